@@ -0,0 +1,23 @@
+# Feed the documents of a short XAS scan, with baseline readings, to
+# tele.callback.  This should store one row with npoints == 3 in a
+# scratch telemetry index.
+
+import os, tempfile, uuid
+
+saved, tele.index = tele.index, os.path.join(tempfile.mkdtemp(), 'telemetry.sqlite')
+run, primary, baseline = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+start = {'uid': run, 'time': 1000.0, 'num_points': 3,
+         'XDI': {'_kind': 'xafs', '_mode': ['transmission'], 'Element': {'symbol': 'Fe', 'edge': 'K'}, 'Mono': {'name': 'Si(111)'}}}
+tele.callback('start', start)
+tele.callback('descriptor', {'uid': baseline, 'run_start': run, 'name': 'baseline'})
+tele.callback('descriptor', {'uid': primary,  'run_start': run, 'name': 'primary'})
+tele.callback('event', {'descriptor': baseline, 'data': {'xafs_x': 0}})
+for energy in (7000, 7100, 7200):
+    tele.callback('event', {'descriptor': primary, 'data': {'dwti_dwell_time': 1.0, 'dcm_energy': energy}})
+tele.callback('event', {'descriptor': baseline, 'data': {'xafs_x': 0}})
+tele.callback('stop', {'run_start': run, 'time': 1005.0})
+tele.writer.join()
+
+rows = [r for r in tele.select() if r['uid'] == run]
+assert len(rows) == 1 and rows[0]['npoints'] == 3 and rows[0]['measurement'] == 3.0, rows
+tele.index = saved
@@ -26,7 +26,7 @@ from BMM.attic.derivedplot       import DerivedPlot, interpret_click, close_all_
 from BMM.suspenders        import BMM_suspenders, BMM_clear_to_start, BMM_clear_suspenders
 from BMM.workspace         import rkvs
 
-from BMM.user_ns.base      import bmm_catalog
+from BMM.user_ns.base      import bmm_catalog, tiled_writer
 from BMM.user_ns.bmm       import BMMuser
 from BMM.user_ns.dwelltime import _locked_dwell_time
 from BMM.user_ns.detectors import quadem1, xs, xs1, xs4, xs7, ic0, ic1, ic2, ION_CHAMBERS
@@ -229,7 +229,7 @@ def areascan(detector,
         db = user_ns['db']
         BMM_clear_suspenders()
         if BMMuser.final_log_entry is True:
-            if is_re_worker_active() is False:
+            if is_re_worker_active() is False and tiled_writer.wait():
                 BMM_log_info('areascan finished\n\tuid = %s, scan_id = %d' % (bmm_catalog[-1].metadata['start']['uid'],
                                                                               bmm_catalog[-1].metadata['start']['scan_id']))
         yield from resting_state_plan()
@@ -23,8 +23,8 @@ from ophyd import Component as C
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 
 import matplotlib.pyplot as plt
-import numpy, xraylib
-from BMM.periodictable import Z_number, edge_number
+import numpy
+from BMM.periodictable import Z_number, edge_number, line_energy
 
 ###########################################################################
 # ______  ___   _   _ _____ _____              ___   _____________ _____  #
@@ -391,17 +391,16 @@ class BMMDante(DetectorBase):
             z = Z_number(BMMuser.element)
             if BMMuser.edge.lower() == 'k':
                 label = f'{BMMuser.element} Kα1'
-                ke = (2*xraylib.LineEnergy(z, xraylib.KL3_LINE) + xraylib.LineEnergy(z, xraylib.KL2_LINE))*1000/3
-                plt.axvline(x = ke/1.0016,  color = 'brown', linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'K')/1.0016,  color = 'brown', linewidth=1, label=label)
             elif BMMuser.edge.lower() == 'l3':
                 label = f'{BMMuser.element} Lα1'
-                plt.axvline(x = xraylib.LineEnergy(z, xraylib.L3M5_LINE)*1000, color = 'brown', linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'L3'), color = 'brown', linewidth=1, label=label)
             elif BMMuser.edge.lower() == 'l2':
                 label = f'{BMMuser.element} Kβ1'
-                plt.axvline(x = xraylib.LineEnergy(z, xraylib.L2M4_LINE)*1000, color = 'brown', linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'L2'), color = 'brown', linewidth=1, label=label)
             elif BMMuser.edge.lower() == 'l1':
                 label = f'{BMMuser.element} Kβ3'
-                plt.axvline(x = xraylib.LineEnergy(z, xraylib.L1M3_LINE)*1000, color = 'brown', linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'L1'), color = 'brown', linewidth=1, label=label)
             plt.legend()
             #plt.show()
 
@@ -6,11 +6,11 @@ from urllib.parse import quote
 import numpy
 
 from bluesky.plans import count
-from bluesky.plan_stubs import sleep, mv, null
+from bluesky.plan_stubs import sleep, mv, null, trigger, create, read, save, wait, rd
+import bluesky.preprocessors as bpp
 
 import matplotlib
 import matplotlib.pyplot as plt
-from larch.io import create_athena
 
 from PIL import Image
 
@@ -46,6 +46,69 @@ def lims(toggle='on'):
         user_ns['BMMuser'].snapshots = True
         user_ns['BMMuser'].htmlout   = True
         
+
+def concurrent_count(detectors, timeouts=None, repeat=None, md=None):
+    '''Trigger several detectors at once and record them in a single
+    event of a single run.
+
+    A detector which has not finished within its timeout is left out
+    of the event rather than holding up the others.  The detectors are
+    waited for by the RunEngine, in order of their timeouts, so a
+    pause does not count against a detector and a simulated RunEngine
+    keeps its own time.
+
+    arguments
+    =========
+    detectors: (list)
+      the devices to trigger and read
+
+    timeouts: (dict)
+      device name : seconds to wait for that device [10]
+
+    repeat: (dict)
+      device name : number of times to trigger that device, only the
+      last of which is recorded [1]
+
+    md: (dict)
+      metadata for the start document
+
+    Return the UID of the run, a list of the names of detectors which
+    did not finish, and the duration of the run in seconds, from its
+    start and stop documents.
+    '''
+    timeouts = timeouts or dict()
+    repeat = repeat or dict()
+    missed = []
+    times = dict()
+
+    def clock(name, doc):
+        if name in ('start', 'stop'):
+            times[name] = doc['time']
+
+    @bpp.subs_decorator(clock)
+    @bpp.stage_decorator(detectors)
+    @bpp.run_decorator(md=md)
+    def main_plan():
+        status = dict()
+        for det in detectors:
+            status[det.name] = yield from trigger(det, group=det.name)
+        for det in sorted(detectors, key=lambda d: timeouts.get(d.name, 10)):
+            for attempt in range(repeat.get(det.name, 1)):
+                if attempt > 0:
+                    status[det.name] = yield from trigger(det, group=det.name)
+                yield from wait(group=det.name, timeout=timeouts.get(det.name, 10), error_on_timeout=False)
+                if not status[det.name].done:
+                    missed.append(det.name)
+                    break
+        yield from create('primary')
+        for det in detectors:
+            if det.name not in missed:
+                yield from read(det)
+        yield from save()
+
+    uid = yield from main_plan()
+    return uid, missed, times.get('stop', 0) - times.get('start', 0)
+
     
 class DossierTools():
     '''A class for aiding in generation of a static HTML file for
@@ -84,6 +147,10 @@ class DossierTools():
       stringification of the OCR values from the XRF exposure
     rois : str
       stringification of the ROI values from the XRF exposure
+    snapshot_time : float
+      seconds taken by the most recent set of snapshots
+    camera_timeouts : dict
+      seconds to wait for each camera (and the XRF exposure) before leaving it out of the snapshots
 
     methods
     =======
@@ -149,6 +216,9 @@ class DossierTools():
     ocrs          = ''
     rois          = ''
 
+    snapshot_time = 0
+    camera_timeouts = {'webcam': 10, 'anacam': 15, 'usbcam1': 10, 'usbcam2': 10, 'xrf': 10}
+
     npoints       = 0
     dwell         = 0
     delay         = 0
@@ -160,39 +230,50 @@ class DossierTools():
     def capture_xrf(self, stub, mode, md):
         '''Capture an XRF spectrum and related metadata at the current energy
         '''
-        
-        BMMuser, xs, xs1, dcm = user_ns['BMMuser'], user_ns['xs'], user_ns['xs1'], user_ns['dcm']
+        if mode == 'dante':
+            dcm, dante = user_ns['dcm'], user_ns['dante']
+            self.xrf_names(stub, md)
+            report(f'measuring an XRF spectrum at {dcm.energy.position:.1f} (Dante)', 'bold')
+            yield from mv(dante.total_points, 1)
+            yield from mv(dante.cam.acquire_time, 1)
+            self.xrfuid = yield from count([dante], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata XRF'})
+        elif mode in ('fluorescence', 'yield', 'pilatus'):
+            xs = yield from self.prepare_xrf(stub, mode, md)
+            self.xrfuid = yield from count([xs], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata XRF'})
+        self.report_xrf()
 
+    def xrf_names(self, stub, md):
+        BMMuser, dcm = user_ns['BMMuser'], user_ns['dcm']
         thisagg = matplotlib.get_backend()
         matplotlib.use('Agg') # produce a plot without screen display
         ahora = now()
         self.xrffile = "%s_%s.xrf" % (stub, ahora)
         self.xrfsnap = "%s_XRF_%s.png" % (stub, ahora)
-        #xrffile  = os.path.join('XRF', self.xrffile)
-        #xrfimage = os.path.join('XRF', self.xrfsnap)
         md['_xrffile']  = self.xrffile
         md['_xrfimage'] = self.xrfsnap
         md['_pccenergy'] = f'{dcm.energy.position:.2f}'
         md['_user'] = dict()
         md['_user']['startdate'] = BMMuser.date
 
-        #print(stub, mode)
-        if mode == 'dante':
-            report(f'measuring an XRF spectrum at {dcm.energy.position:.1f} (Dante)', 'bold')
-            yield from mv(dante.total_points, 1)
-            yield from mv(dante.cam.acquire_time, 1)
-            self.xrfuid = yield from count([dante], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata XRF'})
-        elif mode in ('fluorescence', 'yield', 'pilatus'):
-            report(f'measuring an XRF spectrum at {dcm.energy.position:.1f} ({xs.name})', 'bold')
-            yield from mv(xs.total_points, 1)
-            yield from mv(xs.cam.acquire_time, 1)
-            self.xrfuid = yield from count([xs], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata XRF'})
-
+    def prepare_xrf(self, stub, mode, md):
+        '''Set up the Xspress3 for a single 1 second XRF exposure and
+        return it.  Used by capture_xrf and by cameras, which captures
+        the XRF spectrum at the same time as the camera images.'''
+        xs, dcm = user_ns['xs'], user_ns['dcm']
+        self.xrf_names(stub, md)
+        report(f'measuring an XRF spectrum at {dcm.energy.position:.1f} ({xs.name})', 'bold')
+        yield from mv(xs.total_points, 1)
+        yield from mv(xs.cam.acquire_time, 1)
+        return xs
+
+    def report_xrf(self):
+        '''Ask the kafka workers to plot and save the XRF spectrum and
+        capture its metadata for the dossier.'''
         kafka_message({'xrf' : 'plot',
                        'uid' : self.xrfuid,
                        'add' : False,
                        'filename' : self.xrfsnap,
-                       'post' : BMMuser.post_xrf, })
+                       'post' : user_ns['BMMuser'].post_xrf, })
         kafka_message({'xrf' : 'write',
                        'uid' : self.xrfuid,
                        'filename' : self.xrffile, })
@@ -203,99 +284,98 @@ class DossierTools():
 
         ### --- capture metadata for dossier -----------------------------------------------
         self.xrf_md = {'xrf_uid'   : self.xrfuid, 'xrf_image': self.xrfsnap,}
-                       
-        
 
-    def cameras(self, folder, stub, md):
+    def cameras(self, folder, stub, md, xrf=None):
         '''For each camera in use at the beamline, capture and image and record relevant
-        metadata (UID, filename) for dossier creation
+        metadata (UID, filename) for dossier creation.
+
+        All cameras are triggered at once and recorded in a single
+        event of a single run, so the time taken is that of the
+        slowest camera rather than the sum over all cameras.  A camera
+        which does not finish within its timeout (see
+        self.camera_timeouts) is left out of the record rather than
+        holding up the others.
+
+        If xrf is one of fluorescence, yield, or pilatus, the XRF
+        spectrum is captured by the Xspress3 in the same event (see
+        capture_xrf).
         '''
         ahora = now()
         BMMuser, xascam, anacam, usb1, usb2 = user_ns['BMMuser'], user_ns['xascam'], user_ns['anacam'], user_ns['usb1'], user_ns['usb2']
-        image_ana, image_web, image_usb1, image_usb2 = '','','',''
-        anauid, webuid, usb1uid, usb2uid = '','','',''
-        anasnap, websnap, usb1snap, usb2snap = '','','',''
-        
-        ### --- XAS webcam ---------------------------------------------------------------
-        annotation = stub
-        websnap = "%s_XASwebcam_%s.jpg" % (stub, ahora)
-        image_web = os.path.join(folder, 'snapshots', websnap)
-        md['_filename'] = image_web
-        xascam._annotation_string = annotation
+        websnap  = "%s_XASwebcam_%s.jpg" % (stub, ahora)
+        anasnap  = "%s_analog_%s.jpg" % (stub, ahora)
+        usb1snap = "%s_usb1_%s.jpg" % (stub, ahora)
+        usb2snap = "%s_usb2_%s.jpg" % (stub, ahora)
+
+        ## (key in cameras_md, device, snapshot filename, Slack post flag, copy from device's file rather than run)
+        snaps = []
         if with_webcam is True:
-            bold_msg('XAS webcam snapshot')
-            webuid = yield from count([xascam], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-            self.websnap, self.webuid = websnap, webuid
-            kafka_message({'copy': True,
-                           'uuid': webuid,
-                           'target': os.path.join(proposal_base(), 'snapshots', websnap), })
-
-            if BMMuser.post_webcam:
-                kafka_message({'echoslack': True,
-                               'img': os.path.join(proposal_base(), 'snapshots', websnap)})
-
-        ### --- analog camera using redgo dongle ------------------------------------------
-        ###     this can only be read by a client on xf06bm-ws3, so... not QS on srv1
-        # thishost = socket.gethostname()
-        # if is_re_worker_active() is False and 'ws3' in thishost:
+            xascam._annotation_string = stub
+            snaps.append(('webcam', xascam, websnap, BMMuser.post_webcam, False))
+        ###     the analog camera can only be read by a client on xf06bm-ws3, so... not QS on srv1
         if with_anacam and anacam is not None:
-            pass
-            whisper('The error text below saying "Error opening file for output:"')
-            whisper('happens every time and does not indicate a problem of any sort.')
-            anasnap = "%s_analog_%s.jpg" % (stub, ahora)
-            image_ana = os.path.join(folder, 'snapshots', anasnap)
-            md['_filename'] = image_ana
             anacam._annotation_string = stub
-            bold_msg('analog camera snapshot')
-            anauid = yield from count([anacam], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-            localfile = os.path.join(anacam._root, anacam._rel_path_template % 0)
-            whisper('The error text above saying "Error opening file for output:"')
-            whisper('happens every time and does not indicate a problem of any sort.\n')
-            self.anasnap, self.anauid = anasnap, anauid
-            kafka_message({'copy': True,
-                           'file': localfile,
-                           'target': os.path.join(proposal_base(), 'snapshots', anasnap), })
-            if BMMuser.post_anacam:
-                kafka_message({'echoslack': True,
-                               'img': os.path.join(proposal_base(), 'snapshots', anasnap)})
-
-            
-        ### --- USB camera #1 --------------------------------------------------------------
+            snaps.append(('anacam', anacam, anasnap, BMMuser.post_anacam, True))
         if with_cam1 is True:
-            usb1snap = "%s_usb1_%s.jpg" % (stub, ahora)
-            image_usb1 = os.path.join(folder, 'snapshots', usb1snap)
-            md['_filename'] = image_usb1
-            #usbcam1._annotation_string = stub
-            bold_msg('USB camera #1 snapshot')
-            yield from count([usb1], 1, md={'throwaway': 1})  # this camera often captures incomplete images on the first stab
-                                                              # this is a throwaway image in hopes of capturing a good one
-            usb1uid = yield from count([usb1], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-            self.usb1snap, self.usb1uid = usb1snap, usb1uid
-            kafka_message({'copy': True,
-                           'uuid': usb1uid,
-                           'target': os.path.join(proposal_base(), 'snapshots', usb1snap), })
-            if BMMuser.post_usbcam1:
-                kafka_message({'echoslack': True,
-                               'img': os.path.join(proposal_base(), 'snapshots', usb1snap)})
-
-        ### --- USB camera #2 --------------------------------------------------------------
+            snaps.append(('usbcam1', usb1, usb1snap, BMMuser.post_usbcam1, False))
         if with_cam2 is True:
-            usb2snap = "%s_usb2_%s.jpg" % (stub, ahora)
-            image_usb2 = os.path.join(folder, 'snapshots', usb2snap)
-            md['_filename'] = image_usb2
-            #usbcam2._annotation_string = stub
-            bold_msg('USB camera #2 snapshot')
-            usb2uid = yield from count([usb2], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-            self.usb2snap, self.usb2uid = usb2snap, usb2uid
-            kafka_message({'copy': True,
-                           'uuid': usb2uid,
-                           'target': os.path.join(proposal_base(), 'snapshots', usb2snap), })
-            if BMMuser.post_usbcam2:
-                kafka_message({'echoslack': True,
-                               'img': os.path.join(proposal_base(), 'snapshots', usb2snap)})
-       
+            snaps.append(('usbcam2', usb2, usb2snap, BMMuser.post_usbcam2, False))
+        detectors = [s[1] for s in snaps]
+        timeouts = {s[1].name: self.camera_timeouts.get(s[0], 10) for s in snaps}
+        if xrf is not None:
+            xs = yield from self.prepare_xrf(stub, xrf, md)
+            detectors.append(xs)
+            acquire_time = yield from rd(xs.cam.acquire_time)
+            timeouts[xs.name] = acquire_time + self.camera_timeouts.get('xrf', 10)
+        self.websnap, self.webuid, self.anasnap, self.anauid = '', '', '', ''
+        self.usb1snap, self.usb1uid, self.usb2snap, self.usb2uid = '', '', '', ''
+        self.snapshot_time = 0
+        if len(detectors) > 0:
+            files = {s[0]: os.path.join(folder, 'snapshots', s[2]) for s in snaps}
+            bold_msg(f'snapshots: {", ".join(d.name for d in detectors)}')
+            if anacam in detectors:
+                whisper('The error text below saying "Error opening file for output:"')
+                whisper('happens every time and does not indicate a problem of any sort.')
+            ## USB camera #1 often captures incomplete images on the first stab,
+            ## so it is triggered twice, only the second image is recorded
+            uid, missed, self.snapshot_time = yield from concurrent_count(detectors, timeouts=timeouts, repeat={usb1.name: 2} if usb1 is not None else None,
+                                                                          md = {'XDI':{**md, '_filenames': files}, 'plan_name' : 'count xafs_metadata snapshot'})
+            if anacam in detectors:
+                whisper('The error text above saying "Error opening file for output:"')
+                whisper('happens every time and does not indicate a problem of any sort.\n')
+            for name in missed:
+                report(f'{name} did not finish within {timeouts[name]:.0f} seconds and was left out of the snapshots', level='warning')
+
+            for key, device, snap, post, from_file in snaps:
+                if device.name in missed:
+                    continue
+                if key == 'webcam':
+                    self.websnap, self.webuid = snap, uid
+                elif key == 'anacam':
+                    self.anasnap, self.anauid = snap, uid
+                elif key == 'usbcam1':
+                    self.usb1snap, self.usb1uid = snap, uid
+                elif key == 'usbcam2':
+                    self.usb2snap, self.usb2uid = snap, uid
+                if from_file:
+                    kafka_message({'copy': True,
+                                   'file': os.path.join(device._root, device._rel_path_template % 0),
+                                   'target': os.path.join(proposal_base(), 'snapshots', snap), })
+                else:
+                    kafka_message({'copy': True,
+                                   'uuid': uid,
+                                   'device': device.name,
+                                   'target': os.path.join(proposal_base(), 'snapshots', snap), })
+                if post:
+                    kafka_message({'echoslack': True,
+                                   'img': os.path.join(proposal_base(), 'snapshots', snap)})
+            if xrf is not None and xs.name not in missed:
+                self.xrfuid = uid
+                self.report_xrf()
+
         ### --- capture metadata for dossier -----------------------------------------------
-        self.cameras_md = {'webcam_file': websnap,  'webcam_uid': webuid,
-                           'analog_file': anasnap,  'anacam_uid': anauid,
-                           'usb1_file':   usb1snap, 'usbcam1_uid': usb1uid,
-                           'usb2_file':   usb2snap, 'usbcam2_uid': usb2uid, }
+        self.cameras_md = {'webcam_file': self.websnap,  'webcam_uid': self.webuid,
+                           'analog_file': self.anasnap,  'anacam_uid': self.anauid,
+                           'usb1_file':   self.usb1snap, 'usbcam1_uid': self.usb1uid,
+                           'usb2_file':   self.usb2snap, 'usbcam2_uid': self.usb2uid,
+                           'snapshot_time': round(self.snapshot_time, 2), }
@@ -2,16 +2,18 @@ from ophyd import PVPositionerPC, EpicsSignal, EpicsSignalRO, PseudoPositioner,
 from ophyd import Component as Cpt
 from ophyd.pseudopos import (pseudo_position_argument, real_position_argument)
 
+from BMM.set_on_change import SetOnChange
+
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
 
 
 
-class QuadEMDwellTime(PVPositionerPC):
+class QuadEMDwellTime(SetOnChange, PVPositionerPC):
     setpoint = Cpt(EpicsSignal,   'AveragingTime')
     readback = Cpt(EpicsSignalRO, 'AveragingTime_RBV')
 
-class StruckDwellTime(PVPositionerPC):
+class StruckDwellTime(SetOnChange, PVPositionerPC):
     setpoint = Cpt(EpicsSignal,   'TP')
     readback = Cpt(EpicsSignalRO, 'TP')
 
@@ -28,20 +30,20 @@ class IC2DwellTime(QuadEMDwellTime):
     ...
 
     
-class Xspress3DwellTime(PVPositionerPC):
+class Xspress3DwellTime(SetOnChange, PVPositionerPC):
     setpoint = Cpt(EpicsSignal,   'det1:AcquireTime')
     readback = Cpt(EpicsSignalRO, 'det1:AcquireTime_RBV')
 
 
-class PilatusDwellTime(PVPositionerPC):
+class PilatusDwellTime(SetOnChange, PVPositionerPC):
     setpoint = Cpt(EpicsSignal,   'cam1:AcquireTime')
     readback = Cpt(EpicsSignalRO, 'cam1:AcquireTime_RBV')
 
-class EigerDwellTime(PVPositionerPC):
+class EigerDwellTime(SetOnChange, PVPositionerPC):
     setpoint = Cpt(EpicsSignal,   'cam1:AcquireTime')
     readback = Cpt(EpicsSignalRO, 'cam1:AcquireTime_RBV')
 
-class DanteDwellTime(PVPositionerPC):
+class DanteDwellTime(SetOnChange, PVPositionerPC):
     setpoint = Cpt(EpicsSignal,   'dante:PresetReal')
     readback = Cpt(EpicsSignalRO, 'dante:PresetReal')
 
@@ -73,6 +75,12 @@ class LockedDwellTimes(PseudoPositioner):
     just above and used to set attributes of the class.  In this way,
     only the enabled signal chains will be set, but ALL of the enabled
     signal chains will be set.
+
+    Each signal chain remembers the value it was last set to and skips
+    the put (and the settle time) when asked for the same value again,
+    see BMM.set_on_change.  Use forget() to force every chain to be
+    written on the next move, and put_report() to see how many puts
+    were made and skipped.
     '''
     dwell_time = Cpt(PseudoSingle, kind='hinted')
     if with_quadem is True:
@@ -125,6 +133,28 @@ class LockedDwellTimes(PseudoPositioner):
         #if hasattr(self, 'dualem_dwell_time'):
         #    self.dualem_dwell_time.settle_time = val
 
+    @property
+    def chains(self):
+        '''Names of the enabled signal chains.'''
+        return [c for c in self.component_names if c.endswith('_dwell_time') and c != 'dwell_time']
+
+    def forget(self):
+        for c in self.chains:
+            getattr(self, c).forget()
+
+    def reset_counts(self):
+        for c in self.chains:
+            getattr(self, c).reset_counts()
+
+    def put_report(self):
+        '''Return a table of puts made, puts skipped, and time spent
+        moving for each signal chain since reset_counts.'''
+        text = [f'   {"signal chain":22} {"puts":>6} {"skipped":>8} {"time (s)":>9}']
+        for c in self.chains:
+            chain = getattr(self, c)
+            text.append(f'   {c:22} {chain.puts:6d} {chain.skipped:8d} {chain.put_time:9.2f}')
+        return '\n'.join(text)
+
     @pseudo_position_argument
     def forward(self, pseudo_pos):
         #pseudo_pos = self.PseudoPosition(*pseudo_pos)
@@ -8,7 +8,7 @@ except ImportError:
 import time, json, os
 from rich import print as cprint
 
-from bluesky.plan_stubs import null, sleep, mv, mvr
+from bluesky.plan_stubs import null, mv, mvr
 from bluesky.preprocessors import finalize_wrapper
 
 from BMM.exceptions    import FailedDCMParaException, ArrivedInModeException
@@ -20,6 +20,8 @@ from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg,
 from BMM.kafka         import kafka_message
 from BMM.wheel         import show_reference_wheel
 from BMM.modes         import change_mode, get_mode, pds_motors_ready, MODEDATA
+from BMM.motion        import StepTimer, mv_needed, settle
+from BMM.tuning_cache  import tuning_cache
 from BMM.linescans     import rocking_curve, slit_height, mirror_pitch, wiggle_bct, hcenter
 from BMM.resting_state import resting_state_plan
 from BMM.workspace     import rkvs
@@ -33,6 +35,7 @@ from BMM.user_ns.detectors   import xs, xs1, xs4, xs7
 from BMM.user_ns.dwelltime   import with_xspress3
 from BMM.user_ns.instruments import * #kill_mirror_jacks, m3_ydi, m3_ydo, m3_yu, m3_xd, m3_xu, ks, m2_ydi, m2_ydo, m2_yu
 from BMM.user_ns.motors      import *
+from BMM.user_ns.metadata    import ring
 
 def show_edges():
     show_reference_wheel()
@@ -217,6 +220,11 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=False, mirror=True
     one the energy will be moved to the specified energy xrd=True
     implies focus=True and target=0
 
+    The rocking curve, slit height and mirror pitch scans are skipped or
+    narrowed when a recent outcome for this mode and energy is found in
+    BMM.tuning_cache.  Use tuning_cache.show() to see the cache and
+    tuning_cache.enabled = False to always run the full scans.
+
     '''
 
     def main_plan(el, focus, edge, energy, slits, mirror, tune, target, xrd, bender, insist, no_ref, no_hslits):
@@ -404,6 +412,12 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=False, mirror=True
 
 
         start = time.time()
+        timer = StepTimer()
+        tuning_cache.last.clear()
+        try:
+            ring_current = ring.current.get()
+        except Exception:
+            ring_current = None
         if mode == 'XRD':
             report(f'\nConfiguring beamline for XRD at {energy} eV', level='bold', slack=True)
         else:
@@ -418,24 +432,32 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=False, mirror=True
         # if not calibrating and mode != current_mode:
         #     print('Moving to photon delivery mode %s...' % mode)
         hsize_save = slits3.hsize.position
+        hslits = []             # moved along with the mode change
         if no_hslits is True:
             pass
         elif mode == 'XRD':
-            yield from mv(slits3.hsize, 2)
+            hslits = [slits3.hsize, 2]
         elif mode in ('D', 'E', 'F'):
-            yield from mv(slits3.hsize, 3)
+            hslits = [slits3.hsize, 3]
         elif mode in ('A', 'B', 'C'):
-            yield from mv(slits3.hsize, 0.4)
+            hslits = [slits3.hsize, 0.4]
 
         ## these two instruments involve hijacking the refx and refy motors for other purposes,
         ## so the reference stages should NOT be moved
         if WITH_ENCLOSURE is True or WITH_SALTFURNACE is True:
             no_ref = True
 
-        yield from wiggle_bct()
-        yield from mv(dcm_bragg.acceleration, BMMuser.acc_slow)
-        yield from change_mode(mode=mode, prompt=False, edge=energy+target, reference=el, bender=bender, insist=insist, no_ref=no_ref)
-        yield from mv(dcm_bragg.acceleration, BMMuser.acc_fast)
+        ## change_mode wiggles dm3_bct, skips motors which are already in
+        ## position, and moves everything else, including the reference
+        ## wheel, the mono, and the slits, at once
+        with timer.step('photon delivery mode + mono'):
+            yield from mv(dcm_bragg.acceleration, BMMuser.acc_slow)
+            yield from change_mode(mode=mode, prompt=False, edge=energy+target, reference=el, bender=bender, insist=insist, no_ref=no_ref, also=hslits)
+            ## change_mode may return before moving anything, in which
+            ## case the slits are moved here (and not moved again otherwise)
+            if len(hslits) > 0:
+                yield from mv_needed(*hslits)
+            yield from mv(dcm_bragg.acceleration, BMMuser.acc_fast)
 
         ## verify that dcm_para has arrived in place.  if not, presume
         ## that it has stalled.  back off and try again to move
@@ -470,8 +492,9 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=False, mirror=True
             #yield from null()
             #return
 
-        yield from kill_mirror_jacks()
-        yield from sleep(1)
+        with timer.step('kill mirror jacks'):
+            yield from kill_mirror_jacks()
+            yield from settle(m2.yu, m2.ydo, m2.ydi, m3.yu, m3.ydo, m3.ydi, timeout=1)
         if BMMuser.motor_fault is not None:
             print('\n')
             report(f'\nSome motors are reporting amplifier faults: {BMMuser.motor_fault}', level='error', slack=True)
@@ -494,24 +517,28 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=False, mirror=True
         ############################
         if tune:
             print('Optimizing rocking curve...')
-            yield from mv(dcm_pitch.kill_cmd, 1)
-            yield from mv(dcm_pitch, approximate_pitch(energy+target))
-            yield from sleep(1)
-            yield from mv(dcm_pitch.kill_cmd, 1)
-            yield from sleep(1)
-            yield from rocking_curve()
-            kafka_message({'close': 'last'})
+            with timer.step('rocking curve'):
+                yield from mv(dcm_pitch.kill_cmd, 1)
+                yield from mv_needed(dcm_pitch, approximate_pitch(energy+target))
+                yield from settle(dcm_pitch, timeout=1)
+                yield from mv(dcm_pitch.kill_cmd, 1)
+                yield from settle(dcm_pitch, timeout=1)
+                yield from tuning_cache.tune('rocking_curve', dcm_pitch, mode, dcm._crystal, energy+target,
+                                             rocking_curve, ring_current)
+                kafka_message({'close': 'last'})
 
         ##########################
         # run a slit height scan #
         ##########################
         if slits:
             print('Optimizing slits height...')
-            ok = yield from wiggle_bct()
-            if ok is False:
-                return(yield from null())
-            yield from slit_height(move=True)
-            kafka_message({'close': 'last'})
+            with timer.step('slit height'):
+                ok = yield from wiggle_bct()
+                if ok is False:
+                    return(yield from null())
+                yield from tuning_cache.tune('slit_height', dm3_bct, mode, dcm._crystal, energy+target,
+                                             lambda **kw: slit_height(move=True, **kw), ring_current)
+                kafka_message({'close': 'last'})
 
         ###########################
         # run a mirror pitch scan #
@@ -522,14 +549,17 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=False, mirror=True
             else:
                 mirror = 'm3'
             print(f'Optimizing {mirror} pitch...')
-            yield from mirror_pitch(mirror=mirror, move=True)
-            kafka_message({'close': 'last'})
+            with timer.step(f'{mirror} pitch'):
+                yield from tuning_cache.tune(f'mirror_pitch_{mirror}', m2.yu if mirror == 'm2' else m3.yu, mode, dcm._crystal, energy+target,
+                                             lambda **kw: mirror_pitch(mirror=mirror, move=True, **kw), ring_current)
+                kafka_message({'close': 'last'})
 
 
         if mode in ('A', 'B', 'C'):
             if no_hslits is False:
-                yield from hcenter(move=True)
-                kafka_message({'close': 'last'})
+                with timer.step('horizontal centering'):
+                    yield from hcenter(move=True)
+                    kafka_message({'close': 'last'})
             
         ##################################
         # set reference and roi channels #
@@ -539,20 +569,23 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=False, mirror=True
         print('Moving reference foil...')
         #yield from rois.select_plan(el)   # DEPRECATED
         ## Xspress3
-        if with_xspress3:
-            BMMuser.verify_roi(xs, el, edge)
-            BMMuser.verify_roi(xs1, el, edge)
-            #BMMuser.verify_roi(xs7, el, edge)
-        ## feedback
-        show_edges()
-
+        with timer.step('ROIs + slits'):
+            if with_xspress3:
+                BMMuser.verify_roi(xs, el, edge)
+                BMMuser.verify_roi(xs1, el, edge)
+                #BMMuser.verify_roi(xs7, el, edge)
+            ## feedback
+            show_edges()
+
+            if mode == 'XRD':
+                yield from mv_needed(slits3.hsize, 7)
+            elif no_hslits is False:
+                yield from mv_needed(slits3.hsize, hsize_save)
+        whisper(timer.report('change_edge step'))
+        BMM_log_info(f'change_edge timing:\n{timer.report("change_edge step")}')
         if mode == 'XRD':
-            yield from mv(slits3.hsize, 7)
             report('Finished configuring for XRD', level='bold', slack=True)
         else:
-            #if mode in ('D', 'E', 'F'):
-            if no_hslits is False:
-                yield from mv(slits3.hsize, hsize_save)
             report(f'Finished configuring for {el.capitalize()} {edge.capitalize()} edge, now in photon delivery mode {get_mode()}', level='bold', slack=True)
         # if slits is False:
         #     print('  * You may need to verify the slit position:  RE(slit_height())')
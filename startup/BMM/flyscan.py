@@ -0,0 +1,278 @@
+'''Continuous, or "on the fly", energy scans for XAFS.
+
+In a step scan (scan_nd in BMM.xafs.xafs), each point of the energy
+grid is a separate move of the mono and a separate trigger of the
+detectors, so every point pays for mono settling, electrometer
+re-arming, and a round of event documents.
+
+In a fly scan, dcm_bragg moves continuously through the energy grid,
+divided into segments over which the speed of the mono is nearly
+constant.  The speed is chosen so that the mono crosses each point's
+share of the grid in that point's dwell time.  The electrometers and
+the Xspress3 free-run with a short frame time while the mono moves,
+and every frame is recorded along with its timestamp, as is every
+update of the Bragg angle readback.  Once the mono stops, the frames
+are binned onto the energy grid and written to the primary stream, one
+event per grid point, using the same data keys as a step scan.  Thus
+the XDI file, the dossier, the live plots, and the data evaluation
+work just as they do for a step scan.
+
+Nothing in this module depends on the bsui profile.  Devices are
+handed to fly_energy_scan, so it can be run against simulated ophyd
+devices (see tools/flyscan_benchmark.py).
+
+'''
+import numpy
+
+from ophyd import Signal
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+from bluesky.plan_stubs import mv
+
+HBARC                = 1973.27053324   # as in BMM.functions, which needs the profile
+FLY_FRAME_TIME       = 0.1      # seconds per detector frame while flying
+FLY_TOLERANCE        = 0.15     # fractional change in speed which starts a new segment
+FLY_MINIMUM_SPEED    = 1e-4     # degrees per second
+FLY_SEGMENT_OVERHEAD = 1.5      # seconds to change speed and accelerate at each segment
+
+
+def energy_to_angle(energy, twod):
+    '''Bragg angle in degrees for an energy (or array of energies) in eV.'''
+    return numpy.degrees(numpy.arcsin(2*numpy.pi*HBARC / (twod*numpy.asarray(energy, dtype=float))))
+
+
+def angle_to_energy(angle, twod):
+    '''Energy in eV for a Bragg angle (or array of angles) in degrees.'''
+    return 2*numpy.pi*HBARC / (twod*numpy.sin(numpy.radians(numpy.asarray(angle, dtype=float))))
+
+
+def bin_edges(grid):
+    '''Boundaries of the bins around the points of an energy grid: the
+    midpoints between neighboring points plus a half step beyond each
+    end.  The grid may run in either direction.'''
+    grid = numpy.asarray(grid, dtype=float)
+    middle = (grid[1:] + grid[:-1]) / 2
+    return numpy.concatenate(([2*grid[0]-middle[0]], middle, [2*grid[-1]-middle[-1]]))
+
+
+def fly_segments(grid, timegrid, twod, tolerance=FLY_TOLERANCE, vmin=FLY_MINIMUM_SPEED, vmax=None):
+    '''Divide an energy grid into segments, each of which is flown at a
+    constant speed of dcm_bragg.
+
+    Parameters
+    ----------
+    grid : list of float
+        energy grid, as from conventional_grid
+    timegrid : list of float
+        dwell time at each point of the energy grid
+    twod : float
+        2d spacing of the mono crystal
+    tolerance : float
+        fractional change in speed at which a new segment is started
+    vmin, vmax : float
+        limits on the speed of dcm_bragg in degrees per second
+
+    Output
+    ------
+    list of (start angle, end angle, speed, first point, last point + 1)
+
+    '''
+    angles = energy_to_angle(bin_edges(grid), twod)
+    speeds = numpy.abs(numpy.diff(angles)) / numpy.asarray(timegrid, dtype=float)
+    segments, first = [], 0
+    for i in range(1, len(grid)+1):
+        if i < len(grid) and abs(speeds[i]-speeds[first]) <= tolerance*speeds[first]:
+            continue
+        speed = abs(angles[i]-angles[first]) / sum(timegrid[first:i])
+        speed = max(speed, vmin)
+        if vmax is not None:
+            speed = min(speed, vmax)
+        segments.append((angles[first], angles[i], speed, first, i))
+        first = i
+    return segments
+
+
+def fly_time(grid, timegrid, twod, **kwargs):
+    '''Approximate time in seconds to fly through an energy grid.'''
+    segments = fly_segments(grid, timegrid, twod, **kwargs)
+    return sum(abs(end-start)/speed for start, end, speed, i, j in segments) + FLY_SEGMENT_OVERHEAD*len(segments)
+
+
+def bin_frames(grid, bragg, frames, twod, frame_time=FLY_FRAME_TIME):
+    '''Bin time-stamped detector frames onto an energy grid.
+
+    Parameters
+    ----------
+    grid : list of float
+        energy grid
+    bragg : (array, array)
+        timestamps and values of the Bragg angle readback
+    frames : dict
+        data key : (timestamps, values) for each detector signal
+    twod : float
+        2d spacing of the mono crystal
+    frame_time : float
+        length in seconds of a detector frame
+
+    Each frame is placed at the mono position at the middle of the
+    frame, i.e. half a frame before its timestamp.  A bin which
+    received no frames (which only happens if the mono was moving too
+    fast to keep up with the grid) is interpolated from its neighbors.
+
+    Output
+    ------
+    dict of data key : array of mean frame value in each bin, plus
+      'dcm_energy' : average energy of the frames in each bin
+      'nframes'    : number of frames of the first signal in each bin
+
+    '''
+    grid    = numpy.asarray(grid, dtype=float)
+    edges   = bin_edges(grid)
+    times   = numpy.asarray(bragg[0], dtype=float)
+    order   = numpy.argsort(times)
+    times, angles = times[order], numpy.asarray(bragg[1], dtype=float)[order]
+    binned  = dict()
+    for key, (stamps, values) in frames.items():
+        stamps = numpy.asarray(stamps, dtype=float)
+        values = numpy.asarray(values, dtype=float)
+        energy = angle_to_energy(numpy.interp(stamps - frame_time/2, times, angles), twod)
+        which  = numpy.digitize(energy, edges) - 1
+        inside = (which >= 0) & (which < len(grid))
+        counts = numpy.bincount(which[inside], minlength=len(grid))
+        sums   = numpy.bincount(which[inside], weights=values[inside], minlength=len(grid))
+        filled = counts > 0
+        mean   = numpy.full(len(grid), numpy.nan)
+        mean[filled] = sums[filled] / counts[filled]
+        if filled.any() and not filled.all():
+            ascending = numpy.argsort(grid[filled])
+            mean[~filled] = numpy.interp(grid[~filled], grid[filled][ascending], mean[filled][ascending])
+        binned[key] = mean
+        if 'dcm_energy' not in binned:
+            esums = numpy.bincount(which[inside], weights=energy[inside], minlength=len(grid))
+            binned['dcm_energy'] = numpy.where(filled, esums/numpy.maximum(counts, 1), grid)
+            binned['nframes']    = counts
+    return binned
+
+
+class FlyBuffer():
+    '''Record every update of a set of signals, with its timestamp,
+    while the mono is flying.
+
+    attributes
+    ==========
+    signals: (dict)
+      data key : ophyd signal
+
+    data: (dict)
+      data key : ([timestamps], [values])
+
+    '''
+    def __init__(self, signals):
+        self.signals = signals
+        self.data    = {k: ([], []) for k in signals}
+        self.tokens  = dict()
+
+    def start(self):
+        for key, signal in self.signals.items():
+            self.data[key] = ([], [])
+            self.tokens[key] = signal.subscribe(self.recorder(key), event_type=signal.SUB_VALUE, run=False)
+
+    def stop(self):
+        for key, token in self.tokens.items():
+            self.signals[key].unsubscribe(token)
+        self.tokens = dict()
+
+    def seed(self, key):
+        '''Record the present value of a signal, e.g. the mono position before it starts moving.'''
+        reading = self.signals[key].read()[self.signals[key].name]
+        self.data[key][0].append(reading['timestamp'])
+        self.data[key][1].append(reading['value'])
+
+    def recorder(self, key):
+        stamps, values = self.data[key]
+        def record(value=None, timestamp=None, **kwargs):
+            stamps.append(timestamp)
+            values.append(value)
+        return record
+
+    def arrays(self, key):
+        return(numpy.array(self.data[key][0]), numpy.array(self.data[key][1]))
+
+
+def fly_energy_scan(grid, timegrid, *, bragg, twod, signals, md=None, frame_time=FLY_FRAME_TIME,
+                    prepare=None, restore=None, vmax=None):
+    '''Measure an XAFS scan while moving the mono continuously through
+    the energy grid.  Return the UID of the run.
+
+    Parameters
+    ----------
+    grid, timegrid : list of float
+        energy and dwell time grids, as from conventional_grid
+    bragg : ophyd motor
+        the Bragg axis of the mono, with user_readback and velocity
+    twod : float
+        2d spacing of the mono crystal
+    signals : dict
+        data key : (signal, kind) for each detector channel, where kind
+        is 'current' for an electrometer (scaled like BMM.electrometer.Nanoize)
+        or 'counts' for an Xspress3 ROI (scaled to counts in the dwell time)
+    md : dict
+        start document metadata
+    frame_time : float
+        detector frame time in seconds while flying
+    prepare, restore : callable
+        return plans which put the detectors into and out of free-running mode
+    vmax : float
+        top speed of dcm_bragg, defaults to its current speed
+
+    '''
+    speed    = bragg.velocity.get()
+    if vmax is None:
+        vmax = speed
+    segments = fly_segments(grid, timegrid, twod, vmax=vmax)
+    buffer   = FlyBuffer({'bragg': bragg.user_readback, **{k: s for k, (s, kind) in signals.items()}})
+    columns  = {k: Signal(name=k, value=0.0) for k in ('dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', *signals)}
+    md = dict(md or {})
+    md.setdefault('plan_name', 'fly xafs')
+    md['fly'] = {'frame_time' : frame_time,
+                 'segments'   : [[float(a), float(b), float(v), int(i), int(j)] for a, b, v, i, j in segments], }
+
+    def main_plan():
+        ## park at the outer edge of the first bin at full speed, then fly
+        yield from mv(bragg, segments[0][0])
+        if prepare is not None:
+            yield from prepare()
+        buffer.start()
+        buffer.seed('bragg')
+        for start, end, this, i, j in segments:
+            yield from mv(bragg.velocity, this)
+            yield from mv(bragg, end)
+        buffer.stop()
+        yield from mv(bragg.velocity, speed)
+
+        binned = bin_frames(grid, buffer.arrays('bragg'), {k: buffer.arrays(k) for k in signals}, twod, frame_time)
+        for i, (energy, dwell) in enumerate(zip(grid, timegrid)):
+            columns['dcm_energy'].put(binned['dcm_energy'][i])
+            columns['dcm_energy_setpoint'].put(energy)
+            columns['dwti_dwell_time'].put(binned['nframes'][i]*frame_time)
+            for key, (signal, kind) in signals.items():
+                if kind == 'current':
+                    columns[key].put(binned[key][i] * 1e-9 / dwell)
+                else:
+                    columns[key].put(binned[key][i] * dwell / frame_time)
+            yield from bps.create('primary')
+            for c in columns.values():
+                yield from bps.read(c)
+            yield from bps.save()
+
+    def cleanup_plan():
+        buffer.stop()
+        yield from mv(bragg.velocity, speed)
+        if restore is not None:
+            yield from restore()
+
+    @bpp.run_decorator(md=md)
+    def fly_run():
+        yield from bpp.finalize_wrapper(main_plan(), cleanup_plan())
+
+    return (yield from fly_run())
@@ -89,9 +89,13 @@ def colored(text, tint='white', attrs=[], end=None):
     else:
         print(text)
         
+STARTUP_STEPS = []              # (label, monotonic time) of each run_report, see startup_report
+
 def run_report(thisfile, text=None):
     '''
-    Noisily proclaim to be importing a file of python code.
+    Noisily proclaim to be importing a file of python code.  The time
+    of each report is noted so that startup_report can say where the
+    time went when starting bsui.
     '''
     add = '...'
     prepend = ''
@@ -101,8 +105,35 @@ def run_report(thisfile, text=None):
     importing = 'Importing'
     if thisfile[0] == '\t':
         importing = '\t'
+    STARTUP_STEPS.append((f'{prepend}{thisfile.split("/")[-1]}'.strip(), time.monotonic()))
     colored(f'{importing} {prepend}{thisfile.split("/")[-1]} {add}', 'cyan')
 
+def startup_finished():
+    '''Note the end of the profile and return the number of seconds since
+    the python process started.'''
+    STARTUP_STEPS.append(('end of profile', time.monotonic()))
+    return time.time() - psutil.Process().create_time()
+
+def startup_report(n=15):
+    '''Print the n slowest steps in loading the profile, as marked by
+    run_report.  A step runs from one report to the next.
+
+    Everything imported before BMM.functions (including BMM.user_ns.base,
+    which connects to tiled) is counted as the first step.
+    '''
+    if len(STARTUP_STEPS) < 2:
+        print('No startup steps recorded')
+        return
+    uptime = time.time() - psutil.Process().create_time()
+    first  = uptime - (time.monotonic() - STARTUP_STEPS[0][1])
+    steps  = [('before BMM.functions', first)]
+    steps += [(STARTUP_STEPS[i][0], STARTUP_STEPS[i+1][1] - STARTUP_STEPS[i][1]) for i in range(len(STARTUP_STEPS)-1)]
+    total  = first + STARTUP_STEPS[-1][1] - STARTUP_STEPS[0][1]
+    print(f'{"step":56} {"seconds":>8} {"%":>6}')
+    for label, elapsed in sorted(steps, key=lambda x: x[1], reverse=True)[:n]:
+        print(f'{label[:56]:56} {elapsed:8.2f} {100*elapsed/total:6.1f}')
+    print(f'{"total":56} {total:8.2f}')
+
 
 def error_msg(text, end=None):
     '''Red text'''
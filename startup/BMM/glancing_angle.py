@@ -5,11 +5,11 @@ except ImportError:
     def is_re_worker_active():
         return False
 
-from bluesky.plan_stubs import sleep, mv, mvr, null
-from bluesky.preprocessors import finalize_wrapper
+from bluesky.plan_stubs import mv, mvr, null
+from bluesky.preprocessors import finalize_wrapper, subs_wrapper
 from ophyd import Component as Cpt, EpicsSignal, EpicsSignalRO, Signal, Device
 
-import os, re, shutil, glob, psutil
+import os, re, shutil, glob, psutil, time
 from openpyxl import load_workbook
 import configparser
 import numpy
@@ -18,13 +18,14 @@ from pathlib import Path
 
 from BMM.functions         import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 from BMM.functions         import countdown, isfloat, present_options, now, PROMPT, PROMPTNC, animated_prompt, proposal_base
-from BMM.kafka             import kafka_message
+from BMM.kafka             import kafka_message, kafka_request
 from BMM.logging           import BMM_log_info, BMM_msg_hook, report
 from BMM.linescans         import linescan, prepare_alignment_scan, fetch_peak_position_via_redis
 from BMM.macrobuilder      import BMMMacroBuilder
 from BMM.modes             import get_mode
 from BMM.periodictable     import PERIODIC_TABLE, edge_energy
 from BMM.resting_state     import resting_state_plan
+from BMM.streamfit         import ScanCollector, peak_position, step_center
 from BMM.suspenders        import BMM_suspenders, BMM_clear_to_start, BMM_clear_suspenders
 from BMM.xafs_functions    import conventional_grid
 from BMM.user_ns.dwelltime import _locked_dwell_time
@@ -34,6 +35,16 @@ user_ns = vars(user_ns_module)
 
 from BMM.user_ns.motors  import xafs_garot, xafs_pitch, xafs_x, xafs_y
 
+## auto_align iterates between the linear and pitch scans in transmission
+## until the corrections made by both are smaller than these
+GA_TOLERANCE  = {'linear': 0.02, 'pitch': 0.05}   # mm, degrees
+GA_RANGE      = {'linear': (2.3, 0.6),            # (first, narrowest) half width of a scan
+                 'pitch' : (2.5, 0.8)}
+GA_SHRINK     = 4               # the next scan is this many times wider than the last correction
+GA_NSTEPS     = 51              # steps in the widest scan, narrower scans keep the same step size
+GA_MIN_STEPS  = 21
+GA_MAX_PASSES = 3               # at most this many linear/pitch pairs
+
 class GlancingAngle(Device):
     '''A class capturing the movement and control of the glancing angle
     spinner stage.
@@ -58,6 +69,8 @@ class GlancingAngle(Device):
         The DataBroker UID of the most recent linear against fluorescence scan
     alignment_filename : str
         The fully resolved path to the three-panel, auto-alignment png image
+    timings : list
+        (spinner, number of scans, seconds) for each auto_align
 
 
     Methods
@@ -92,6 +105,7 @@ class GlancingAngle(Device):
     pitch_uid = ''
     f_uid = ''
     alignment_filename = ''
+    timings = []
     _orientation = 'parallel'
     toss = os.path.join(user_ns['BMMuser'].folder, 'snapshots', 'toss.png')
     img = None
@@ -188,24 +202,47 @@ class GlancingAngle(Device):
             yield from mv(this, 1)
 
 
-    def align_pitch(self, force=False):
+    def fit(self, message, fitter):
+        '''Find the target of an alignment scan in-process with fitter.
+        The scan is still sent to the consumer, which plots it and
+        gathers the alignment summary, but the plan does not wait for
+        it.  If the fit fails, ask the consumer and wait for its answer,
+        as before.  Raise ValueError if neither finds the target, or if
+        the scan did not run (e.g. it was not clear to start), rather
+        than fitting whatever scan came before it.'''
+        if message['uid'] is None:
+            raise ValueError(f'The {message["motor_name"]} alignment scan did not run.')
+        try:
+            target = fitter()
+            kafka_message(message)
+        except Exception as E:
+            whisper(f'in-process fit failed ({E}), asking the consumer')
+            target = fetch_peak_position_via_redis(kafka_request(message))
+        if target is None:
+            raise ValueError(f'Failed to find {message["motor_name"]} alignment position.')
+        return target
+
+    def align_pitch(self, force=False, width=2.5, nsteps=51):
         '''Find the peak of xafs_pitch scan against It. Plot the
-        result. Move to the peak.'''
+        result. Move to the peak.  Return the size of the correction.'''
         kafka_message({'close': 'last'})
         motor = user_ns['xafs_pitch']
+        start = motor.position
+        collector = ScanCollector(motor.name, 'It')
         yield from prepare_alignment_scan()
-        uid = yield from linescan(motor, 'it', -2.5, 2.5, 51, dopluck=False, force=force)
+        yield from subs_wrapper(linescan(motor, 'it', -width, width, nsteps, dopluck=False, force=force), collector)
         kafka_message({'close': 'last'})
-
-        
-        kafka_message({'peakfit'    : True,
-                       'uid'        : 'last',
-                       'motor_name' : motor.name,
-                       'signal'     : 'It',
-                       'choice'     : 'peak',
-                       'spinner'    : self.current()})
-        top = fetch_peak_position_via_redis()
+        self.pitch_uid = collector.uid
+
+        top = self.fit({'peakfit'    : True,
+                        'uid'        : collector.uid,
+                        'motor_name' : motor.name,
+                        'signal'     : 'It',
+                        'choice'     : 'peak',
+                        'spinner'    : self.current()},
+                       lambda : peak_position(*collector.arrays())[0])
         yield from mv(motor, top)
+        return top - start
 
         
         # ATTEMPTS = 4
@@ -238,24 +275,30 @@ class GlancingAngle(Device):
         # #self.pitch_plot(pitch, signal)
     
 
-    def align_linear(self, force=False, drop=None):
+    def align_linear(self, force=False, drop=None, width=2.3, nsteps=51):
         '''Fit an error function to the linear scan against It. Plot the
-        result. Move to the centroid of the error function.'''
+        result. Move to the centroid of the error function.  Return the
+        size of the correction.'''
         kafka_message({'close': 'last'})
         if self.orientation == 'parallel':
             motor = user_ns['xafs_liny']
         else:
             motor = user_ns['xafs_linx']
+        start = motor.position
+        collector = ScanCollector(motor.name, 'It')
         yield from prepare_alignment_scan()
-        uid = yield from linescan(motor, 'it', -2.3, 2.3, 51, dopluck=False)
+        yield from subs_wrapper(linescan(motor, 'it', -width, width, nsteps, dopluck=False), collector)
         kafka_message({'close': 'last'})
-        kafka_message({'stepfit'    : True,
-                       'uid'        : 'last',
-                       'motor_name' : motor.name,
-                       'signal'     : 'It',
-                       'spinner'    : self.current() })
-        target = fetch_peak_position_via_redis()
+        self.y_uid = collector.uid
+
+        target = self.fit({'stepfit'    : True,
+                           'uid'        : collector.uid,
+                           'motor_name' : motor.name,
+                           'signal'     : 'It',
+                           'spinner'    : self.current() },
+                          lambda : step_center(*collector.arrays(), drop=drop)[0])
         yield from mv(motor, target)
+        return target - start
         
         
         # table  = user_ns['db'][-1].table()
@@ -298,17 +341,20 @@ class GlancingAngle(Device):
             motor = user_ns['xafs_liny']
         else:
             motor = user_ns['xafs_linx']
-        uid = yield from linescan(motor, 'xs', -1.8, 1.8, 51, dopluck=False, force=force, stack=False)
+        channels = [getattr(BMMuser, f'xs{i}') for i in range(1, 9) if hasattr(BMMuser, f'xs{i}')]
+        collector = ScanCollector(motor.name, 'If', channels)
+        yield from subs_wrapper(linescan(motor, 'xs', -1.8, 1.8, 51, dopluck=False, force=force, stack=False), collector)
         kafka_message({'close': 'last'})
-        kafka_message({'peakfit'    : True,
-                       'uid'        : 'last',
-                       'motor_name' : motor.name,
-                       'signal'     : 'If',
-                       'choice'     : 'peak',
-                       'spinner'    : self.current()})
-        target = fetch_peak_position_via_redis()
+        self.f_uid = collector.uid
+
+        target = self.fit({'peakfit'    : True,
+                           'uid'        : collector.uid,
+                           'motor_name' : motor.name,
+                           'signal'     : 'If',
+                           'choice'     : 'peak',
+                           'spinner'    : self.current()},
+                          lambda : peak_position(*collector.arrays())[0])
         yield from mv(motor, target)
-        self.f_uid = uid
 
         # tf = user_ns['db'][-1].table()
         # yy = tf[motor.name]
@@ -349,9 +395,13 @@ class GlancingAngle(Device):
 
         
     def auto_align(self, pitch=2, drop=None):
-        '''Align a sample on a spinner automatically.  This performs 5 scans.
-        The first four iterate twice between linear and pitch
-        against the signal in It.  This find the flat position.
+        '''Align a sample on a spinner automatically.  This iterates
+        between linear and pitch scans against the signal in It until
+        both corrections are smaller than GA_TOLERANCE, or for at most
+        GA_MAX_PASSES pairs of scans.  This finds the flat position.
+        After the first pair, each scan is narrowed around the previous
+        result, GA_SHRINK times the size of the last correction, but no
+        narrower than the narrow end of GA_RANGE.
 
         Then the sample is pitched to the requested angle and a fifth
         scan is done to optimize the linear motor position against the
@@ -367,9 +417,12 @@ class GlancingAngle(Device):
         The linear scan against fluorescence ideally looks like a
         flat-topped peak.  Move to the center of mass.
 
-        At the end, a three-panel figure is drawn showing the last
-        three scans.  This is posted to Slack.  It also finds its way
-        into the dossier as a record of the quality of the alignment.
+        Each scan is fit in-process as it is measured (see
+        BMM.streamfit).  At the end, a three-panel figure is drawn by
+        the consumer showing the last three scans.  This is posted to
+        Slack.  It also finds its way into the dossier as a record of
+        the quality of the alignment.  The time taken and the number of
+        scans are logged and appended to self.timings.
 
         Arguments
         =========
@@ -399,23 +452,32 @@ class GlancingAngle(Device):
             kafka_message({'glancing_angle' : 'start',
                            'filename' : self.alignment_filename})
 
-            ## first pass in transmission
-            yield from self.align_linear(drop=drop)
-            yield from sleep(1)
-            yield from self.align_pitch()
-            yield from sleep(1)
-
-            ## for realsies X or Y in transmission
-            yield from self.align_linear(drop=drop)
-            #self.y_uid = user_ns['db'].v2[-1].metadata['start']['uid'] 
-            yield from sleep(1)
-            kafka_message({'close': 'all'})
-
-            ## for realsies Y in pitch
-            yield from self.align_pitch()
-            #self.pitch_uid = user_ns['db'].v2[-1].metadata['start']['uid'] 
-            yield from sleep(1)
+            ## iterate between linear and pitch in transmission until neither moves by much
+            begin = time.monotonic()
+            width = {axis: GA_RANGE[axis][0] for axis in GA_RANGE}
+            moved = {'linear': None, 'pitch': None}
+            nscans = 0
+            for npass in range(GA_MAX_PASSES):
+                for axis in ('linear', 'pitch'):
+                    if self.converged(moved):
+                        break
+                    widest, narrowest = GA_RANGE[axis]
+                    nsteps = max(GA_MIN_STEPS, int(round((GA_NSTEPS-1) * width[axis] / widest)) + 1)
+                    if axis == 'linear':
+                        moved[axis] = yield from self.align_linear(drop=drop, width=width[axis], nsteps=nsteps)
+                    else:
+                        moved[axis] = yield from self.align_pitch(width=width[axis], nsteps=nsteps)
+                    nscans += 1
+                    whisper(f'{axis} correction {moved[axis]:.3f} from a scan of +/- {width[axis]:.2f} in {nsteps} steps')
+                    if abs(moved[axis]) > width[axis]:  # the fit landed outside the scan, start wide again
+                        width[axis] = widest
+                    else:
+                        width[axis] = min(widest, max(narrowest, GA_SHRINK*abs(moved[axis])))
+                if self.converged(moved):
+                    break
             kafka_message({'close': 'all'})
+            if not self.converged(moved):
+                warning_msg(f'Glancing angle alignment did not converge in {GA_MAX_PASSES} passes at spinner {self.current()}')
 
             ## record the flat position
             if self.orientation == 'parallel':
@@ -427,7 +489,12 @@ class GlancingAngle(Device):
             ## move to measurement angle and align
             yield from mvr(user_ns['xafs_pitch'], pitch)
             yield from self.align_fluo()
-            self.f_uid = user_ns['db'].v2[-1].metadata['start']['uid'] 
+            nscans += 1
+
+            elapsed = time.monotonic() - begin
+            self.timings.append((self.current(), nscans, elapsed))
+            BMM_log_info(f'glancing angle alignment of spinner {self.current()}: {nscans} scans in {elapsed:.1f} seconds')
+            whisper(f'aligned spinner {self.current()} with {nscans} scans in {elapsed:.1f} seconds')
 
 
         def cleanup_plan():
@@ -435,14 +502,15 @@ class GlancingAngle(Device):
             yield from resting_state_plan()
             kafka_message({'close': 'all'})
             kafka_message({'glancing_angle' : 'stop'})
-            self.y_uid     = user_ns['rkvs'].get('BMM:ga:xy_uid').decode('utf-8')
-            self.pitch_uid = user_ns['rkvs'].get('BMM:ga:pitch_uid').decode('utf-8')
-            self.f_uid     = user_ns['rkvs'].get('BMM:ga:fluo_uid').decode('utf-8')
             
         user_ns['RE'].msg_hook = None
-        yield from finalize_wrapper(main_plan(pitch=2, drop=None), cleanup_plan())
+        yield from finalize_wrapper(main_plan(pitch=pitch, drop=drop), cleanup_plan())
         user_ns['RE'].msg_hook = BMM_msg_hook
         BMM_clear_suspenders()
+
+    def converged(self, moved):
+        '''True when the last linear and pitch corrections are both within GA_TOLERANCE.'''
+        return all(moved[axis] is not None and abs(moved[axis]) < GA_TOLERANCE[axis] for axis in GA_TOLERANCE)
  
 
 
@@ -1,5 +1,5 @@
 
-import os
+import os, uuid
 
 try:
     from bluesky_queueserver import is_re_worker_active
@@ -16,7 +16,8 @@ from nslsii.kafka_utils import _read_bluesky_kafka_config_file
 from bluesky_kafka.produce import BasicProducer
 
 from BMM.functions import proposal_base, warning_msg, bold_msg, whisper, error_msg
-from BMM.user_ns.base import bmm_catalog
+from BMM.user_ns.base import bmm_catalog, tiled_writer
+from BMM.workspace import rkvs
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
@@ -30,6 +31,17 @@ producer = BasicProducer(bootstrap_servers=kafka_config['bootstrap_servers'],
 )
 
 
+def resolve_last(message):
+    '''A consumer asked to work on the 'last' run would find the most
+    recent run in Tiled, which may not yet be the one just measured (see
+    BMM.tiled_writer).  Name that run instead, so the consumer can wait
+    for it.  This does not wait on anything.'''
+    if message.get('uid') == 'last':
+        latest = tiled_writer.latest()
+        if latest is not None:
+            message['uid'] = latest
+
+
 def kafka_message(message):
     '''Broadcast a message to kafka on the private BMM channel.
 
@@ -37,9 +49,49 @@ def kafka_message(message):
     documentation for details.
 
     '''
+    resolve_last(message)
     producer.produce(['bmm', message])
 
 
+# Request/reply over kafka + redis
+#
+# A request is an ordinary kafka message with a 'reply_to' entry
+# holding a redis key made unique to that request.  The worker pushes
+# its answer onto that key and the requester blocks on the key with
+# BLPOP.  The requester is woken as soon as the answer arrives, there
+# is no fixed sleep, and concurrent requests cannot clobber one
+# another's answers.
+REPLY_TIMEOUT = 15
+
+def kafka_request(message):
+    '''Broadcast a message to kafka which expects an answer from a worker.
+
+    A unique reply key is added to the message as its 'reply_to'
+    entry.  That key is returned so that it can be handed to
+    fetch_reply().
+
+    '''
+    reply_to = f'BMM:reply:{uuid.uuid4().hex}'
+    message['reply_to'] = reply_to
+    kafka_message(message)
+    return reply_to
+
+
+def fetch_reply(reply_to, timeout=REPLY_TIMEOUT):
+    '''Block until a worker posts an answer on the reply key of a
+    request made with kafka_request().
+
+    Return the answer as a string, or None if no answer arrives within
+    timeout seconds.
+
+    '''
+    answer = rkvs.blpop(reply_to, timeout=timeout)
+    if answer is None:
+        return None
+    rkvs.delete(reply_to)
+    return answer[1].decode('utf8')
+
+
 # Maintenance of kafka output
 def close_line_plots():
     kafka_message({'close': 'line'})
@@ -82,7 +134,7 @@ def is_date(string):
     except:
         return False
     
-def regenerate_every_xas_scan(gup=None, since=None, until=None):
+def regenerate_every_xas_scan(gup=None, since=None, until=None, force=False):
     '''Regenerate all XAS scans for a given experiment.
 
     arguments
@@ -96,6 +148,10 @@ def regenerate_every_xas_scan(gup=None, since=None, until=None):
     until [date string of the form YYYY-MM-DD]
       The ending date of the search. If not provided, the current date will be used
 
+    force [bool]
+      Rewrite every file.  Otherwise files already written by an earlier
+      regeneration are skipped unless the scan has changed.
+
     '''
     if gup is None:
         return []
@@ -113,6 +169,6 @@ def regenerate_every_xas_scan(gup=None, since=None, until=None):
     if is_date(until) is False:
         error_msg(f'"{until}" is not an interpretable date string.  Try specifying your date in the form YYYY-MM-DD')
         return
-    kafka_message({'everyxas': True, 'gup': gup, 'since': since, 'until': until})
+    kafka_message({'everyxas': True, 'gup': gup, 'since': since, 'until': until, 'force': force})
     bold_msg('This will take some time to complete.')
     whisper('Progress can be monitored in the terminal window displaying the Kafka file manager.')
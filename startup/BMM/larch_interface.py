@@ -27,8 +27,7 @@ import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 
 #from BMM.functions import etok, ktoe
-#from BMM.periodictable import edge_energy, element_symbol
-from larch.xray import atomic_symbol, xray_edge
+from BMM.periodictable import edge_energy, nearest_edge
 
 #from BMM import user_ns as user_ns_module
 #user_ns = vars(user_ns_module)
@@ -169,7 +168,7 @@ class Pandrosus():
             print('Pandrosus requires use of the Tiled interface.')
             print('The V1 interface to databroker is deprecated.')
             return
-        else:                               # tiled catalog
+        else:                               # tiled catalog (or a BMM.run_cache.RunCache)
             header = self.db[uid].metadata
             start = header['start']
             table  = self.db[uid].primary.read()
@@ -243,10 +242,10 @@ class Pandrosus():
             header = self.db[uid]
             start = header.start
             table  = header.table()
-        else:                               # tiled catalog
+        else:                               # tiled catalog (or a BMM.run_cache.RunCache)
             header = self.db[uid].metadata
             start = header['start']
-            table  = self.db[uid].primary.read()
+            table  = self.db[uid].primary.read(['dcm_energy', 'It', 'Ir'])
             
         self.group.energy = numpy.array(table['dcm_energy'])
         self.group.reference = numpy.array(numpy.log(table['It']/table['Ir']))
@@ -287,45 +286,10 @@ class Pandrosus():
         self.prep()
 
     def find_edge(self):
-        '''This re-implements the Demeter::Data::find_edge method
+        '''This re-implements the Demeter::Data::find_edge method, using
+        the edge table in BMM.periodictable
         '''
-        diff = 100000
-        for ed in ('K', 'l3', 'L2', 'L1'):
-            for z in range(14, 98):  # larch.xray stops at Cf
-                en = xray_edge(z, ed).energy
-                this = abs(en - self.group.e0)
-                if this > diff and en > self.group.e0:
-                    break
-                if this < diff:
-                    diff = this
-                    answer = z
-                    edge = ed
-        elem = atomic_symbol(answer)
-        if (elem, edge) == ('Nd', 'L1'):    # Fe oxide
-            (elem, edge) = ('Fe', 'K')
-        elif (elem, edge) == ('Sm', 'L1'):  # Co oxide
-            (elem, edge) = ('Co', 'K')
-        elif (elem, edge) == ('Er', 'L1'):  # Ni oxide
-            (elem, edge) = ('Ni', 'K')
-        elif (elem, edge) == ('Ce', 'L1'):  # Mn oxide
-            (elem, edge) = ('Mn', 'K')
-        elif (elem, edge) == ('Ir', 'L1'):  # prefer Bi l3 to Ir L1
-            (elem, edge) = ('Bi', 'L3')
-        elif (elem, edge) == ('Th', 'L3'):  # prefer Se K to Tl L3
-            (elem, edge) = ('Se', 'K')
-        #elif (elem, edge) == ('W', 'L2'):   # prefer Pt L3 to W L2
-        #    (elem, edge) = ('Pt', 'L3')
-        elif (elem, edge) == ('Pb', 'L2'):  # prefer Se K to Tl L3
-            (elem, edge) = ('Rb', 'K')
-        #elif (elem, edge) == ('At', 'L1'):  # prefer Np L3 to At L1
-        #    (elem, edge) = ('Np', 'L3')
-        elif (elem, edge) == ('Ba', 'L1'):  # prefer Cr K to Ba L1
-            (elem, edge) = ('Cr', 'K')
-        #elif (elem, edge) == ('Er', 'L3'):  # prefer Ni K to Er L3
-        #    (elem, edge) = ('Ni', 'K')
-        elif (elem, edge) == ('Bk', 'L2'):  # prefer Pd K to Bk L2
-            (elem, edge) = ('Pd', 'K')
-
+        (elem, edge) = nearest_edge(self.group.e0)
         self.element = elem
         self.edge = edge
             
@@ -335,14 +299,14 @@ class Pandrosus():
             return None
         if self.edge.lower() == 'k' or self.edge.lower() == 'l1':
             return None
-        e0 = xray_edge(self.element, self.edge).energy
+        e0 = edge_energy(self.element, self.edge)
         if e0 is None:
             return None
         if self.edge.lower() == 'l3':
-            l2 = xray_edge(self.element, 'L2').energy
+            l2 = edge_energy(self.element, 'L2')
             return etok(l2-e0-30)
         if self.edge.lower() == 'l1':
-            l1 = xray_edge(self.element, 'L1').energy
+            l1 = edge_energy(self.element, 'L1')
             return etok(l1-e0-30)
         
         
@@ -368,11 +332,11 @@ class Pandrosus():
         if self.element is None or self.edge is None:
             self.find_edge()
         if self.edge.lower() == 'l3':
-            diff = xray_edge(self.element, 'L2').energy - xray_edge(self.element, 'L3').energy
+            diff = edge_energy(self.element, 'L2') - edge_energy(self.element, 'L3')
             if self.pre['norm2'] > diff:
                self.pre['norm2'] = diff - 20 
         if self.edge.lower() == 'l2':
-            diff = xray_edge(self.element, 'L1').energy - xray_edge(self.element, 'L2').energy
+            diff = edge_energy(self.element, 'L1') - edge_energy(self.element, 'L2')
             if self.pre['norm2'] > diff:
                self.pre['norm2'] = diff - 20 
         pre_edge(self.group.energy, mu=self.group.mu, group=self.group,
@@ -832,6 +796,89 @@ class Pandrosus():
     pkq = plot_chikq
 
 
+## running merge of a growing sequence of mu(E) spectra
+class Erichthonius():
+    '''A running merge of mu(E) spectra, updated in constant time as
+    each new spectrum arrives.
+
+    The first spectrum added fixes the energy grid.  Each subsequent
+    spectrum is interpolated onto that grid and folded into a running
+    mean and a running sum of squared deviations (Welford's method),
+    so adding the Nth spectrum costs the same as adding the second.
+    The Larch normalization chain is not run until a Pandrosus object
+    for the merge is actually requested with merged().
+
+    Attributes
+    ----------
+    energy : ndarray
+        energy grid of the merge, taken from the first spectrum
+    mean : ndarray
+        running mean of mu(E) on the energy grid
+    count : int
+        number of spectra in the merge
+
+    Methods
+    -------
+    add :
+        fold a Pandrosus object (or energy and mu arrays) into the merge
+    variance :
+        point-by-point sample variance of the merged spectra
+    noise :
+        point-by-point standard error of the merged mu(E)
+    merged :
+        return a prepped Pandrosus object containing the merge
+
+    '''
+    def __init__(self, name='merge'):
+        self.name    = name
+        self.energy  = None
+        self.mean    = None
+        self.m2      = None
+        self.count   = 0
+        self.folder  = None
+        self.db      = None
+        self.element = None
+        self.edge    = None
+        self._merged = None
+
+    def add(self, group=None, energy=None, mu=None):
+        if group is not None:
+            energy, mu = group.group.energy, group.group.mu
+            if self.element is None:
+                self.element, self.edge = group.element, group.edge
+        if self.energy is None:
+            self.energy = numpy.array(energy, dtype=float)
+            self.mean   = numpy.array(mu, dtype=float)
+            self.m2     = numpy.zeros(len(self.energy))
+            self.count  = 1
+        else:
+            this = numpy.interp(self.energy, energy, mu)
+            self.count += 1
+            delta = this - self.mean
+            self.mean += delta / self.count
+            self.m2   += delta * (this - self.mean)
+        self._merged = None
+
+    def variance(self):
+        if self.count < 2:
+            return numpy.zeros_like(self.energy)
+        return self.m2 / (self.count - 1)
+
+    def noise(self):
+        return numpy.sqrt(self.variance() / self.count)
+
+    def merged(self):
+        '''Return a Pandrosus object containing the merge.  The Larch
+        normalization chain is run only if spectra have been added
+        since the last time this was called.'''
+        if self._merged is None:
+            self._merged = Pandrosus()
+            self._merged.folder, self._merged.db = self.folder, self.db
+            self._merged.element, self._merged.edge = self.element, self.edge
+            self._merged.put(self.energy.copy(), self.mean.copy(), self.name)
+        return self._merged
+
+
 from collections.abc import Iterable
 ## grouping of Pandrosus objects for making purple plots
 class Kekropidai():
@@ -857,7 +904,8 @@ class Kekropidai():
         make a Kekropidai object out of a list of UIDs
     merge :
         merge the contents of the Kekropidai object and return a
-        Pandrosus object containing the merge
+        Pandrosus object containing the merge (the merge is kept up
+        to date as groups are added, see Erichthonius)
     plot_xmu : 
         (alias = pe) overplot all the groups in energy
     plot_i0 :
@@ -884,6 +932,7 @@ class Kekropidai():
         self.rmax   = 6
         self.folder = None
         self.db     = None
+        self.running = Erichthonius()
 
     def put(self, uidlist):
         for u in uidlist:
@@ -893,28 +942,21 @@ class Kekropidai():
             self.add(this)
 
     def merge(self):
-        base = self.groups[0]
-        ee = base.group.energy
-        mm = base.group.mu
-        for spectrum in self.groups[1:]:
-            mu = numpy.interp(ee, spectrum.group.energy, spectrum.group.mu)
-            mm = mm + mu
-        mm = mm / len(self.groups)
-        merge = Pandrosus()
-        merge.folder, merge.db = self.folder, self.db
-        merge.put(ee, mm, 'merge')
-        return(merge)
+        self.running.folder, self.running.db = self.folder, self.db
+        return(self.running.merged())
         
             
     def add(self, groups):
         if 'Pandrosus' in str(type(groups)):
             # this is a single group
             self.groups.append(groups)
+            self.running.add(groups)
             return()
         if isinstance(groups, Iterable):
             for item in groups:
                 if 'Pandrosus' in str(type(item)):
                     self.groups.append(item)
+                    self.running.add(item)
 
     def plot_xmu(self, norm=False, flat=False, deriv=False):
         '''Overplot multiple data sets in energy.
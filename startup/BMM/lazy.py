@@ -0,0 +1,101 @@
+import importlib, threading, time
+
+from BMM.functions import whisper
+
+## every Lazy made while loading the profile, see warm_lazy_objects
+LAZY_OBJECTS = []
+
+
+class Lazy():
+    '''A stand-in for an object which is expensive to make and is not
+    needed while bsui starts, e.g. the data evaluation model, which
+    imports scikit-learn and Larch and loads a trained model from disk.
+
+    The object is made from an attribute of a module the first time
+    one of its attributes is used or it is called.  From then on, the
+    Lazy passes everything through to it.  If call is True, the module
+    attribute is called (without arguments) to make the object,
+    otherwise the attribute is the object (e.g. a class).
+
+      clf = Lazy('clf', 'BMM.ml', 'BMMDataEvaluation', call=True)
+      Pandrosus = Lazy('Pandrosus', 'BMM.larch_interface', 'Pandrosus')
+
+    attributes
+    ==========
+    name: (str)
+      the name of the object in the user namespace
+
+    module, attribute: (str)
+      where to find the object or the thing that makes it
+
+    call: (bool)
+      True to call attribute to make the object
+
+    warm: (bool)
+      True if the object should be made in the background once bsui
+      has started, see warm_lazy_objects
+
+    elapsed: (float)
+      time in seconds taken to make the object
+
+    '''
+    def __init__(self, name, module, attribute, call=False, warm=False):
+        object.__setattr__(self, '_Lazy__state', {'name': name, 'module': module, 'attribute': attribute,
+                                                  'call': call, 'warm': warm, 'elapsed': None,
+                                                  'object': None, 'made': False, 'lock': threading.RLock()})
+        LAZY_OBJECTS.append(self)
+
+    def resolve(self):
+        '''Make the object if that has not yet been done, and return it.'''
+        state = self.__state
+        if state['made']:
+            return state['object']
+        with state['lock']:
+            if not state['made']:
+                start = time.monotonic()
+                thing = getattr(importlib.import_module(state['module']), state['attribute'])
+                if state['call']:
+                    thing = thing()
+                state['object'], state['made'] = thing, True
+                state['elapsed'] = time.monotonic() - start
+        return state['object']
+
+    @property
+    def resolved(self):
+        return self.__state['made']
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.resolve(), attr, value)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __dir__(self):
+        return dir(self.resolve())
+
+    def __repr__(self):
+        if self.__state['made']:
+            return repr(self.__state['object'])
+        return f'<{self.__state["name"]}: {self.__state["module"]}.{self.__state["attribute"]}, not yet loaded>'
+
+
+def warm_lazy_objects(report=False):
+    '''Make, in a background thread, each Lazy marked warm, so that the
+    first use does not wait.  Something which uses one of these before
+    it is ready waits for it to finish.'''
+    def warm():
+        for lazy in LAZY_OBJECTS:
+            if lazy._Lazy__state['warm'] and not lazy.resolved:
+                try:
+                    lazy.resolve()
+                except Exception as E:
+                    whisper(f'could not load {lazy._Lazy__state["name"]}: {E}')
+                    continue
+                if report:
+                    whisper(f'loaded {lazy._Lazy__state["name"]} in {lazy._Lazy__state["elapsed"]:.1f} s')
+    thread = threading.Thread(target=warm, name='warm lazy objects', daemon=True)
+    thread.start()
+    return thread
@@ -11,7 +11,7 @@ import bluesky
 from bluesky.plans import rel_scan
 from bluesky.plan_stubs import sleep, mv, null, mvr
 from bluesky import __version__ as bluesky_version
-import numpy, os, datetime
+import numpy, os, datetime, time
 from lmfit.models import SkewedGaussianModel, RectangleModel
 #from databroker.core import SingleRunCache
 import matplotlib
@@ -26,7 +26,7 @@ user_ns = vars(user_ns_module)
 
 from BMM.resting_state import resting_state_plan
 from BMM.suspenders    import BMM_clear_to_start, BMM_clear_suspenders
-from BMM.kafka         import kafka_message
+from BMM.kafka         import kafka_message, kafka_request, fetch_reply, REPLY_TIMEOUT
 from BMM.logging       import BMM_log_info, BMM_msg_hook
 from BMM.functions     import countdown, clean_img, PROMPT, PROMPTNC, animated_prompt, now
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
@@ -224,28 +224,33 @@ def prepare_alignment_scan(inttime=0.1):
     yield from mv(_locked_dwell_time, inttime)
     
 
-def fetch_peak_position_via_redis(maxtries=6, verbose=False):
+def fetch_peak_position_via_redis(reply_to=None, timeout=REPLY_TIMEOUT, verbose=False):
     '''Retrieve a result found by the Kafka consumer and posted to redis.
 
-    The function prepare_alignment_scan() should have been called
-    prior to the alignment scan.
+    The fitting request should have been made with kafka_request(),
+    which returns the reply key handed to this function.  This blocks
+    on that key until the consumer posts the fitted position.
 
-    This function waits increasing times for that parameter in redis
-    to be set to value bigger than UNSET_PEAK_POSITION.  This gives
-    the kafka consumer some time to do its thing.
+    For a request made without a reply key, fall back to reading the
+    shared BMM:peak_position key, which prepare_alignment_scan() should
+    have set to its unset value prior to the alignment scan.
 
     '''
-    time.sleep(0.25)
+    t0 = time.time()
+    if reply_to is not None:
+        answer = fetch_reply(reply_to, timeout=timeout)
+        if verbose: print(f"{answer = }, {time.time()-t0:.3f} seconds", flush=True)
+        if answer is None:
+            return(None)
+        return float(answer)
+
     top = float(rkvs.get('BMM:peak_position').decode('utf8'))
-    count = 0
-    #if verbose: print(f"{count = }, {top = }")
     while top < UNSET_PEAK_POSITION:
-        time.sleep(0.1 * 2**count)
-        top = float(rkvs.get('BMM:peak_position').decode('utf8'))
-        count += 1
-        if verbose: print(f"{count = }, {top = }", flush=True)
-        if count > maxtries:
+        if time.time() - t0 > timeout:
             return(None)
+        time.sleep(0.05)
+        top = float(rkvs.get('BMM:peak_position').decode('utf8'))
+    if verbose: print(f"{top = }, {time.time()-t0:.3f} seconds", flush=True)
     return top
 
 def slit_height(start=-1.5, stop=1.5, nsteps=31, move=False, force=False, slp=1.0, choice='peak'):
@@ -268,6 +273,10 @@ def slit_height(start=-1.5, stop=1.5, nsteps=31, move=False, force=False, slp=1.
         length of sleep before trying to move dm3_bct [3.0]
     choice : str 
         'peak' or 'com' (center of mass) ['peak']
+
+    Return the position of the peak which was moved to, or None if the
+    scan was not made or no peak was fit (e.g. dry run, not clear to
+    start, or plucked by hand).
     '''
 
     def main_plan(start, stop, nsteps, move, slp, force):
@@ -314,16 +323,17 @@ def slit_height(start=-1.5, stop=1.5, nsteps=31, move=False, force=False, slp=1.
                 user_ns['ks'].cycle('dm3')
             if move:
                 kafka_message({'close': 'last'})
-                kafka_message({'peakfit' : True,
-                               'uid' : uid,
-                               'motor_name' : motor.name,
-                               'signal' : 'I0',
-                               'choice' : choice})
-                top = fetch_peak_position_via_redis()
+                reply_to = kafka_request({'peakfit' : True,
+                                          'uid' : uid,
+                                          'motor_name' : motor.name,
+                                          'signal' : 'I0',
+                                          'choice' : choice})
+                top = fetch_peak_position_via_redis(reply_to)
                 if top is None:
                     error_msg('Failed to find rocking curve peak position.')
                     raise ValueError('Failed to find slit_height peak position.')
                 yield from mv(motor, top)
+                return top
                 
             else:
                 #action = input('\n' + bold_msg('Pluck motor position from the plot? ' + PROMPT))
@@ -338,7 +348,7 @@ def slit_height(start=-1.5, stop=1.5, nsteps=31, move=False, force=False, slp=1.
                 yield from sleep(slp)
                 yield from pluck(suggested_motor=motor)
                 #yield from move_after_scan(motor)
-        yield from scan_slit(slp)
+        return(yield from scan_slit(slp))
 
     def cleanup_plan(slp):
         #yield from mv(slits3.vsize, slit_height)
@@ -361,8 +371,9 @@ def slit_height(start=-1.5, stop=1.5, nsteps=31, move=False, force=False, slp=1.
     motor = dm3_bct
     slit_height = slits3.vsize.readback.get()
     user_ns['RE'].msg_hook = None
-    yield from finalize_wrapper(main_plan(start, stop, nsteps, move, slp, force), cleanup_plan(slp))
+    top = yield from finalize_wrapper(main_plan(start, stop, nsteps, move, slp, force), cleanup_plan(slp))
     user_ns['RE'].msg_hook = BMM_msg_hook
+    return top
         
 
 def mirror_pitch(start=None, stop=None, nsteps=41, mirror='m3', move=False, force=False, choice='peak'):
@@ -390,6 +401,10 @@ def mirror_pitch(start=None, stop=None, nsteps=41, mirror='m3', move=False, forc
     choice : str 
         'peak' or 'com' (center of mass) ['peak']  (com not currently implemented)
 
+    Return the position of the peak which was moved to, or None if the
+    scan was not made or no peak was fit (e.g. dry run, not clear to
+    start, or plucked by hand).
+
     '''
 
     def main_plan(start, stop, nsteps, move, force):
@@ -427,16 +442,17 @@ def mirror_pitch(start=None, stop=None, nsteps=41, mirror='m3', move=False, forc
             BMM_log_info(f'mirror pitch scan: {line1}\tuid = {uid}')
             if move:
                 kafka_message({'close': 'last'})
-                kafka_message({'peakfit' : True,
-                               'uid' : uid,
-                               'motor_name' : motor.name,
-                               'signal' : 'I0',
-                               'choice' : choice})
-                top = fetch_peak_position_via_redis()
+                reply_to = kafka_request({'peakfit' : True,
+                                          'uid' : uid,
+                                          'motor_name' : motor.name,
+                                          'signal' : 'I0',
+                                          'choice' : choice})
+                top = fetch_peak_position_via_redis(reply_to)
                 if top is None:
                     error_msg('Failed to find rocking curve peak position.')
                     raise ValueError('Failed to find rocking curve peak position.')
                 yield from mv(motor, top)
+                return top
 
             else:
                 #action = input('\n' + bold_msg('Pluck motor position from the plot? ' + PROMPT))
@@ -446,7 +462,7 @@ def mirror_pitch(start=None, stop=None, nsteps=41, mirror='m3', move=False, forc
                     if action[0].lower() == 'n' or action[0].lower() == 'q':
                         return(yield from null())
                 yield from pluck(suggested_motor=motor)
-        yield from scan_pitch()
+        return(yield from scan_pitch())
 
     def cleanup_plan():
         #yield from mv(slits3.vsize, slit_height)
@@ -472,8 +488,9 @@ def mirror_pitch(start=None, stop=None, nsteps=41, mirror='m3', move=False, forc
     if stop is None:
         stop  = defstop
     user_ns['RE'].msg_hook = None
-    yield from finalize_wrapper(main_plan(start, stop, nsteps, move, force), cleanup_plan())
+    top = yield from finalize_wrapper(main_plan(start, stop, nsteps, move, force), cleanup_plan())
     user_ns['RE'].msg_hook = BMM_msg_hook
+    return top
 
 
 def rocking_curve(start=-0.10, stop=0.10, nsteps=101, detector='I0', choice='peak', height=3):
@@ -502,6 +519,10 @@ def rocking_curve(start=-0.10, stop=0.10, nsteps=101, detector='I0', choice='pea
     measurement at BMM.  The line shape is a bit skewed due to the
     convolution with the slightly misaligned entrance slits.
 
+    Return the position of the peak which was moved to, or None if the
+    scan was not made or no peak was fit (e.g. dry run, not clear
+    to start).
+
     '''
     def main_plan(start, stop, nsteps, detector, height):
         (ok, text) = BMM_clear_to_start()
@@ -546,13 +567,13 @@ def rocking_curve(start=-0.10, stop=0.10, nsteps=101, detector='I0', choice='pea
             uid = yield from rel_scan(dets, motor, start, stop, nsteps, md={'plan_name' : f'rel_scan linescan {motor.name} I0'})
             kafka_message({'linescan': 'stop',})
             kafka_message({'close': 'last'})
-            kafka_message({'peakfit' : True,
-                           'uid' : uid,
-                           'motor_name' : 'dcm_pitch',
-                           'signal' : 'I0',
-                           'choice' : choice})
+            reply_to = kafka_request({'peakfit' : True,
+                                      'uid' : uid,
+                                      'motor_name' : 'dcm_pitch',
+                                      'signal' : 'I0',
+                                      'choice' : choice})
 
-            top = fetch_peak_position_via_redis()
+            top = fetch_peak_position_via_redis(reply_to)
             if top is None:
                 error_msg('Failed to find rocking curve peak position.')
                 raise ValueError('Failed to find rocking curve peak position.')
@@ -565,9 +586,10 @@ def rocking_curve(start=-0.10, stop=0.10, nsteps=101, detector='I0', choice='pea
             #             (line1, uid, user_ns['db'][-1].start['scan_id']))
             BMM_log_info(f'rocking curve scan: {line1}\tuid = {uid}')
             yield from mv(motor, top)
+            return top
             #if sgnl == 'Bicron':
             #    yield from mv(slitsg.vsize, gonio_slit_height)
-        yield from scan_dcmpitch(sgnl)
+        return(yield from scan_dcmpitch(sgnl))
 
     def cleanup_plan():
         yield from mv(slits3.top, slit_height/2, slits3.bottom, -1*slit_height/2)
@@ -597,8 +619,9 @@ def rocking_curve(start=-0.10, stop=0.10, nsteps=101, detector='I0', choice='pea
     # except:
     #     gonio_slit_height = 1
     user_ns['RE'].msg_hook = None
-    yield from finalize_wrapper(main_plan(start, stop, nsteps, detector, height), cleanup_plan())
+    top = yield from finalize_wrapper(main_plan(start, stop, nsteps, detector, height), cleanup_plan())
     user_ns['RE'].msg_hook = BMM_msg_hook
+    return top
 
 
 
@@ -657,12 +680,12 @@ def hcenter(start=-1, stop=1, nsteps=41, move=False, force=False, choice='peak')
             BMM_log_info(f'hcenter scan: {line1}\tuid = {uid}')
             if move:
                 kafka_message({'close': 'last'})
-                kafka_message({'peakfit' : True,
-                               'uid' : uid,
-                               'motor_name' : motor.name,
-                               'signal' : 'I0',
-                               'choice' : choice})
-                top = fetch_peak_position_via_redis()
+                reply_to = kafka_request({'peakfit' : True,
+                                          'uid' : uid,
+                                          'motor_name' : motor.name,
+                                          'signal' : 'I0',
+                                          'choice' : choice})
+                top = fetch_peak_position_via_redis(reply_to)
                 if top is None:
                     error_msg('Failed to find rocking curve peak position.')
                     raise ValueError('Failed to find rocking curve peak position.')
@@ -796,12 +819,12 @@ def rectangle_scan(motor=None, start=-20, stop=20, nsteps=41, detector='It',
 
             if move is True:
                 kafka_message({'close': 'all'})
-                kafka_message({'rectanglefit' : True,
-                               'uid'          : uid,
-                               'signal'       : detector.capitalize(),
-                               'motor_name'   : motor.name })
+                reply_to = kafka_request({'rectanglefit' : True,
+                                          'uid'          : uid,
+                                          'signal'       : detector.capitalize(),
+                                          'motor_name'   : motor.name })
 
-                top = fetch_peak_position_via_redis(verbose=True)
+                top = fetch_peak_position_via_redis(reply_to, verbose=True)
                 if top is None:
                     error_msg('Failed to find rectangle midpoint.')
                     raise ValueError('Failed to find rectangle midpoint.')
@@ -877,12 +900,12 @@ def peak_scan(motor=None, start=-20, stop=20, nsteps=41, detector='It', find='ma
             uid = yield from rel_scan(dets, motor, start, stop, nsteps, md={'plan_name' : f'rel_scan linescan {motor.name} I0'})
             kafka_message({'linescan': 'stop',})
 
-            kafka_message({'stepfit'    : True,
-                           'uid'        : uid,
-                           'motor_name' : motor.name,
-                           'signal'     : 'It',
-                           'choice'     : 'peak'})
-            target = fetch_peak_position_via_redis()
+            reply_to = kafka_request({'stepfit'    : True,
+                                      'uid'        : uid,
+                                      'motor_name' : motor.name,
+                                      'signal'     : 'It',
+                                      'choice'     : 'peak'})
+            target = fetch_peak_position_via_redis(reply_to)
             yield from mv(motor, target)
             bold_msg(f'Found peak at {motor.name} = {motor.position}')
             for k in ('center1', 'center2', 'sigma1', 'sigma2', 'amplitude', 'midpoint'):
@@ -0,0 +1,158 @@
+'''A cache of the lookup tables read by the profile, such as
+lookup_table/Modes.xlsx and rois.json.
+
+Each table is parsed from its source file once and the result is
+pickled to CACHE_FOLDER.  After that, the table comes from memory or,
+in a new bsui session or queue server worker, from the pickle.  A
+source file is parsed again only when it changes.  A change is noticed
+from the modification time and size.  A file that is touched but not
+edited is recognized by its SHA1 hash and is not parsed again.
+
+Nothing in this module depends on the bsui profile, so the kafka
+consumers use it for rois.json as well.
+
+    >>> from BMM.lookup_cache import lookup_table, read_json
+    >>> allrois = read_json('/path/to/rois.json')
+    >>> modes = lookup_table('/path/to/Modes.xlsx', modes_from_xlsx)
+
+'''
+import os, json, pickle, hashlib, threading
+
+CACHE_FOLDER  = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'BMM', 'lookup_tables')
+CACHE_VERSION = 1               # increment to discard every pickle written by an older version of this module
+
+_memory = dict()                # (source, parser name) : (mtime_ns, size, table)
+_lock   = threading.Lock()
+STATS   = {'memory': 0, 'pickle': 0, 'parsed': 0}
+
+
+def _signature(source):
+    st = os.stat(source)
+    return st.st_mtime_ns, st.st_size
+
+
+def _sha1(source):
+    with open(source, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+def cache_file(source, parser):
+    '''Return the name of the pickle file for a source file and parser.'''
+    name = os.path.basename(source)
+    tag = hashlib.sha1(f'{os.path.abspath(source)} {parser.__module__}.{parser.__qualname__}'.encode()).hexdigest()[:12]
+    return os.path.join(CACHE_FOLDER, f'{name}.{tag}.pickle')
+
+
+def _write_pickle(filename, contents):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename+'.tmp', 'wb') as fh:
+            pickle.dump(contents, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filename+'.tmp', filename)
+    except OSError:
+        pass                    # a cache which cannot be written is just a slower cache
+
+
+def lookup_table(source, parser):
+    '''Return parser(source), parsing source only if it has changed since
+    the last time it was parsed by parser.
+
+    Parameters
+    ----------
+    source : str
+        fully resolved path to the lookup table
+    parser : callable
+        function of one argument, the source file name, returning
+        something which can be pickled
+
+    The table is shared by every caller, so treat it as read-only.
+
+    '''
+    key = (os.path.abspath(source), f'{parser.__module__}.{parser.__qualname__}')
+    mtime, size = _signature(source)
+    with _lock:
+        if key in _memory and _memory[key][:2] == (mtime, size):
+            STATS['memory'] += 1
+            return _memory[key][2]
+
+        pickled = cache_file(source, parser)
+        contents, sha1 = None, None
+        if os.path.isfile(pickled):
+            try:
+                with open(pickled, 'rb') as fh:
+                    contents = pickle.load(fh)
+                if contents.get('version') != CACHE_VERSION:
+                    contents = None
+            except Exception:
+                contents = None
+        if contents is not None and (contents['mtime'], contents['size']) == (mtime, size):
+            STATS['pickle'] += 1
+        elif contents is not None and contents['size'] == size and contents['sha1'] == (sha1 := _sha1(source)):
+            STATS['pickle'] += 1
+            contents.update(mtime=mtime)
+            _write_pickle(pickled, contents)
+        else:
+            STATS['parsed'] += 1
+            contents = {'version': CACHE_VERSION, 'mtime': mtime, 'size': size,
+                        'sha1': sha1 or _sha1(source), 'table': parser(source)}
+            _write_pickle(pickled, contents)
+        _memory[key] = (mtime, size, contents['table'])
+        return contents['table']
+
+
+def forget(source=None):
+    '''Drop tables from memory (all of them if source is None), so that
+    the next lookup checks the pickle.  Remove the pickle with
+    os.remove(cache_file(source, parser)) to force a parse.'''
+    with _lock:
+        for key in list(_memory.keys()):
+            if source is None or key[0] == os.path.abspath(source):
+                del _memory[key]
+
+
+def parse_json(source):
+    with open(source, 'r') as fh:
+        return json.load(fh)
+
+
+def read_json(source):
+    '''Return the contents of a JSON file, like rois.json, from the cache.'''
+    return lookup_table(source, parse_json)
+
+
+def modes_from_xlsx(source):
+    '''Parse the "Modes A-F" sheet of Modes.xlsx into a dict of motor
+    alias : dict of PV, description, and position and encoder readings
+    in each mode.'''
+    from openpyxl import load_workbook
+    wb = load_workbook(source, read_only=True)
+    ws = wb['Modes A-F']
+    bl = dict()
+    header = 1
+    for row in ws.rows:
+        axis = dict()
+        if str(row[0].value) == 'Instrument':
+            header = 0
+            continue
+        if header == 1: continue
+        alias           = row[2].value
+        if 'fe_slits' in alias: continue
+        axis['PV']      = row[1].value
+        axis['desc']    = row[3].value
+        axis['A']       = row[4].value
+        axis['A_REP']   = row[5].value
+        axis['B']       = row[6].value
+        axis['B_REP']   = row[7].value
+        axis['C']       = row[8].value
+        axis['C_REP']   = row[9].value
+        axis['D']       = row[10].value
+        axis['D_REP']   = row[11].value
+        axis['E']       = row[12].value
+        axis['E_REP']   = row[13].value
+        axis['F']       = row[14].value
+        axis['F_REP']   = row[15].value
+        axis['XRD']     = row[19].value
+        axis['XRD_REP'] = row[20].value
+        bl[alias] = axis
+    wb.close()
+    return bl
@@ -634,7 +634,7 @@ class BMMMacroBuilder():
         s = [float(x) if isfloat(x) else x for x in s]
         t = [float(x) if isfloat(x) else x for x in t]
 
-        (e, t, at, delta) = conventional_grid(bounds=b, steps=s, times=t, e0=edge_energy(el, ed), element=el, edge=ed, ththth=False)
+        (e, t, at, delta) = conventional_grid(bounds=b, steps=s, times=t, e0=edge_energy(el, ed), element=el, edge=ed, ththth=False, mode=m['mode'])
 
         if type(m['nscans']) is int:
             nsc = m['nscans']
@@ -0,0 +1,149 @@
+'''Write raster maps (areascans) to files for use outside of bsui.
+
+A map is a dict of columns, each a 1-D numpy array with one value per
+pixel in the order measured, plus the (nslow, nfast) shape of the map
+from the start document.  It can be written as
+
+  * HDF5, laid out as a NeXus NXdata group, with each column as a
+    chunked, compressed 2-D dataset of the shape of the map
+  * Parquet, one row per pixel (if pyarrow is available)
+  * a Matlab .mat file, the columns handed to savemat as arrays
+  * an Excel spreadsheet, one row per pixel, written with openpyxl's
+    write-only mode.  Above XLSX_LIMIT pixels no spreadsheet is
+    written, since Excel is not a sensible way to handle a map that
+    large.
+
+Nothing in this module depends on the bsui profile, so it is used by
+the kafka file manager as well as by BMM.raster.
+
+    >>> from BMM.map_export import export_map
+    >>> export_map('/path/to/maps/mymap', {'xafs_x': x, 'xafs_y': y, 'I0': i0, 'signal': z},
+    ...            shape=(51, 101), signal='signal', label='my sample')
+
+'''
+import numpy, h5py, openpyxl
+from scipy.io import savemat
+
+XLSX_LIMIT   = 250000           # largest map, in pixels, written as a spreadsheet
+MAP_FORMATS  = ('hdf5', 'parquet', 'mat', 'xlsx')
+
+
+def as_map(values, shape):
+    '''Reshape a column to the (nslow, nfast) shape of a map, padding an
+    incomplete map with NaN.'''
+    values = numpy.asarray(values, dtype=float).ravel()
+    full = numpy.full(int(numpy.prod(shape)), numpy.nan)
+    full[:min(len(values), len(full))] = values[:len(full)]
+    return full.reshape(shape)
+
+
+def write_hdf5(filename, columns, shape, signal=None, axes=None, label=None, attrs=None):
+    '''Write a map to an HDF5 file as a NeXus NXdata group.
+
+    Parameters
+    ----------
+    filename : str
+        output file
+    columns : dict
+        name : 1-D array, one value per pixel
+    shape : (int, int)
+        (nslow, nfast) shape of the map
+    signal : str
+        name of the column which is the map's signal
+    axes : (str, str)
+        names of the slow and fast motor columns
+    label : str
+        title of the map
+    attrs : dict
+        further attributes of the NXentry group, e.g. the uid
+
+    '''
+    shape = tuple(int(s) for s in shape)
+    chunks = (min(shape[0], 64), shape[1]) if shape[1] <= 4096 else True
+    with h5py.File(filename, 'w') as f:
+        entry = f.create_group('entry')
+        entry.attrs['NX_class'] = 'NXentry'
+        if label is not None:
+            entry.create_dataset('title', data=str(label))
+        for k, v in (attrs or {}).items():
+            entry.attrs[k] = v
+        data = entry.create_group('data')
+        data.attrs['NX_class'] = 'NXdata'
+        if signal is not None:
+            data.attrs['signal'] = signal
+        if axes is not None:
+            data.attrs['axes'] = [str(a) for a in axes]
+        for name, values in columns.items():
+            data.create_dataset(name, data=as_map(values, shape), chunks=chunks, compression='gzip', compression_opts=4, shuffle=True)
+        entry.attrs['default'] = 'data'
+        f.attrs['default'] = 'entry'
+    return filename
+
+
+def write_parquet(filename, columns):
+    '''Write a map as a Parquet table, one row per pixel.  Return None
+    if pandas cannot write Parquet here.'''
+    import pandas
+    try:
+        pandas.DataFrame({k: numpy.asarray(v) for k, v in columns.items()}).to_parquet(filename, index=False)
+    except ImportError:
+        return None
+    return filename
+
+
+def write_mat(filename, columns, label=None):
+    '''Write a map as a Matlab file, handing the arrays straight to savemat.'''
+    contents = {k: numpy.asarray(v) for k, v in columns.items()}
+    if label is not None:
+        contents = {'label': label, **contents}
+    savemat(filename, contents)
+    return filename
+
+
+def write_xlsx(filename, columns, title='map', limit=XLSX_LIMIT):
+    '''Write a map as a spreadsheet, one row per pixel, using openpyxl's
+    write-only mode.  Return None, writing nothing, if the map is
+    larger than limit.'''
+    names = list(columns.keys())
+    npixels = len(columns[names[0]])
+    if limit is not None and npixels > limit:
+        return None
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=str(title)[:31])   # the longest sheet name Excel allows
+    ws.append(names)
+    for row in zip(*(numpy.asarray(columns[n]).tolist() for n in names)):
+        ws.append(row)
+    wb.save(filename)
+    return filename
+
+
+def export_map(stem, columns, shape, formats=MAP_FORMATS, signal=None, axes=None, label=None, attrs=None,
+               xlsx=None, mat=None):
+    '''Write a map in each of several formats.
+
+    Parameters
+    ----------
+    stem : str
+        output file name without extension
+    columns, shape, signal, axes, label, attrs
+        as for write_hdf5
+    formats : list of str
+        some of 'hdf5', 'parquet', 'mat', 'xlsx'
+    xlsx, mat : str
+        file names to use instead of stem.xlsx and stem.mat
+
+    Output
+    ------
+    list of the files written
+
+    '''
+    written = []
+    if 'hdf5' in formats:
+        written.append(write_hdf5(stem+'.h5', columns, shape, signal=signal, axes=axes, label=label, attrs=attrs))
+    if 'parquet' in formats:
+        written.append(write_parquet(stem+'.parquet', columns))
+    if 'mat' in formats:
+        written.append(write_mat(mat or stem+'.mat', columns, label=label))
+    if 'xlsx' in formats:
+        written.append(write_xlsx(xlsx or stem+'.xlsx', columns, title=label or 'map'))
+    return [w for w in written if w is not None]
@@ -0,0 +1,236 @@
+'''A stack of raster maps (areascans) of one object measured at several
+energies, for chemical-state mapping.
+
+The maps are read lazily into a single (energy, slow, fast) array of
+signal/I0, memory-mapped to a scratch file when the stack is larger
+than MEMMAP_LIMIT.  From the stack can be made
+
+  * difference maps and ratio maps between any two energies
+  * edge-step normalized maps, given a map below and a map above the edge
+  * per-pixel linear combination fits against reference XANES spectra,
+    done as a single least-squares solve for every pixel at once
+
+Nothing in this module depends on the bsui profile, so it can be used
+from a notebook or from the kafka consumers, given a catalog.
+
+    >>> from BMM.map_stack import MapStack
+    >>> stack = MapStack(bmm_catalog, [below, ce3, ce4, above])
+    >>> stack.energies
+    array([5700. , 5726. , 5738. , 5780. ])
+    >>> fit = stack.lcf({'CeO2': (e1, mu1), 'Ce(NO3)3': (e2, mu2)}, pre=0, post=3)
+    >>> stack.export('/path/to/maps/ce_speciation', {'Ce3+': fit['Ce(NO3)3'], 'Ce4+': fit['CeO2']})
+
+'''
+import os, tempfile
+import numpy
+
+from BMM.map_export import as_map, write_hdf5
+
+MEMMAP_LIMIT = 2**29            # bytes, larger stacks are kept in a memory-mapped scratch file
+
+
+def map_signals(start):
+    '''Return the names of the columns summed to make the signal of an
+    areascan, following difference_data.'''
+    if 'xs' in start['detectors']:
+        det_name = start['plan_name'].split()[-1][:-1]
+        return [det_name+'1', det_name+'2', det_name+'3', det_name+'4']
+    return ['noisy_det']
+
+
+def map_energy(start):
+    '''Return the energy at which an areascan was measured, which is the
+    last word of the hint passed to the kafka consumers.'''
+    try:
+        return float(start['BMM_kafka']['hint'].split()[-1])
+    except (KeyError, IndexError, ValueError):
+        return numpy.nan
+
+
+class MapStack():
+    '''A stack of raster maps of the same region at several energies.
+
+    attributes
+    ==========
+    catalog:
+      the databroker catalog holding the maps
+
+    uids: (list)
+      UIDs of the maps, sorted by energy
+
+    energies: (numpy array)
+      measurement energy of each map, from the start documents unless given
+
+    shape: (int, int)
+      (nslow, nfast) shape of the maps
+
+    motors: (list)
+      names of the slow and fast motors
+
+    memmap: (str)
+      file used to hold a large stack, a scratch file if None
+
+    data: (numpy array)
+      (energy, slow, fast) array of signal/I0, read on first use
+
+    '''
+    def __init__(self, catalog, uids, energies=None, memmap=None):
+        self.catalog = catalog
+        self.memmap  = memmap
+        self.__data  = None
+        self.__axes  = None
+        starts = [catalog[uid].metadata['start'] for uid in uids]
+        if energies is None:
+            energies = [map_energy(s) for s in starts]
+        shapes = set(tuple(s['shape']) for s in starts)
+        if len(shapes) != 1:
+            raise ValueError(f'maps in a stack must have the same shape, these have {sorted(shapes)}')
+        self.shape   = shapes.pop()
+        self.motors  = list(starts[0]['motors'])
+        self.signals = [map_signals(s) for s in starts]
+        order = numpy.argsort(energies, kind='stable')
+        self.uids     = [uids[i] for i in order]
+        self.signals  = [self.signals[i] for i in order]
+        self.energies = numpy.asarray(energies, dtype=float)[order]
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __repr__(self):
+        return f'<MapStack: {len(self)} maps of {self.shape[0]} x {self.shape[1]} pixels, {self.energies.min():.1f} to {self.energies.max():.1f} eV>'
+
+    def allocate(self):
+        '''Make an empty (energy, slow, fast) array, memory-mapped to a
+        file if it is larger than MEMMAP_LIMIT.'''
+        shape = (len(self), *self.shape)
+        if self.memmap is None and numpy.prod(shape) * 8 <= MEMMAP_LIMIT:
+            return numpy.full(shape, numpy.nan)
+        if self.memmap is None:
+            handle, self.memmap = tempfile.mkstemp(suffix='.npy', prefix='mapstack_')
+            os.close(handle)
+        stack = numpy.lib.format.open_memmap(self.memmap, mode='w+', dtype=float, shape=shape)
+        stack[:] = numpy.nan
+        return stack
+
+    def read(self, i):
+        '''Read the I0 and signal columns of one map, returning signal/I0
+        reshaped to the map.  The motor positions are kept from the
+        first map read.'''
+        columns = ['I0', *self.signals[i]]
+        if self.__axes is None:
+            columns = [*self.motors, *columns]
+        table = self.catalog[self.uids[i]].primary.read(columns)
+        if self.__axes is None:
+            self.__axes = [as_map(table[m], self.shape) for m in self.motors]
+        signal = numpy.sum([numpy.asarray(table[s], dtype=float) for s in self.signals[i]], axis=0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return as_map(signal / numpy.asarray(table['I0'], dtype=float), self.shape)
+
+    @property
+    def data(self):
+        if self.__data is None:
+            stack = self.allocate()
+            for i in range(len(self)):
+                stack[i] = self.read(i)
+            self.__data = stack
+        return self.__data
+
+    @property
+    def axes(self):
+        '''The slow and fast motor positions as maps.'''
+        if self.__axes is None:
+            self.read(0)
+        return self.__axes
+
+    def index(self, which):
+        '''Return the position in the stack of a map given by position,
+        UID, or energy (the closest).'''
+        if isinstance(which, str):
+            return self.uids.index(which)
+        if isinstance(which, (int, numpy.integer)):
+            return int(which)
+        return int(numpy.argmin(numpy.abs(self.energies - which)))
+
+    def difference(self, high, low):
+        '''Map of normalized signal at one energy minus another.  high and
+        low are positions, UIDs, or energies, as for index.'''
+        return self.data[self.index(high)] - self.data[self.index(low)]
+
+    def ratio(self, numerator, denominator):
+        '''Map of normalized signal at one energy divided by another.'''
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self.data[self.index(numerator)] / self.data[self.index(denominator)]
+
+    def normalized(self, pre, post):
+        '''Return the stack edge-step normalized, pixel by pixel, using the
+        map at pre as the background and the map at post as the edge step.'''
+        pre, post = self.data[self.index(pre)], self.data[self.index(post)]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return (self.data - pre) / (post - pre)
+
+    def lcf(self, references, pre=None, post=None, sum_to_one=False):
+        '''Fit every pixel of the stack as a linear combination of
+        reference XANES spectra, in a single least-squares solve.
+
+        Parameters
+        ----------
+        references : dict
+            name : (energy array, normalized mu array) of each standard
+        pre, post : int, str, or float
+            maps used to edge-step normalize the stack, see normalized.
+            The stack is fit as is if either is None.
+        sum_to_one : bool
+            if True, strongly weight the weights of each pixel to sum to 1
+
+        Output
+        ------
+        dict of name : (nslow, nfast) map of weights, plus 'residual',
+        the rms misfit at each pixel.  Pixels with a missing value at any
+        energy are NaN.
+
+        '''
+        names = list(references.keys())
+        basis = numpy.column_stack([numpy.interp(self.energies, *map(numpy.asarray, references[n])) for n in names])
+        stack = self.data if pre is None or post is None else self.normalized(pre, post)
+        pixels = numpy.asarray(stack).reshape(len(self), -1)
+        good = numpy.all(numpy.isfinite(pixels), axis=0)
+        target = pixels[:, good]
+        if sum_to_one:
+            weight = 1e3 * max(numpy.abs(basis).max(), 1)
+            basis = numpy.vstack([basis, numpy.full(len(names), weight)])
+            target = numpy.vstack([target, numpy.full(target.shape[1], weight)])
+        weights, _, _, _ = numpy.linalg.lstsq(basis, target, rcond=None)
+        misfit = pixels[:, good] - basis[:len(self)] @ weights
+
+        result = dict()
+        for n, w in zip(names, weights):
+            this = numpy.full(pixels.shape[1], numpy.nan)
+            this[good] = w
+            result[n] = this.reshape(self.shape)
+        residual = numpy.full(pixels.shape[1], numpy.nan)
+        residual[good] = numpy.sqrt(numpy.mean(misfit**2, axis=0))
+        result['residual'] = residual.reshape(self.shape)
+        return result
+
+    def export(self, filename, maps=None, label=None):
+        '''Write maps made from the stack, along with the normalized map at
+        each energy, to an HDF5 file as a NeXus NXdata group.
+
+        Parameters
+        ----------
+        filename : str
+            output file, .h5 is appended if missing
+        maps : dict
+            name : (nslow, nfast) map, e.g. from difference, ratio, or lcf
+        label : str
+            title of the file
+
+        '''
+        if not filename.endswith('.h5'):
+            filename = filename + '.h5'
+        columns = {m: a.ravel() for m, a in zip(self.motors, self.axes)}
+        columns.update({f'normalized_{e:.1f}': self.data[i].ravel() for i, e in enumerate(self.energies)})
+        columns.update({k: numpy.asarray(v).ravel() for k, v in (maps or {}).items()})
+        signal = next(iter(maps)) if maps else f'normalized_{self.energies[-1]:.1f}'
+        return write_hdf5(filename, columns, self.shape, signal=signal, axes=self.motors, label=label,
+                          attrs={'uids': self.uids, 'energies': self.energies})
@@ -14,6 +14,7 @@ user_ns = vars(user_ns_module)
 from BMM.user_ns.bmm         import BMMuser
 from BMM.user_ns.dcm         import dcm
 from BMM.user_ns.instruments import m2, m3, m2_bender
+from BMM.tuning_cache        import tuning_cache
 
 class TC(Device):
     temperature = Cpt(EpicsSignal, 'T-I-I')
@@ -171,6 +172,7 @@ def bmm_metadata(measurement   = 'transmission',
     collection = sys.executable.split('/')[-3]
     python_version = sys.version.split(' ')[0]
     md['Beamline']['software'] = f'Bluesky {bluesky_version}, Ophyd {ophyd_version}, DataBroker {databroker_version}, Python {python_version}, {collection}'
+    md['_tuning'] = tuning_cache.metadata()   # how change_edge's alignment scans were run or skipped
 
     if direction > 0:
         md['Mono']['direction'] = 'increasing in energy'
@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 #plt.ion()
 import h5py
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.ensemble import RandomForestClassifier
@@ -20,6 +21,10 @@ user_ns = vars(user_ns_module)
 
 from BMM.functions       import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 from BMM.larch_interface import Pandrosus
+from BMM.run_cache       import RunCache
+from BMM.ml_core         import GOOD_EMOJI, BAD_EMOJI, classify, rationalize_mu, fetch_evaluation
+from BMM.ml_core         import measured_mu, feature_row, predict
+from BMM.workspace       import rkvs
 #from BMM.functions import plotting_mode
 from BMM.user_ns.base import WORKSPACE, bmm_catalog
 from BMM.user_ns.bmm  import BMMuser
@@ -36,6 +41,67 @@ from BMM.user_ns.bmm  import BMMuser
 
 from BMM.user_ns.base import startup_dir
 
+class FeatureStore():
+    '''An HDF5 file of measurements interpolated onto the grid of the
+    data evaluation model, keyed by uid.  The layout is the same as
+    the training set files: one group per uid holding "energy" and
+    "mu" datasets.  The group attributes record the measurement mode
+    and the most recent prediction of the model (not the "score"
+    attribute, which is reserved for human-assigned training labels).
+
+    Once a measurement is in the store, retraining or re-scoring it
+    does not require reading it from Tiled again.
+
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+
+    def keys(self):
+        if not os.path.isfile(self.filename):
+            return []
+        with h5py.File(self.filename, 'r') as f:
+            return list(f.keys())
+
+    def __contains__(self, uid):
+        if not os.path.isfile(self.filename):
+            return False
+        with h5py.File(self.filename, 'r') as f:
+            return uid in f
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, uids):
+        '''Return a dict of uid : mu for those uids found in the store.'''
+        found = dict()
+        if not os.path.isfile(self.filename):
+            return found
+        with h5py.File(self.filename, 'r') as f:
+            for uid in uids:
+                if uid in f:
+                    found[uid] = f[uid]['mu'][()]
+        return found
+
+    def put(self, features):
+        '''Add to the store.  features is a dict of uid : (energy, mu, mode).'''
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with h5py.File(self.filename, 'a') as f:
+            for uid, (energy, mu, mode) in features.items():
+                if uid in f:
+                    del f[uid]
+                grp = f.create_group(uid)
+                grp.create_dataset("energy", data=energy)
+                grp.create_dataset("mu", data=mu)
+                grp.attrs['mode'] = str(mode)
+
+    def mark(self, predictions):
+        '''Record predictions, a dict of uid : score.'''
+        with h5py.File(self.filename, 'a') as f:
+            for uid, score in predictions.items():
+                if uid in f:
+                    f[uid].attrs['prediction'] = int(score)
+
+
 class BMMDataEvaluation:
     '''A very simple machine learning model for recognizing when an XAS
     scan goes horribly awry.
@@ -56,9 +122,12 @@ class BMMDataEvaluation:
                          os.path.join(self.folder, 'verygood_training_set.hdf5'),
                          os.path.join(self.folder, '2023-04-12_training_set.hdf5'),]
         self.matrix   = os.path.join(self.folder, 'scaler.joblib')
-        self.good_emoji = ':heavy_check_mark:'
-        self.bad_emoji  = ':heavy_multiplication_x:'
+        self.store    = FeatureStore(os.path.join(WORKSPACE, 'ML', 'feature_store.hdf5'))
+        self.hdf5.append(self.store.filename)   # entries given a "score" attribute by hand join the training set
+        self.good_emoji = GOOD_EMOJI
+        self.bad_emoji  = BAD_EMOJI
         self.tab = ''
+        self._runs    = None
         try:
             if os.path.isfile(self.model):
                 self.clf = load(self.model)
@@ -68,6 +137,13 @@ class BMMDataEvaluation:
             print(str(E))
             self.retrain()
             
+    @property
+    def runs(self):
+        '''Cache of runs from the catalog, so each record is read from Tiled only once.'''
+        if self._runs is None:
+            self._runs = RunCache(user_ns['db'].v2)
+        return self._runs
+
     def retrain(self):
         self.tab = '\t'*4
         print(self.tab+"regenerating joblib files")
@@ -153,9 +229,7 @@ class BMMDataEvaluation:
     def rationalize_mu(self, en, mu):
         '''Return energy and mu on a "rationalized" grid of equally spaced points.  See self.GRIDSIZE
         '''
-        ee=list(numpy.arange(float(en[0]), float(en[-1]), (float(en[-1])-float(en[0]))/self.GRIDSIZE))
-        mm=numpy.interp(ee, en, mu)
-        return(ee, mm)
+        return rationalize_mu(en, mu, gridsize=self.GRIDSIZE)
 
 
     def get_uid_list(self, mode='fluorescence'):
@@ -242,10 +316,11 @@ class BMMDataEvaluation:
                             score == 0
                     except:
                         continue
-                    mu = list(f[uid]['mu'])
                     scores.append(score)
-                    data.append(mu)
+                    data.append(f[uid]['mu'][()])
+                f.close()
 
+        data = numpy.vstack(data)
         self.trainX, self.X, self.trainy, self.y = train_test_split(data, scores, random_state=0)
         self.scaler.fit(self.trainX)
         dump(self.scaler, self.matrix)
@@ -295,52 +370,88 @@ class BMMDataEvaluation:
             when not None, used to specify fluorescence or transmission (for a data set that has both)
 
         '''
-        this = user_ns['db'].v2[uid]
-        if mode is None:
-            mode = this.metadata['start']['XDI']['_mode'][0]
-        element = this.metadata['start']['XDI']['Element']['symbol']
-        t = this.primary.read()
-        i0 = t['I0']
-        en = t['dcm_energy']
-        if mode in ('fluorescence', 'dante', 'pilatus'):
-            channels = this.metadata['start']['XDI']['_dtc']
-            signal = numpy.zeros(len(en))
-            for ch in channels:
-                signal += numpy.array(t[ch])
-            mu = signal/i0
-        elif mode == 'transmission':
-            it = this.primary.read()['It']
-            mu = numpy.log(abs(i0/it))
-        elif mode == 'reference':
-            it = this.primary.read()['It']
-            ir = this.primary.read()['Ir']
-            mu = numpy.log(abs(it/ir))
-        elif mode == 'yield':
-            iy = this.primary.read()['Iy']
-            mu = iy/i0
-        else:                   #  this is old skool analog fluorescence data.  Try to evaluate...
-            if element in str(this.primary.read()['vor:vor_names_name3'][0].values):
-                signal = this.primary.read()['DTC1'] + this.primary.read()['DTC2'] + this.primary.read()['DTC3'] + this.primary.read()['DTC4']
-            elif element in str(this.primary.read()['vor:vor_names_name15'][0].values):
-                signal = this.primary.read()['DTC2_1'] + this.primary.read()['DTC2_2'] + this.primary.read()['DTC2_3'] + this.primary.read()['DTC2_4']
-            elif element in str(this.primary.read()['vor:vor_names_name19'][0].values):
-                signal = this.primary.read()['DTC3_1'] + this.primary.read()['DTC3_2'] + this.primary.read()['DTC3_3'] + this.primary.read()['DTC3_4']
-            else:
-                print('cannot figure out fluorescence signal')
-                #print(f'vor:vor_names_name3 {}')
-                return()
-            mu = signal/i0
-        e,m = self.rationalize_mu(en, mu)
-        if len(e) > self.GRIDSIZE:
-            e, m = e[:-1], m[:-1]
-        m = self.scaler.transform([m,])
-        #if len(m) > self.GRIDSIZE:
-        #    m = m[:-1]
-        result = self.clf.predict(m)[0]
+        result = classify(self.clf, self.scaler, self.runs[uid], mode=mode, gridsize=self.GRIDSIZE)
+        if result is None:
+            return()
         if result == 1:
             return(result, self.good_emoji)
         else:
             return(result, self.bad_emoji)
+
+    def evaluate_many(self, uids, mode=None, workers=8, refresh=False):
+        '''Evaluate a batch of measurements.  Measurements not already in
+        the feature store are read from Tiled concurrently and added
+        to the store.  All measurements are then interpolated into a
+        single feature matrix and scored with one call to the model.
+
+        This returns a dict of uid : (score, emoji).  A uid which
+        could not be read or evaluated maps to None.
+
+        Parameters
+        ----------
+        uids : list of str
+            uids of data to be evaluated
+        mode : str
+            when not None, used to specify fluorescence or transmission for every data set
+        workers : int
+            number of concurrent reads from Tiled [8]
+        refresh : bool
+            True to read every measurement from Tiled, ignoring the feature store
+
+        '''
+        uids = list(uids)
+        known = dict() if refresh else self.store.get(uids)
+        missing = [u for u in uids if u not in known]
+
+        def fetch(uid):
+            try:
+                return(uid, measured_mu(user_ns['db'].v2[uid], mode=mode))
+            except Exception as E:
+                print(f'could not read {uid}: {E}')
+                return(uid, None)
+
+        new = dict()
+        if len(missing) > 0:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for uid, found in pool.map(fetch, missing):
+                    if found is None or len(found[0]) < self.GRIDSIZE/2:
+                        continue
+                    energy, mu = feature_row(*found, gridsize=self.GRIDSIZE)
+                    new[uid] = (energy, mu, mode)
+                    known[uid] = mu
+            self.store.put(new)
+
+        evaluated = [u for u in uids if u in known]
+        results = {u: None for u in uids}
+        if len(evaluated) == 0:
+            return results
+        matrix = numpy.vstack([known[u] for u in evaluated])
+        scores = predict(self.clf, self.scaler, matrix)
+        for uid, score in zip(evaluated, scores):
+            results[uid] = (int(score), self.good_emoji if score == 1 else self.bad_emoji)
+        self.store.mark(dict(zip(evaluated, scores)))
+        return results
+
+    def rescore(self):
+        '''Re-evaluate every measurement in the feature store with the
+        current model, without reading anything from Tiled.  Returns a
+        dict of uid : (score, emoji).'''
+        return self.evaluate_many(self.store.keys())
+
+    def result(self, uid, timeout=0):
+        '''Return the (score, emoji) tuple for a measurement as posted to
+        redis by the evaluation worker in the kafka plot manager.
+        Return None if the evaluation is not (yet) available.
+
+        Parameters
+        ----------
+        uid : str
+            uid of evaluated data
+        timeout : float
+            wait this many seconds for the worker to post the evaluation [0]
+
+        '''
+        return fetch_evaluation(rkvs, uid, timeout=timeout)
     
     def test_failure(self, filename=None):
         '''Examine and process data that failed the current iteration of the data evaluator. 
@@ -0,0 +1,138 @@
+'''The arithmetic of BMM's data evaluation model, free of any
+dependence on the bsui profile, so that it can be used both by
+BMM.ml.BMMDataEvaluation and by the evaluation worker in the kafka
+consumer (consumer/data_evaluation.py).
+
+'''
+import json
+import numpy
+
+GRIDSIZE   = 401
+GOOD_EMOJI = ':heavy_check_mark:'
+BAD_EMOJI  = ':heavy_multiplication_x:'
+
+## modes which can be evaluated by the model
+EVALUABLE  = ('transmission', 'fluorescence', 'reference', 'yield', 'pilatus', 'dante')
+
+
+def evaluation_key(uid):
+    '''Redis key holding the evaluation of a scan.'''
+    return f'BMM:ml:{uid}'
+
+
+def rationalize_mu(en, mu, gridsize=GRIDSIZE):
+    '''Return energy and mu on a "rationalized" grid of equally spaced points.
+    '''
+    ee=list(numpy.arange(float(en[0]), float(en[-1]), (float(en[-1])-float(en[0]))/gridsize))
+    mm=numpy.interp(ee, en, mu)
+    return(ee, mm)
+
+
+def measured_mu(run, mode=None):
+    '''Construct energy and mu from the primary stream of a run.  Return
+    None if the fluorescence signal of old, analog data cannot be
+    identified.
+
+    Parameters
+    ----------
+    run : Tiled run or BMM.run_cache.CachedRun
+        record of the measurement
+    mode : str
+        when not None, used to specify fluorescence or transmission (for a data set that has both)
+
+    '''
+    if mode is None:
+        mode = run.metadata['start']['XDI']['_mode'][0]
+    element = run.metadata['start']['XDI']['Element']['symbol']
+    ## read only the columns needed, the primary stream may hold large MCA spectra
+    if mode in ('fluorescence', 'dante', 'pilatus'):
+        t = run.primary.read(['dcm_energy', 'I0', *run.metadata['start']['XDI']['_dtc']])
+    elif mode == 'transmission':
+        t = run.primary.read(['dcm_energy', 'I0', 'It'])
+    elif mode == 'reference':
+        t = run.primary.read(['dcm_energy', 'I0', 'It', 'Ir'])
+    elif mode == 'yield':
+        t = run.primary.read(['dcm_energy', 'I0', 'Iy'])
+    else:
+        t = run.primary.read()
+    i0 = t['I0']
+    en = t['dcm_energy']
+    if mode in ('fluorescence', 'dante', 'pilatus'):
+        channels = run.metadata['start']['XDI']['_dtc']
+        signal = numpy.zeros(len(en))
+        for ch in channels:
+            signal += numpy.array(t[ch])
+        mu = signal/i0
+    elif mode == 'transmission':
+        it = t['It']
+        mu = numpy.log(abs(i0/it))
+    elif mode == 'reference':
+        it = t['It']
+        ir = t['Ir']
+        mu = numpy.log(abs(it/ir))
+    elif mode == 'yield':
+        iy = t['Iy']
+        mu = iy/i0
+    else:                   #  this is old skool analog fluorescence data.  Try to evaluate...
+        if element in str(t['vor:vor_names_name3'][0].values):
+            signal = t['DTC1'] + t['DTC2'] + t['DTC3'] + t['DTC4']
+        elif element in str(t['vor:vor_names_name15'][0].values):
+            signal = t['DTC2_1'] + t['DTC2_2'] + t['DTC2_3'] + t['DTC2_4']
+        elif element in str(t['vor:vor_names_name19'][0].values):
+            signal = t['DTC3_1'] + t['DTC3_2'] + t['DTC3_3'] + t['DTC3_4']
+        else:
+            print('cannot figure out fluorescence signal')
+            return None
+        mu = signal/i0
+    return(en, mu)
+
+
+def feature_row(en, mu, gridsize=GRIDSIZE):
+    '''Return the grid of gridsize equally spaced points spanning the
+    energy array and mu interpolated onto it.  This is the same grid
+    as rationalize_mu, without the extra point arange sometimes adds.'''
+    en = numpy.asarray(en, dtype=float)
+    grid = en[0] + (en[-1]-en[0]) * numpy.arange(gridsize) / gridsize
+    return(grid, numpy.interp(grid, en, numpy.asarray(mu, dtype=float)))
+
+
+def feature_matrix(spectra, gridsize=GRIDSIZE):
+    '''Interpolate a list of (energy, mu) pairs onto the grid used by
+    the model.  Return a 2D array with one row per spectrum, ready to
+    be handed to the scaler and classifier in a single call.'''
+    matrix = numpy.empty((len(spectra), gridsize))
+    for i, (en, mu) in enumerate(spectra):
+        matrix[i] = feature_row(en, mu, gridsize=gridsize)[1]
+    return matrix
+
+
+def predict(clf, scaler, matrix):
+    '''Score every row of a feature matrix with one call to the model.'''
+    return clf.predict(scaler.transform(matrix)).astype(int)
+
+
+def classify(clf, scaler, run, mode=None, gridsize=GRIDSIZE):
+    '''Interpolate a measurement onto the grid of the training set and
+    subject it to the model.  Return the score (1 or 0) or None if mu
+    could not be constructed.'''
+    found = measured_mu(run, mode=mode)
+    if found is None:
+        return None
+    return int(predict(clf, scaler, feature_matrix([found], gridsize=gridsize))[0])
+
+
+def fetch_evaluation(rkvs, uid, timeout=0):
+    '''Return the (score, emoji) tuple posted to redis by the evaluation
+    worker for a scan, or None if it is not available.  With a timeout
+    in seconds, wait that long for the evaluation to be posted.'''
+    key = evaluation_key(uid)
+    answer = rkvs.get(key)
+    if answer is None and timeout > 0:
+        ## the worker pushes a token onto this list when it is done,
+        ## pop and push it back so that any other waiter will see it
+        rkvs.brpoplpush(key+':done', key+':done', timeout=timeout)
+        answer = rkvs.get(key)
+    if answer is None:
+        return None
+    result = json.loads(answer)
+    return(result['score'], result['emoji'])
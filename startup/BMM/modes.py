@@ -1,6 +1,5 @@
 import json, time, os
 
-from openpyxl import load_workbook
 
 from bluesky.plan_stubs import null, sleep, mv, mvr
 
@@ -10,6 +9,8 @@ from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg,
 from BMM.kafka         import kafka_message
 from BMM.linescans     import rocking_curve, slit_height, mirror_pitch, wiggle_bct
 from BMM.logging       import BMM_log_info, BMM_msg_hook, report
+from BMM.lookup_cache  import lookup_table, modes_from_xlsx
+from BMM.motion        import mv_needed, settle
 from BMM.motor_status  import motor_status
 from BMM.resting_state import resting_state_plan
 from BMM.suspenders    import BMM_clear_to_start
@@ -23,38 +24,10 @@ from BMM.user_ns.base   import profile_configuration
 MODEDATA = None
 def read_mode_data():
      '''Read the lookup table Modes.xlsx and return position and encoder
-     readings as a dict.
+     readings as a dict.  The spreadsheet is parsed only when it has
+     changed, see BMM/lookup_cache.py.
      '''
-     wb = load_workbook(os.path.join(user_ns["BMM_CONFIGURATION_LOCATION"], 'Modes.xlsx'), read_only=True);
-     ws = wb['Modes A-F']
-     bl = dict()
-     header = 1
-     for row in ws.rows:
-         axis = dict()
-         if str(row[0].value) == 'Instrument':
-             header = 0
-             continue
-         if header == 1: continue
-         alias           = row[2].value
-         if 'fe_slits' in alias: continue
-         axis['PV']      = row[1].value
-         axis['desc']    = row[3].value
-         axis['A']       = row[4].value
-         axis['A_REP']   = row[5].value
-         axis['B']       = row[6].value
-         axis['B_REP']   = row[7].value
-         axis['C']       = row[8].value
-         axis['C_REP']   = row[9].value
-         axis['D']       = row[10].value
-         axis['D_REP']   = row[11].value
-         axis['E']       = row[12].value
-         axis['E_REP']   = row[13].value
-         axis['F']       = row[14].value
-         axis['F_REP']   = row[15].value
-         axis['XRD']     = row[19].value
-         axis['XRD_REP'] = row[20].value
-         bl[alias] = axis
-     return bl
+     return lookup_table(os.path.join(user_ns["BMM_CONFIGURATION_LOCATION"], 'Modes.xlsx'), modes_from_xlsx)
 
 MODEDATA = read_mode_data();
 
@@ -217,7 +190,7 @@ def verify_limits(targets):
      
           
 
-def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True, insist=False, no_ref=False):
+def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True, insist=False, no_ref=False, also=None):
      '''Move the photon delivery system to a new mode. 
      A: focused at XAS end station, energy > 8000
      B: focused at XAS end station, energy < 6000
@@ -226,11 +199,16 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
      E: unfocused, 6000 < energy < 8000
      F: unfocused, energy < 8000
      XRD: focused at XRD end station, energy > 8000
+
+     Motors already in position for the new mode are not moved (see
+     BMM/motion.py).  also is a list of further mv() arguments,
+     e.g. [slits3.hsize, 3], to move along with the mode change.
      '''
      BMMuser, RE, dcm, dm3_bct, slits3 = user_ns['BMMuser'], user_ns['RE'], user_ns['dcm'], user_ns['dm3_bct'], user_ns['slits3']
      xafs_table, m3, m2, m2_bender = user_ns['xafs_table'], user_ns['m3'], user_ns['m2'], user_ns['m2_bender']
      m2_xu, m2_xd = user_ns['m2_xu'], user_ns['m2_xd']
      dcm_bragg, dcm_roll, xafs_ref, xafs_refx = user_ns['dcm_bragg'], user_ns['dcm_roll'], user_ns['xafs_ref'], user_ns['xafs_refx']
+     also = also or []
      if mode is None:
           print('No mode specified')
           return(yield from null())
@@ -388,10 +366,10 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
 
      if mode == 'XRD':
           print('For XRD mode, move to old (pre 4/2025) position for dcm_roll.')
-          yield from mv(dcm_roll, -4.5608)
+          yield from mv_needed(dcm_roll, -4.5608)
      else:
           print('For all XAS modes, move to new (post 4/2025) position for dcm_roll.')
-          yield from  mv(dcm_roll, profile_configuration.getfloat('dcm', f'roll_{dcm._crystal}'))
+          yield from mv_needed(dcm_roll, profile_configuration.getfloat('dcm', f'roll_{dcm._crystal}'))
           
      if mode in ('D', 'E', 'F') and user_ns['slits3'].vsize.position < 0.4:
           print('Slit height appears to be set for focused beam.  Opening slits.')
@@ -406,7 +384,7 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
                raise ValueError
           try:
                report('M2 remaining collimated', slack=True)
-               yield from mv(*base)
+               yield from mv_needed(*base, *also)
           except Exception as E:
                verbosebold_msg(f"\nThis is the problem:\n\t{E}\n")
                count = 0
@@ -426,7 +404,7 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
                     #dm3_bct.clear_encoder_loss()
                     yield from sleep(1)
                     try:
-                         yield from mv(*base)
+                         yield from mv_needed(*base, *also)
                     except:
                          pass
                
@@ -436,7 +414,7 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
                raise ValueError
           try:
                report('M2 remaining focused', slack=True)
-               yield from mv(*base)
+               yield from mv_needed(*base, *also)
           except Exception as E:
                verbosebold_msg(f"\nThis is the problem:\n\t{E}\n")
                count = 0
@@ -456,7 +434,7 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
                     #dm3_bct.clear_encoder_loss()
                     yield from sleep(1)
                     try:
-                         yield from mv(*base)
+                         yield from mv_needed(*base, *also)
                     except:
                          pass
      else:
@@ -481,7 +459,7 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
                raise ValueError
           try:
                report('Changing M2 setup', slack=True)
-               yield from mv(*base)
+               yield from mv_needed(*base, *also)
           except Exception as E:
                verbosebold_msg(f"\nThis is the problem:\n\t{E}\n")
                count = 0
@@ -502,13 +480,13 @@ def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True,
                     #dm3_bct.clear_encoder_loss()
                     yield from sleep(1)
                     try:
-                         yield from mv(*base)
+                         yield from mv_needed(*base, *also)
                     except:
                          pass
 
      #print(base)
                     
-     yield from sleep(1.0)
+     yield from settle(*base[::2], timeout=1.0)
      yield from mv(m2_bender.kill_cmd, 1)
      yield from mv(dm3_bct.kill_cmd, 1)
      yield from m2.kill_jacks()
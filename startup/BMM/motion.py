@@ -0,0 +1,111 @@
+import time
+
+from bluesky.plan_stubs import sleep, mv
+
+## moves closer than this to their target are skipped, by motor name.
+## others use the display precision of the motor, or DEFAULT_TOLERANCE
+TOLERANCES = {'dcm_energy'  : 0.1,      # eV
+              'xafs_ref'    : 0.01,     # degrees on the reference wheel
+              'slits3_hsize': 0.005,
+              'slits3_vsize': 0.005,
+              }
+DEFAULT_TOLERANCE = 0.001
+
+
+def tolerance(motor):
+    '''Return how close to its target motor must be for a move to be skipped.'''
+    if motor.name in TOLERANCES:
+        return TOLERANCES[motor.name]
+    try:
+        precision = int(motor.precision)
+    except Exception:
+        return DEFAULT_TOLERANCE
+    return max(10**-precision, DEFAULT_TOLERANCE)
+
+
+def in_position(motor, target):
+    try:
+        return abs(motor.position - target) <= tolerance(motor)
+    except Exception:           # not a positioner, e.g. a kill_cmd signal, so always "move" it
+        return False
+
+
+def pending_moves(targets):
+    '''Take a list of mv() arguments, like the base list in change_mode,
+    and return (the list without the moves whose motors are already at
+    their targets, names of the motors left out).'''
+    pending, skipped = [], []
+    for motor, target in zip(targets[::2], targets[1::2]):
+        if in_position(motor, target):
+            skipped.append(motor.name)
+        else:
+            pending.extend([motor, target])
+    return pending, skipped
+
+
+def mv_needed(*args):
+    '''mv() only those motors which are not already at their targets, all
+    at once.  Return the names of the motors which did not need to move.'''
+    pending, skipped = pending_moves(list(args))
+    if len(pending) > 0:
+        yield from mv(*pending)
+    return skipped
+
+
+def settle(*motors, timeout=1.0, poll=0.05, ready=None):
+    '''Wait until none of these motors is moving and ready(), if given,
+    returns True, but no longer than timeout seconds.  This replaces a
+    fixed sleep of timeout seconds after, say, killing the mirror jacks.'''
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        yield from sleep(poll)
+        if any(getattr(m, 'moving', False) for m in motors):
+            continue
+        if ready is not None and ready() is False:
+            continue
+        break
+
+
+class StepTimer():
+    '''Time the steps of a plan, like change_edge.
+
+        timer = StepTimer()
+        with timer.step('mode change'):
+            yield from change_mode(...)
+        print(timer.report())
+
+    attributes
+    ==========
+    steps: (list)
+      (label, seconds) for each step, in the order run
+
+    '''
+    def __init__(self):
+        self.steps = []
+        self.begin = time.monotonic()
+
+    def step(self, label):
+        return _Step(self, label)
+
+    def total(self):
+        return time.monotonic() - self.begin
+
+    def report(self, title='step'):
+        text = [f'   {title:32} {"seconds":>8}']
+        for label, elapsed in self.steps:
+            text.append(f'   {label:32} {elapsed:8.1f}')
+        text.append(f'   {"total":32} {self.total():8.1f}')
+        return '\n'.join(text)
+
+
+class _Step():
+    def __init__(self, timer, label):
+        self.timer, self.label = timer, label
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.steps.append((self.label, time.monotonic() - self.start))
+        return False
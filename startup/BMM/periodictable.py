@@ -1,5 +1,7 @@
 
-import xraylib
+import xraylib, numpy
+from bisect import bisect_left
+from functools import lru_cache
 #run_report(__file__, text='help with element names, symbols, and Z numbers')
 
 PERIODIC_TABLE = '\
@@ -71,9 +73,80 @@ def edge_number(edge):
         edge = EDGES[edge.capitalize()]
     return edge
         
+@lru_cache(maxsize=1024)
 def edge_energy(element, edge):
     element = Z_number(element)
     if element is None: return None
     edge = edge_number(edge)
     if edge is None: return None
     return round(xraylib.EdgeEnergy(int(element), int(edge))*1000, 1)
+
+
+## the emission line marked on XRF plots for each edge, K is a weighted average of Kα1 and Kα2
+FLUORESCENCE_LINES = {'K':  ((xraylib.KL3_LINE, 2/3), (xraylib.KL2_LINE, 1/3)),
+                      'L3': ((xraylib.L3M5_LINE, 1),),
+                      'L2': ((xraylib.L2M4_LINE, 1),),
+                      'L1': ((xraylib.L1M3_LINE, 1),), }
+
+@lru_cache(maxsize=1024)
+def line_energy(element, edge):
+    '''Return the energy in eV of the emission line from this edge that
+    is marked on XRF plots, or None.'''
+    z = Z_number(element)
+    if z is None or str(edge).upper() not in FLUORESCENCE_LINES:
+        return None
+    return sum(xraylib.LineEnergy(int(z), line)*w for line, w in FLUORESCENCE_LINES[str(edge).upper()]) * 1000
+
+
+## edges considered when identifying data from its edge energy, in
+## order of preference when two are equally close
+EDGE_SEARCH = ('K', 'L3', 'L2', 'L1')
+EDGE_Z      = (14, 98)          # Si to Bk, as larch.xray stops at Cf
+
+## edges which are close to a much more likely edge
+EDGE_OVERRIDES = {('Nd', 'L1'): ('Fe', 'K'),    # Fe oxide
+                  ('Sm', 'L1'): ('Co', 'K'),    # Co oxide
+                  ('Er', 'L1'): ('Ni', 'K'),    # Ni oxide
+                  ('Ce', 'L1'): ('Mn', 'K'),    # Mn oxide
+                  ('Ir', 'L1'): ('Bi', 'L3'),   # prefer Bi l3 to Ir L1
+                  ('Pb', 'L2'): ('Rb', 'K'),    # prefer Rb K to Pb L2
+                  ('Ba', 'L1'): ('Cr', 'K'),    # prefer Cr K to Ba L1
+                  ('Bk', 'L2'): ('Pd', 'K'),    # prefer Pd K to Bk L2
+                  }
+
+
+def _edge_table():
+    '''Tabulate every edge in EDGE_SEARCH for Z in EDGE_Z, sorted by
+    energy, then by preference.'''
+    rows = []
+    for rank, ed in enumerate(EDGE_SEARCH):
+        for z in range(*EDGE_Z):
+            try:
+                en = xraylib.EdgeEnergy(z, int(edge_number(ed)))*1000
+            except ValueError:
+                continue
+            if en > 0:
+                rows.append((en, rank, z))
+    rows.sort()
+    table = numpy.array(rows)
+    return table[:,0], table[:,1].astype(int), table[:,2].astype(int)
+
+EDGE_TABLE_ENERGY, EDGE_TABLE_RANK, EDGE_TABLE_Z = _edge_table()
+
+
+def nearest_edge(energy, overrides=True):
+    '''Return (element symbol, edge) of the edge nearest in energy (eV),
+    preferring K to L3 to L2 to L1, then lower Z, when two are equally
+    close.  If overrides is True, apply EDGE_OVERRIDES to the answer.'''
+    energies = EDGE_TABLE_ENERGY
+    here = bisect_left(energies, energy)
+    candidates = []
+    if here < len(energies):
+        candidates.append(here)
+    if here > 0:
+        candidates.append(bisect_left(energies, energies[here-1]))   # first of any equal energies
+    best = min(candidates, key=lambda i: (abs(energies[i] - energy), EDGE_TABLE_RANK[i], EDGE_TABLE_Z[i]))
+    answer = (element_symbol(int(EDGE_TABLE_Z[best])), EDGE_SEARCH[EDGE_TABLE_RANK[best]])
+    if overrides:
+        return EDGE_OVERRIDES.get(answer, answer)
+    return answer
@@ -6,7 +6,7 @@ except ImportError:
     def is_re_worker_active():
         return False
 
-import numpy, os, re, shutil, openpyxl, uuid
+import numpy, os, re, shutil, uuid
 import textwrap, configparser, datetime
 import matplotlib.pyplot as plt
 
@@ -29,11 +29,12 @@ from BMM.motor_status    import motor_status
 from BMM.resting_state   import resting_state_plan
 from BMM.suspenders      import BMM_suspenders, BMM_clear_to_start, BMM_clear_suspenders
 from BMM.xafs            import file_exists
+from BMM.map_export      import write_xlsx, write_mat, write_hdf5
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
 
-from BMM.user_ns.base      import bmm_catalog
+from BMM.user_ns.base      import bmm_catalog, tiled_writer
 from BMM.user_ns.dwelltime import _locked_dwell_time
 
 def read_ini(inifile, **kwargs):
@@ -174,6 +175,8 @@ def difference_data(uid1, uid2, tag):
     uid2 : (str) the UID of the baseline map
     tag  : (str) a string to use to identify this difference spectrum
 
+    For more than two maps, see BMM.map_stack.MapStack.
+
     '''
 
     ## HIP1
@@ -185,11 +188,16 @@ def difference_data(uid1, uid2, tag):
     motors = bmm_catalog[uid1].metadata['start']['motors']
     [nslow, nfast] = bmm_catalog[uid1].metadata['start']['shape']
 
-    ## slurp in data
+    ## slurp in data, only the columns needed
+    if 'xs' in bmm_catalog[uid1].metadata['start']['detectors']:
+        det_name = bmm_catalog[uid1].metadata['start']['plan_name'].split()[-1][:-1]
+        signals  = [det_name+'1', det_name+'2', det_name+'3', det_name+'4']
+    else:
+        signals  = ['noisy_det']
     print('Reading primary data set...')
-    datatable1 = bmm_catalog[uid1].primary.read()
+    datatable1 = bmm_catalog[uid1].primary.read([*motors, 'I0', *signals])
     print('Reading secondary data set...')
-    datatable2 = bmm_catalog[uid2].primary.read()
+    datatable2 = bmm_catalog[uid2].primary.read(['I0', *signals])
 
     ## common arrays and I0 arrays
     slow = numpy.array(datatable1[motors[0]])
@@ -207,31 +215,30 @@ def difference_data(uid1, uid2, tag):
         z1 = numpy.array(datatable1['noisy_det'])
         z2 = numpy.array(datatable2['noisy_det'])
 
-    ## save map in xlsx format
-    wb = openpyxl.Workbook()
-    ws1 = wb.active
-    ws1.title = tag
-    ws1.append(('slow', 'fast', 'difference', 'normalized_1', 'normalized_2', 'signal_1', 'I0_1', 'signal_2', 'I0_2'))
     n1 = z1/i01
     n2 = z2/i02
     diff = n1 - n2
-    for i in range(len(slow)):
-        ws1.append((slow[i], fast[i], diff[i], n1[i], n2[i], z1[i], i01[i], z2[i], i02[i]))
-    wb.save(filename=os.path.join(user_ns['BMMuser'].folder, 'maps', f'{tag}.xlsx'))
-    print(f'wrote {user_ns["BMMuser"].folder}/maps/{tag}.xlsx')
-    
-    ## save map in matlab format 
-    savemat(os.path.join(user_ns['BMMuser'].folder, 'maps', f'{tag}.mat'), {'label'        : tag,
-                                                                            motors[0]      : list(slow),
-                                                                            motors[1]      : list(fast),
-                                                                            'difference'   : list(diff),
-                                                                            'normalized_1' : list(n1),
-                                                                            'normalized_2' : list(n2),
-                                                                            'I0_1'         : list(i01),
-                                                                            'signal_1'     : list(z1),
-                                                                            'I0_2'         : list(i02),
-                                                                            'signal_2'     : list(z2), })
-    print(f'wrote {user_ns["BMMuser"]}/maps/{tag}.mat')
+    stem = os.path.join(user_ns['BMMuser'].folder, 'maps', tag)
+
+    ## save map in xlsx format (unless it is too big for a spreadsheet to be sensible)
+    if write_xlsx(f'{stem}.xlsx', {'slow': slow, 'fast': fast, 'difference': diff, 'normalized_1': n1, 'normalized_2': n2,
+                                   'signal_1': z1, 'I0_1': i01, 'signal_2': z2, 'I0_2': i02}, title=tag) is not None:
+        print(f'wrote {stem}.xlsx')
+
+    ## save map in matlab format and as a 2-D NeXus/HDF5 file
+    columns = {motors[0]      : slow,
+               motors[1]      : fast,
+               'difference'   : diff,
+               'normalized_1' : n1,
+               'normalized_2' : n2,
+               'I0_1'         : i01,
+               'signal_1'     : z1,
+               'I0_2'         : i02,
+               'signal_2'     : z2, }
+    write_mat(f'{stem}.mat', columns, label=tag)
+    print(f'wrote {stem}.mat')
+    write_hdf5(f'{stem}.h5', columns, (nslow, nfast), signal='difference', axes=motors, label=tag, attrs={'uid1': uid1, 'uid2': uid2})
+    print(f'wrote {stem}.h5')
 
     ## make a pretty picture of the difference map
     zzz=diff.reshape(nfast, nslow)
@@ -455,6 +462,7 @@ def raster(inifile=None, **kwargs):
             yield from mv(dossier.fast, float(dossier.fast_init), dossier.slow, float(dossier.slow_init))
             dossier.seqend = now('%A, %B %d, %Y %I:%M %p')
             how = 'finished  :tada:'
+            tiled_writer.wait()
             try:
                 if 'primary' not in bmm_catalog[-1].metadata['stop']['num_events']:
                     how = '*stopped*'
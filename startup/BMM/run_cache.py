@@ -0,0 +1,252 @@
+import time, threading
+from collections import OrderedDict
+
+import numpy, xarray
+
+
+class CachedStream():
+    '''One stream (primary, baseline, ...) of a cached run.
+
+    Columns are fetched from Tiled at most once and kept as xarray
+    DataArrays.  The primary stream is fetched column by column, as
+    asked for, since it may hold large MCA spectra.  Any other stream
+    (e.g. baseline) is small and is fetched whole on first use.
+
+    Mimics the bits of a Tiled stream used at BMM:
+       stream.read(), stream.read(columns), stream.data[name], stream['data'][name]
+
+    Coordinates, like time, are kept as columns alongside the data
+    variables.  The consumers read streams from several threads, so
+    columns is only touched while holding the lock of the RunCache.
+
+    '''
+    def __init__(self, run, name):
+        self.run      = run
+        self.name     = name
+        self.columns  = dict()
+        self.complete = False
+        self._keys    = None
+
+    def read(self, variables=None):
+        '''Return an xarray Dataset of the requested columns (or of all
+        columns), fetching from Tiled only those not seen before.'''
+        if variables is None or (self.name != 'primary' and not self.complete):
+            if not self.complete:
+                ds = self.run.cache.fetch(lambda: self.run.node[self.name].read())
+                self.store(ds)
+                self.complete = True
+                self.run.cache.account()
+            if variables is None:
+                with self.run.cache.lock:
+                    return xarray.Dataset(dict(self.columns))
+        with self.run.cache.lock:
+            missing = [v for v in variables if v not in self.columns]
+        if len(missing) > 0 and not self.complete:
+            ds = self.run.cache.fetch(lambda: self.run.node[self.name].read(missing))
+            self.store(ds)
+            self.run.cache.account()
+        with self.run.cache.lock:
+            return xarray.Dataset({v: self.columns[v] for v in variables})
+
+    def store(self, ds):
+        '''Keep every variable of a Dataset, coordinates included.'''
+        with self.run.cache.lock:
+            self.columns.update({k: ds[k] for k in ds.variables})
+
+    def column(self, name):
+        '''Return a column as a numpy array.'''
+        return numpy.asarray(self.read([name])[name])
+
+    def keys(self):
+        if self.complete:
+            with self.run.cache.lock:
+                return list(self.columns.keys())
+        if self._keys is None:
+            self._keys = self.run.cache.fetch(lambda: list(self.run.node[self.name]['data'].keys()))
+        return self._keys
+
+    @property
+    def data(self):
+        return _Columns(self)
+
+    def __getitem__(self, key):
+        if key == 'data':
+            return _Columns(self)
+        raise KeyError(key)
+
+    @property
+    def nbytes(self):
+        with self.run.cache.lock:
+            return sum(c.nbytes for c in self.columns.values())
+
+
+class _Columns():
+    '''Dict-like view of the columns of a CachedStream, returning numpy arrays.'''
+    def __init__(self, stream):
+        self.stream = stream
+    def __getitem__(self, key):
+        return self.stream.column(key)
+    def __contains__(self, key):
+        return key in self.stream.keys()
+    def __iter__(self):
+        return iter(self.stream.keys())
+    def keys(self):
+        return self.stream.keys()
+
+
+class CachedRun():
+    '''A run fetched once from Tiled: the start and stop documents, plus
+    streams which fill in as they are used.
+
+    Mimics the bits of a Tiled run used at BMM:
+       run.metadata['start'], run.primary.read(), run.baseline.data[name], run.documents()
+
+    '''
+    def __init__(self, cache, node):
+        self.cache    = cache
+        self.node     = node
+        self.metadata = dict(node.metadata)
+        self.start    = self.metadata.get('start')
+        self.stop     = self.metadata.get('stop')
+        self.uid      = self.start['uid']
+        self.fetched  = time.monotonic()
+        self.streams  = dict()
+        self._documents = None
+
+    def stream(self, name):
+        with self.cache.lock:
+            if name not in self.streams:
+                self.streams[name] = CachedStream(self, name)
+            return self.streams[name]
+
+    @property
+    def primary(self):
+        return self.stream('primary')
+
+    @property
+    def baseline(self):
+        return self.stream('baseline')
+
+    def __getitem__(self, name):
+        return self.stream(name)
+
+    def column(self, name, stream='primary'):
+        '''Return a column of a stream as a numpy array.'''
+        return self.stream(stream).column(name)
+
+    def documents(self):
+        if self._documents is None:
+            self._documents = self.cache.fetch(lambda: list(self.node.documents()))
+        return iter(self._documents)
+
+    @property
+    def nbytes(self):
+        with self.cache.lock:
+            return sum(s.nbytes for s in self.streams.values())
+
+
+class RunCache():
+    '''An LRU cache of runs from a Tiled catalog, keyed by UID.
+
+    A RunCache can be used in place of the catalog it wraps: indexing
+    with a UID returns a CachedRun which fetches each thing from Tiled
+    at most once, while anything else (searches, integer indexing like
+    catalog[-1], iteration) is handed to the catalog.
+
+    Runs without a stop document are not cached, as they are still
+    growing.  Cached runs expire after ttl seconds and the least
+    recently used runs are dropped when the cached columns exceed
+    maxbytes.
+
+    attributes
+    ==========
+    catalog:
+      the Tiled catalog
+
+    maxbytes: (int)
+      upper bound on the size of cached columns [512 MB]
+
+    ttl: (float)
+      lifetime in seconds of a cached run [600]
+
+    hits, misses, requests: (int)
+      counters of cache hits, cache misses, and requests made to Tiled
+
+    '''
+    def __init__(self, catalog, maxbytes=512*2**20, ttl=600):
+        self.catalog  = catalog
+        self.maxbytes = maxbytes
+        self.ttl      = ttl
+        self.runs     = OrderedDict()
+        self.aliases  = dict()
+        self.lock     = threading.RLock()
+        self.hits     = 0
+        self.misses   = 0
+        self.requests = 0
+
+    def fetch(self, func):
+        '''Make a request of Tiled, counting it.'''
+        self.requests += 1
+        return func()
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return self.catalog[key]
+        with self.lock:
+            uid = self.aliases.get(key, key)
+            run = self.runs.get(uid)
+            if run is not None and time.monotonic() - run.fetched < self.ttl:
+                self.runs.move_to_end(uid)
+                self.hits += 1
+                return run
+            self.misses += 1
+        ## fetch without holding the lock, so that threads reading different runs do not wait on one another
+        run = CachedRun(self, self.fetch(lambda: self.catalog[key]))
+        if run.stop is None:
+            return run
+        with self.lock:
+            self.runs[run.uid] = run
+            self.runs.move_to_end(run.uid)
+            if key != run.uid:
+                self.aliases[key] = run.uid
+            self.account()
+            return run
+
+    def account(self):
+        '''Drop least recently used runs until the cache fits in maxbytes.'''
+        with self.lock:
+            while len(self.runs) > 1 and self.nbytes > self.maxbytes:
+                uid, run = self.runs.popitem(last=False)
+                for k in [a for a, u in self.aliases.items() if u == uid]:
+                    del self.aliases[k]
+
+    def clear(self):
+        with self.lock:
+            self.runs.clear()
+            self.aliases.clear()
+
+    @property
+    def nbytes(self):
+        with self.lock:
+            return sum(r.nbytes for r in self.runs.values())
+
+    def stats(self):
+        return {'hits'     : self.hits,
+                'misses'   : self.misses,
+                'requests' : self.requests,
+                'runs'     : len(self.runs),
+                'nbytes'   : self.nbytes, }
+
+    def __getattr__(self, name):
+        if name == 'catalog':
+            raise AttributeError(name)
+        return getattr(self.catalog, name)
+
+    def __contains__(self, key):
+        return key in self.catalog
+
+    def __iter__(self):
+        return iter(self.catalog)
+
+    def __len__(self):
+        return len(self.catalog)
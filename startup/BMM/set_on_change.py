@@ -0,0 +1,87 @@
+'''Positioners which only write to EPICS when asked for a new value.
+
+The dwell time of every enabled signal chain (ion chambers, Xspress3,
+Pilatus, Dante, ...) is moved by LockedDwellTimes whenever the dwell
+time pseudo-axis is moved.  A dwell time usually stays the same across
+a region of an XAFS scan, from one repetition to the next, and from one
+count or linescan to the next.  Writing the same value again costs a
+put, a wait for the readback and the settle time of every chain.
+
+Nothing in this module depends on the bsui profile, so the simulated
+devices in tools/dwelltime_benchmark.py can use it.
+
+'''
+import time
+from ophyd.status import Status
+
+
+class SetOnChange():
+    '''Mixin for a positioner (e.g. a PVPositionerPC) which skips a move
+    to the value it was last moved to, so long as its readback has not
+    changed since.  Checking the readback catches a change made some
+    other way, say by caput or by setting the Xspress3 acquire time
+    directly.
+
+    attributes
+    ==========
+    committed: (tuple or None)
+      (setpoint, readback) at the end of the last successful move
+
+    puts: (int)
+      number of moves made
+
+    skipped: (int)
+      number of moves skipped because the value was unchanged
+
+    put_time: (float)
+      seconds spent in moves, from request to done, including settle time
+
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.committed = None
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.puts, self.skipped, self.put_time = 0, 0, 0.0
+
+    def forget(self):
+        '''Write the next value asked for, whatever it is.'''
+        self.committed = None
+
+    def unchanged(self, position):
+        if self.committed is None:
+            return False
+        setpoint, readback = self.committed
+        return abs(position - setpoint) < 1e-9 and self.position == readback
+
+    def move(self, position, wait=True, timeout=None, moved_cb=None, **kwargs):
+        if self.unchanged(position):
+            self.skipped += 1
+            status = Status(obj=self)
+            status.set_finished()
+            if moved_cb is not None:
+                moved_cb(obj=self)
+            return status
+
+        self.puts += 1
+        self.committed = None
+        start = time.monotonic()
+        def committed(status):
+            self.put_time += time.monotonic() - start
+            if status.success:
+                self.committed = (position, self.position)
+        status = super().move(position, wait=wait, timeout=timeout, moved_cb=moved_cb, **kwargs)
+        status.add_callback(committed)
+        return status
+
+
+def dwell_regions(timegrid):
+    '''Return a list of (index, dwell time) at which the dwell time of a
+    scan changes, starting with the first point.  These are the only
+    points at which the signal chains are written to.'''
+    regions = []
+    for i, t in enumerate(timegrid):
+        if len(regions) == 0 or abs(t - regions[-1][1]) > 1e-9:
+            regions.append((i, t))
+    return regions
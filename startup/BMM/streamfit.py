@@ -0,0 +1,98 @@
+'''Fit alignment scans as they are measured, rather than asking the
+kafka consumer to fetch the scan from the data store and fit it.
+
+ScanCollector is subscribed to a linescan and keeps the motor positions
+and the signal from each event document.  When the scan is done, the
+step or peak position is found in-process with the same models used by
+peakfit and stepfit in consumer/tools.py.
+
+Nothing in this module depends on the bsui profile.
+
+    >>> collector = ScanCollector('xafs_liny', 'It')
+    >>> uid = yield from subs_wrapper(linescan(xafs_liny, 'it', -2, 2, 41, dopluck=False), collector)
+    >>> center, amplitude = step_center(*collector.arrays())
+
+'''
+import numpy
+from bluesky.callbacks import CallbackBase
+from lmfit.models import StepModel
+
+
+class ScanCollector(CallbackBase):
+    '''Gather (position, signal) from the event documents of a scan.
+
+    attributes
+    ==========
+    motor: (str)
+      name of the scanned motor, i.e. its key in the event documents
+
+    signal: (str)
+      'It' for It/I0, 'I0', or 'If' for the sum of the fluorescence
+      channels named in channels, divided by I0
+
+    channels: (list)
+      names of the fluorescence ROIs, e.g. [BMMuser.xs1, BMMuser.xs2, ...]
+
+    uid: (str)
+      uid of the start document of the scan
+
+    '''
+    def __init__(self, motor, signal, channels=None):
+        super().__init__()
+        self.motor    = motor
+        self.signal   = signal
+        self.channels = channels or []
+        self.uid      = None
+        self.x, self.y = [], []
+
+    def start(self, doc):
+        self.uid = doc['uid']
+        self.x, self.y = [], []
+
+    def event(self, doc):
+        data = doc['data']
+        if self.motor not in data:
+            return
+        if self.signal == 'It':
+            value = data['It'] / data['I0']
+        elif self.signal == 'If':
+            value = sum(data[c] for c in self.channels if c in data) / data['I0']
+        else:
+            value = data[self.signal]
+        self.x.append(data[self.motor])
+        self.y.append(value)
+
+    def arrays(self):
+        return numpy.array(self.x), numpy.array(self.y)
+
+
+def peak_position(positions, signal):
+    '''Return (position, amplitude) of the maximum of a peaked scan.'''
+    top = numpy.argmax(signal)
+    return positions[top], signal[top]
+
+
+def step_center(positions, signal, drop=None):
+    '''Fit an error function to a step-like scan.  Return (center,
+    amplitude).  Like stepfit, a step down is inverted before fitting.
+
+    Parameters
+    ----------
+    positions : numpy array
+        motor positions
+    signal : numpy array
+        It/I0
+    drop : int or None
+        number of points to drop from the end of the scan before fitting [None]
+
+    '''
+    if drop is not None:
+        positions, signal = positions[:-drop], signal[:-drop]
+    if float(signal[2]) > float(signal[-2]):
+        ss = -(signal - signal[2])
+    else:
+        ss = signal - signal[2]
+    mod  = StepModel(form='erf')
+    pars = mod.guess(ss, x=positions)
+    out  = mod.fit(ss, pars, x=positions)
+    return out.params['center'].value, out.params['amplitude'].value
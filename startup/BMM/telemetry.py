@@ -1,9 +1,9 @@
-import numpy, json, os, time
+import numpy, json, os, time, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm           # progress bar
-from pprint import pprint
 
 from BMM.periodictable import element_symbol, edge_energy, Z_number
-from BMM.functions import elapsed_time
+from BMM.functions import elapsed_time, plotting_mode, HBARC
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
@@ -21,6 +21,17 @@ except ImportError:
 from databroker import catalog
 from databroker.queries import TimeRange
 
+from BMM.dcm_parameters import dcm_parameters
+BMM_dcm = dcm_parameters()
+
+def bragg_angle(energy, crystal='111'):
+    '''Monochromator angle in degrees for an energy (or array of energies) in eV.'''
+    dspacing = BMM_dcm.dspacing_311 if '311' in str(crystal) else BMM_dcm.dspacing_111
+    return numpy.degrees(numpy.arcsin(2*numpy.pi*HBARC / (2*dspacing*energy)))
+
+def is_fluorescence(mode):
+    return plotting_mode(str(mode)) in ('fluorescence', 'yield', 'pilatus', 'dante')
+
 
 class BMMTelemetry():
     '''A class for figuring out the historical average overhead for an
@@ -31,10 +42,29 @@ class BMMTelemetry():
     in the start and stop document.  The measurement time is the sum
     of the dwell time column in the datatable from the measurement.
 
+    Each XAS scan is summarized by one row of a SQLite table (see
+    self.index): elapsed time, measurement time, number of points,
+    element, edge, mode, and the time spent on visual metadata and
+    XRF.  Rows are added as scans finish by the RunEngine
+    subscription, callback, and by update, which sweeps the catalog
+    for scans since the most recent one in the table.  The overhead
+    statistics are computed from the table, so Tiled is read only
+    once for any scan.
+
+    The overhead model (see fit) predicts the overhead of a scan from
+    its energy grid, dwell times, detector mode, mono crystal and scan
+    direction.  It is fit to the table by least squares, saved to
+    overhead_model.json, and kept in memory once loaded.
+
     '''
     def __init__(self):
         self.folder      = os.path.join(startup_dir, 'telemetry')
         self.json        = os.path.join(self.folder, 'telemetry.json')
+        self.index       = os.path.join(self.folder, 'telemetry.sqlite')
+        self.modelfile   = os.path.join(self.folder, 'overhead_model.json')
+        self._model      = None
+        self._json       = None     # contents of telemetry.json, read once
+        self.workers     = 8
         self.bc          = None
         if not is_re_worker_active():
             self.bc      = catalog['bmm']
@@ -45,7 +75,10 @@ class BMMTelemetry():
         self.all_elements = list(range(21, 46)) + list(range(52, 93))
         self.time_search = None
         self.xafs_search = None
-        self.seen = {}
+        self.live = None        # summary of the XAS scan in progress, accumulated by callback
+        self.spans = dict()     # uid : [start time, stop time] of recent snapshot and XRF runs
+        self.writer = None      # thread storing the most recent row from callback
+        self.lock = threading.Lock()
 
     @property
     def start_date(self):
@@ -67,123 +100,396 @@ class BMMTelemetry():
         print(f'\nNumber of records for {element} since {self.start_date}: {len(element_search)}')
         return(element_search)
 
-    def visual_metadata(self, snapshots):
+    def span(self, uid, spans=None):
+        '''Return the start and stop times of a run, from spans if given,
+        otherwise from the catalog.'''
+        if spans is not None:
+            return spans[uid]
+        md = self.bc[uid].metadata
+        return(md['start']['time'], md['stop']['time'])
+
+    def visual_metadata(self, snapshots, spans=None):
         '''Determine the amount of time to capture all four camera images,
-        including the time between images.
+        including the time between images.  When the cameras were
+        captured together in a single run (see DossierTools.cameras),
+        this is the duration of that run.
 
         If the XAFS measurement was a fluorescence measurement, also
         record the time required to capture the XRF spectrun and make
         its png image.
 
+        The start and stop times of the camera and XRF runs are taken
+        from spans, a dict of uid : (start, stop), if given, otherwise
+        from the catalog.
+
         '''
-        #print(snapshots['webcam_uid'])
-        if snapshots['webcam_uid'] in self.seen:
-            return 0
         net_time, between_time, xrf_time = 0,0,0
+        ## since the cameras (and perhaps the XRF spectrum) are captured in a single run
+        uids = [snapshots[k] for k in ('webcam_uid', 'anacam_uid', 'usbcam1_uid', 'usbcam2_uid') if snapshots.get(k, '') != '']
+        if len(uids) > 0 and len(set(uids)) == 1:
+            try:
+                snap = self.span(uids[0], spans)
+                net_time = snap[1] - snap[0]
+                if 'xrf_uid' in snapshots and snapshots['xrf_uid'] != uids[0]:
+                    xrf = self.span(snapshots['xrf_uid'], spans)
+                    xrf_time = (xrf[1] - xrf[0]) + (snap[0] - xrf[1])
+            except:
+                pass
+            return(net_time, xrf_time)
         try:
-            web  = self.bc[snapshots['webcam_uid']].metadata
-            ana  = self.bc[snapshots['anacam_uid']].metadata
-            usb1 = self.bc[snapshots['usbcam1_uid']].metadata
-            usb2 = self.bc[snapshots['usbcam2_uid']].metadata
-            net_time = (web['stop']['time'] - web['start']['time']) +\
-                (ana['stop']['time']  - ana['start']['time']) +\
-                (usb1['stop']['time'] - usb1['start']['time']) +\
-                (usb2['stop']['time'] - usb2['start']['time'])
-            between_time = (ana['start']['time'] - web['stop']['time']) +\
-                (usb1['start']['time'] - ana['stop']['time']) +\
-                (usb2['start']['time'] - usb1['stop']['time'])
+            web  = self.span(snapshots['webcam_uid'], spans)
+            ana  = self.span(snapshots['anacam_uid'], spans)
+            usb1 = self.span(snapshots['usbcam1_uid'], spans)
+            usb2 = self.span(snapshots['usbcam2_uid'], spans)
+            net_time = (web[1] - web[0]) + (ana[1] - ana[0]) + (usb1[1] - usb1[0]) + (usb2[1] - usb2[0])
+            between_time = (ana[0] - web[1]) + (usb1[0] - ana[1]) + (usb2[0] - usb1[1])
             if 'xrf_uid' in snapshots:
-                xrf = self.bc[snapshots['xrf_uid']].metadata
-                xrf_time = (xrf['stop']['time'] - xrf['start']['time']) + (web['start']['time'] - xrf['stop']['time'])
-            self.seen[snapshots['webcam_uid']] = 1
+                xrf = self.span(snapshots['xrf_uid'], spans)
+                xrf_time = (xrf[1] - xrf[0]) + (web[0] - xrf[1])
         except:
             pass
         #print(net_time, between_time)
         return(net_time + between_time, xrf_time)
-        
-            
-    def overhead(self, element=None):
-        '''Determine the average overhead for all scans in a time period and
-        of a particular element.  Also record the time taken to
-        capture the visual metadata.
 
-        '''
-        if element is None: return({})
-        element_search = self.records(element)
-        l = len(element_search)
-        if l == 0: return({})
-        ratio, difference, dpp, visual, xrf = numpy.zeros(l), numpy.zeros(l), numpy.zeros(l), numpy.zeros(l), numpy.zeros(l)
-        count = 0
-        start = time.time()
-        self.seen = {}
-        for u, this in tqdm(element_search.items()):
-            ## records that did not complete normally
-            #if this is None: continue
+    ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
+    ## the telemetry index
+
+    COLUMNS = ('uid', 'time', 'element', 'edge', 'mode', 'npoints', 'elapsed', 'measurement', 'visual', 'xrf', 'snapshots',
+               'dtheta', 'crystal', 'direction')
+
+    def connect(self):
+        db = sqlite3.connect(self.index, timeout=30)
+        db.execute('''CREATE TABLE IF NOT EXISTS scans
+                      (uid TEXT PRIMARY KEY, time REAL, element TEXT, edge TEXT, mode TEXT,
+                       npoints INTEGER, elapsed REAL, measurement REAL, visual REAL, xrf REAL, snapshots TEXT,
+                       dtheta REAL, crystal TEXT, direction TEXT)''')
+        ## indexes made before the overhead model need the columns it uses
+        have = [c[1] for c in db.execute('PRAGMA table_info(scans)')]
+        for column, kind in (('dtheta', 'REAL'), ('crystal', 'TEXT'), ('direction', 'TEXT')):
+            if column not in have:
+                db.execute(f'ALTER TABLE scans ADD COLUMN {column} {kind}')
+        db.execute('CREATE INDEX IF NOT EXISTS scans_element ON scans (element)')
+        return db
+
+    def store(self, rows):
+        '''Add rows (dicts with keys self.COLUMNS) to the telemetry index.'''
+        rows = [r for r in rows if r is not None]
+        if len(rows) == 0:
+            return
+        with self.lock:
+            db = self.connect()
+            with db:
+                db.executemany(f'INSERT OR REPLACE INTO scans ({", ".join(self.COLUMNS)}) VALUES ({", ".join("?"*len(self.COLUMNS))})',
+                               [tuple(r[c] for c in self.COLUMNS) for r in rows])
+            db.close()
+
+    def summarize(self, start, stop, measurement, npoints, energy=None, spans=None):
+        '''Make a row of the telemetry index from the start and stop
+        documents, the sum of the dwell times, the number of points,
+        and the energy of each point.'''
+        if stop is None or measurement <= 0:
+            return None
+        if start.get('num_points') is not None and start['num_points'] != npoints:  # did not complete normally
+            return None
+        snapshots = start['XDI'].get('_snapshots', dict())
+        visual, xrf = self.visual_metadata(snapshots, spans)
+        mono = start['XDI'].get('Mono', dict())
+        crystal = '311' if '311' in str(mono.get('name', '')) else '111'
+        dtheta = None
+        if energy is not None and len(energy) > 1:
+            dtheta = float(numpy.abs(numpy.diff(bragg_angle(numpy.array(energy), crystal))).sum())
+        return {'uid'         : start['uid'],
+                'time'        : start['time'],
+                'element'     : start['XDI']['Element']['symbol'],
+                'edge'        : start['XDI']['Element'].get('edge', ''),
+                'mode'        : start['XDI'].get('_mode', [''])[0],
+                'npoints'     : npoints,
+                'elapsed'     : stop['time'] - start['time'],
+                'measurement' : measurement,
+                'visual'      : visual,
+                'xrf'         : xrf,
+                'snapshots'   : snapshots.get('webcam_uid', ''),
+                'dtheta'      : dtheta,
+                'crystal'     : crystal,
+                'direction'   : mono.get('direction', 'forward'), }
+
+    def row(self, uid):
+        '''Read a scan from the catalog and summarize it for the telemetry index.'''
+        try:
+            this = self.bc[uid]
             md = this.metadata
-            if md is None or md['stop'] is None: continue
-            if 'primary' in md['stop']['num_events']:
-                if md['start']['num_points'] != md['stop']['num_events']['primary']:
-                    continue
-            try:
-                t = this['primary', 'data', 'dwti_dwell_time'][:]
-                measurement_time = float(t.sum())
-                time_elapsed = md['stop']['time'] - md['start']['time']
-
-                ## exclude records that span beam dumps or other pauses
-                if time_elapsed/measurement_time > self.beamdump:
-                    continue
-
-                ## gather simple statistics
-                difference[count] = time_elapsed - measurement_time  # total motor motion overhead
-                ratio[count]      = time_elapsed/measurement_time
-                dpp[count]        = difference[count] / len(t)  # approximate overhead as evenly distributed point-by-point
-                visual[count], xrf[count] = self.visual_metadata(md['start']['XDI']['_snapshots'])
-                count             = count + 1
-            except: #  Exception as E:             # if a record cannot be processed for any reason, just skip it.
-                #print(E)
-                pass
+            t = this['primary', 'data', 'dwti_dwell_time'][:]
+            e = this['primary', 'data', 'dcm_energy'][:]
+            return self.summarize(md['start'], md['stop'], float(t.sum()), len(t), energy=e)
+        except Exception:
+            return None
+
+    def callback(self, name, doc):
+        '''RunEngine subscription which adds each XAS scan to the telemetry
+        index as it finishes, using only the documents themselves.'''
+        if name == 'start':
+            if doc.get('XDI', dict()).get('_kind') == 'xafs':
+                self.live = {'start': doc, 'primary': None, 'measurement': 0, 'npoints': 0, 'energy': []}
+            elif str(doc.get('plan_name', '')).startswith('count xafs_metadata'):
+                self.spans[doc['uid']] = [doc['time'], None]
+        elif name == 'descriptor' and self.live is not None:
+            ## only the primary stream is counted, not the baseline readings before and after the scan
+            if doc['run_start'] == self.live['start']['uid'] and doc.get('name') == 'primary':
+                self.live['primary'] = doc['uid']
+        elif name == 'event' and self.live is not None:
+            if doc['descriptor'] != self.live['primary']:
+                return
+            self.live['measurement'] += doc['data'].get('dwti_dwell_time', 0)
+            self.live['npoints'] += 1
+            if 'dcm_energy' in doc['data']:
+                self.live['energy'].append(doc['data']['dcm_energy'])
+        elif name == 'event_page' and self.live is not None:
+            if doc['descriptor'] != self.live['primary']:
+                return
+            self.live['measurement'] += sum(doc['data'].get('dwti_dwell_time', [0]))
+            self.live['npoints'] += len(doc['seq_num'])
+            self.live['energy'].extend(doc['data'].get('dcm_energy', []))
+        elif name == 'stop':
+            if doc['run_start'] in self.spans:
+                self.spans[doc['run_start']][1] = doc['time']
+            elif self.live is not None and doc['run_start'] == self.live['start']['uid']:
+                live, self.live = self.live, None
+                try:
+                    spans = {u: s for u, s in self.spans.items() if s[1] is not None}
+                    this = self.summarize(live['start'], doc, live['measurement'], live['npoints'], energy=live['energy'], spans=spans)
+                except Exception:
+                    return
+                ## do not make the RunEngine wait on the disk
+                self.writer = threading.Thread(target=self.store, args=([this],), daemon=True)
+                self.writer.start()
+            if len(self.spans) > 50:
+                for u in list(self.spans)[:-50]:
+                    del self.spans[u]
 
-        ## count will likely be smaller than l
-        ratio = ratio[numpy.flatnonzero(ratio)]
-        difference = difference[numpy.flatnonzero(difference)]
-        dpp = dpp[numpy.flatnonzero(dpp)]
-        visual = visual[numpy.flatnonzero(visual)]
-        xrf = xrf[numpy.flatnonzero(xrf)]
+    def latest(self):
+        '''Return the time of the most recent scan in the telemetry index, or None.'''
+        if not os.path.isfile(self.index):
+            return None
+        db = self.connect()
+        latest = db.execute('SELECT MAX(time) FROM scans').fetchone()[0]
+        db.close()
+        return latest
+
+    def update(self, since=None):
+        '''Add to the telemetry index every XAS scan since the most recent
+        one already in the index (or since self.start_date for an empty
+        index).  Scans are read from the catalog concurrently.'''
+        if since is None:
+            latest = self.latest()
+            since = self.start_date if latest is None else time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(latest))
+        found = self.bc.search(TimeRange(since=since)).search({'XDI._kind':'xafs'})
+        db = self.connect()
+        known = set(u for (u,) in db.execute('SELECT uid FROM scans'))
+        db.close()
+        uids = [u for u in found if u not in known]
+        print(f'adding {len(uids)} scans since {since} to the telemetry index')
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            rows = list(tqdm(pool.map(self.row, uids), total=len(uids)))
+        self.store(rows)
         elapsed_time(start)
-        ## return means and standard deviations
-        return({'count'     : count,
+
+    def select(self, element=None):
+        '''Return the rows of the telemetry index for an element (or for all
+        elements), excluding those that span beam dumps or other pauses.'''
+        if not os.path.isfile(self.index):
+            return []
+        db = self.connect()
+        query = f'SELECT {", ".join(self.COLUMNS)} FROM scans WHERE elapsed < ? * measurement'
+        args = [self.beamdump]
+        if element is not None:
+            query += ' AND element = ?'
+            args.append(element_symbol(element))
+        rows = [dict(zip(self.COLUMNS, r)) for r in db.execute(query, args)]
+        db.close()
+        return rows
+
+    def statistics(self, rows):
+        '''Means and standard deviations of the overhead for a list of rows of
+        the telemetry index.  The visual metadata of a scan sequence is
+        counted only once.'''
+        if len(rows) == 0:
+            return({})
+        elapsed     = numpy.array([r['elapsed']     for r in rows])
+        measurement = numpy.array([r['measurement'] for r in rows])
+        npoints     = numpy.array([r['npoints']     for r in rows])
+        sequences = dict()
+        for r in rows:
+            sequences.setdefault(r['snapshots'], (r['visual'], r['xrf']))
+        visual = numpy.array([v[0] for k, v in sequences.items() if k != '' and v[0] > 0])
+        xrf    = numpy.array([v[1] for k, v in sequences.items() if k != '' and v[1] > 0])
+        ratio      = elapsed/measurement
+        difference = elapsed - measurement
+        dpp        = difference / npoints
+        return({'count'     : len(rows),
                 'ratio'     : [ratio.mean(), ratio.std()],
                 'difference': [difference.mean(), difference.std()],
                 'dpp'       : [dpp.mean(), dpp.std(), dpp.max(), dpp.min()],
-                'visual'    : [visual.mean(), visual.std(), len(visual)],
-                'xrf'       : [xrf.mean(), xrf.std(), len(xrf)],
+                'visual'    : [visual.mean() if len(visual) > 0 else 0, visual.std() if len(visual) > 0 else 0, len(visual)],
+                'xrf'       : [xrf.mean() if len(xrf) > 0 else 0, xrf.std() if len(xrf) > 0 else 0, len(xrf)],
             })
-    
 
-    ## TODO: take a list of integers/element symbols as an input
-    ## parameter, extract just those, modify json file for those
-    ## elements
-    def periodic_table(self):
+    def overhead(self, element=None):
+        '''Determine the average overhead for all scans in a time period and
+        of a particular element.  Also record the time taken to
+        capture the visual metadata.
+
+        '''
+        if element is None: return({})
+        return self.statistics(self.select(element))
+
+    def periodic_table(self, update=True):
+        '''Bring the telemetry index up to date, then write the overhead
+        statistics for every element to the json file.'''
         start = time.time()
+        if update:
+            self.update()
+            self.fit()
         results = {}
         for z in self.all_elements:
             el = element_symbol(z)
             results[el] = self.overhead(el)
-            pprint(results[el])
-            j = json.dumps(results)
-            f = open(self.json,"w")
-            f.write(j)
-            f.close()
+        with open(self.json, 'w') as f:
+            f.write(json.dumps(results))
+        self._json = results
         end = time.time()
         print('\n\nThat took %.1f min' % ((end-start)/60))
 
 
+    def table(self):
+        '''Contents of telemetry.json, read from disk only once.'''
+        if self._json is None:
+            with open(self.json, 'r') as td:
+                self._json = json.load(td)
+        return self._json
+
+    ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
+    ## the overhead model
+
+    MODEL_TERMS = ('per point', 'per degree', 'per second of dwell', 'fluorescence per point', 'backward per point', 'Si(311) per point')
+
+    def features(self, npoints, dtheta, measurement, mode, crystal, direction):
+        '''The terms of the overhead model for a scan, in the order of self.MODEL_TERMS.'''
+        return [npoints,
+                dtheta,
+                measurement,
+                npoints * is_fluorescence(mode),
+                npoints * (direction == 'backward'),
+                npoints * ('311' in str(crystal)), ]
+
+    def fit(self, rows=None, save=True):
+        '''Fit the overhead model to the telemetry index by least squares.
+
+        The overhead of a scan (elapsed time less the sum of the dwell
+        times) is modeled as a sum over points of a cost per point, a
+        cost per degree of Bragg angle traversed, a cost per second of
+        dwell time (detector readout), and extra costs per point for
+        fluorescence detectors, for scans measured backwards, and for
+        the Si(311) crystal.
+        '''
+        if rows is None:
+            rows = [r for r in self.select() if r['dtheta'] is not None]
+        if len(rows) < 2*len(self.MODEL_TERMS):
+            print(f'not enough scans ({len(rows)}) in the telemetry index to fit the overhead model')
+            return None
+        A = numpy.array([self.features(r['npoints'], r['dtheta'], r['measurement'], r['mode'], r['crystal'], r['direction']) for r in rows], dtype=float)
+        y = numpy.array([r['elapsed'] - r['measurement'] for r in rows])
+        coefficients = numpy.linalg.lstsq(A, y, rcond=None)[0]
+        residuals = y - A.dot(coefficients)
+        model = {'coefficients' : list(coefficients),
+                 'terms'        : list(self.MODEL_TERMS),
+                 'rms'          : float(numpy.sqrt((residuals**2).mean())),
+                 'npoints'      : float(numpy.mean([r['npoints'] for r in rows])),
+                 'count'        : len(rows),
+                 'fitted'       : time.strftime('%Y-%m-%d %H:%M:%S'), }
+        self._model = model
+        if save:
+            with open(self.modelfile, 'w') as f:
+                f.write(json.dumps(model, indent=2))
+        return model
+
+    @property
+    def model(self):
+        '''The overhead model, read from disk only once.  None if not yet fit.'''
+        if self._model is None and os.path.isfile(self.modelfile):
+            with open(self.modelfile, 'r') as f:
+                self._model = json.load(f)
+        return self._model
+
+    def predict(self, grid, timegrid, mode='transmission', crystal=None, direction='forward', element=None):
+        '''Predict the overhead in seconds of a scan on an energy grid.
+        Return the overhead and its uncertainty.  Without a fitted
+        model, use the historical overhead per point for the element.'''
+        if crystal is None:
+            try:
+                crystal = user_ns['dcm']._crystal
+            except Exception:
+                crystal = '111'
+        model = self.model
+        if model is None or len(grid) < 2:
+            try:
+                dpp, uncertainty, maxdpp, mindpp = self.overhead_per_point(element)
+            except Exception:
+                dpp, uncertainty = self.average()[:2]
+            return(len(grid)*dpp, len(grid)*uncertainty)
+        dtheta = float(numpy.abs(numpy.diff(bragg_angle(numpy.array(grid, dtype=float), crystal))).sum())
+        terms = self.features(len(grid), dtheta, float(sum(timegrid)), mode, crystal, direction)
+        overhead = float(numpy.dot(model['coefficients'], terms))
+        ## the rms residual is for a scan of typical length, scale it to this one
+        return(overhead, model['rms'] * len(grid) / model['npoints'])
+
+    def validate(self, split=0.8):
+        '''Compare predicted and actual durations of the scans in the
+        telemetry index.  The model is fit to the earliest fraction
+        (split) of the scans and tested on the rest.  The model in
+        memory is not changed.'''
+        rows = sorted([r for r in self.select() if r['dtheta'] is not None], key=lambda r: r['time'])
+        ntrain = int(split*len(rows))
+        saved = self._model
+        model = self.fit(rows[:ntrain], save=False)
+        self._model = saved
+        if model is None or ntrain == len(rows):
+            return None
+        report = dict()
+        for label, test in (('all', rows[ntrain:]),
+                            ('transmission', [r for r in rows[ntrain:] if not is_fluorescence(r['mode'])]),
+                            ('fluorescence', [r for r in rows[ntrain:] if is_fluorescence(r['mode'])]), ):
+            if len(test) == 0:
+                continue
+            actual    = numpy.array([r['elapsed'] for r in test])
+            predicted = numpy.array([r['measurement'] + numpy.dot(model['coefficients'],
+                                                                  self.features(r['npoints'], r['dtheta'], r['measurement'],
+                                                                                r['mode'], r['crystal'], r['direction']))
+                                     for r in test])
+            ## the old estimate: mean overhead per point of the training scans of the same element
+            dpp = dict()
+            for r in rows[:ntrain]:
+                dpp.setdefault(r['element'], []).append((r['elapsed']-r['measurement'])/r['npoints'])
+            alldpp = numpy.mean([numpy.mean(v) for v in dpp.values()])
+            old = numpy.array([r['measurement'] + r['npoints']*numpy.mean(dpp.get(r['element'], [alldpp])) for r in test])
+            report[label] = {'count'              : len(test),
+                             'model error (s)'    : float(numpy.abs(predicted-actual).mean()),
+                             'model error (%)'    : float(100*(numpy.abs(predicted-actual)/actual).mean()),
+                             'per-point error (s)': float(numpy.abs(old-actual).mean()),
+                             'per-point error (%)': float(100*(numpy.abs(old-actual)/actual).mean()), }
+        print(f'Overhead model fit to {ntrain} scans, tested on {len(rows)-ntrain} scans')
+        for label, this in report.items():
+            print(f'  {label:13} ({this["count"]:5} scans): model {this["model error (s)"]:7.1f} s ({this["model error (%)"]:4.1f}%)'
+                  f'   per-point mean {this["per-point error (s)"]:7.1f} s ({this["per-point error (%)"]:4.1f}%)')
+        return report
+
     def value(self, el, thing='dpp'):
         if thing not in ('dpp', 'visual', 'xrf', 'ratio', 'difference'):
             return 0
-       
-        alltele = json.loads(tdata)
-        return alltele[el.capitalize()][thing][0]
+        this = self.overhead(el)
+        if thing in this:
+            return this[thing][0]
+        return self.table()[el.capitalize()][thing][0]
         
     def average(self, thing='dpp'):
         '''In the case of an element that has not been measured before, use
@@ -192,13 +498,18 @@ class BMMTelemetry():
         '''
         if thing not in ('dpp', 'visual', 'xrf', 'ratio', 'difference'):
             return (0,0)
-        with open(self.json, 'r') as td:
-            tdata = td.read()
-        alltele = json.loads(tdata)
-        a = []
-        for el in alltele.keys():
-            if 'dpp' in alltele[el]:
-                a.append(alltele[el]['dpp'][0])
+        rows = self.select()
+        if len(rows) > 0:
+            bytype = dict()
+            for r in rows:
+                bytype.setdefault(r['element'], []).append(r)
+            a = [self.statistics(these)['dpp'][0] for these in bytype.values()]
+        else:
+            alltele = self.table()
+            a = []
+            for el in alltele.keys():
+                if 'dpp' in alltele[el]:
+                    a.append(alltele[el]['dpp'][0])
 
         result = numpy.array(a).mean()
         if str(result) == 'nan':
@@ -223,10 +534,13 @@ class BMMTelemetry():
     #     return(numpy.interp(energy, e[s], t[s]))
 
     def overhead_per_point(self, element, edge=None):
-        a = json.load(open(self.json))
         element = element_symbol(element)
         if edge is not None and edge.lower() in ('l2', 'l1'):
             return(self.average(thing='dpp'))
+        this = self.overhead(element)
+        if this.get('count', 0) >= self.reliability:
+            return(this['dpp'])
+        a = self.table()
         if element in a and 'dpp' in a[element]:
             return(a[element]['dpp'])
         else:
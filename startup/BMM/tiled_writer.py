@@ -0,0 +1,293 @@
+import os, json, time, datetime, threading, queue, logging
+from collections import deque, OrderedDict
+
+from rich import print as cprint
+from event_model import pack_datum_page, pack_event_page
+
+logger = logging.getLogger('BMM_logger')
+WAIT_TIMEOUT = 60               # seconds to wait for a run to reach Tiled
+REMEMBER     = 1000             # number of runs for which wait() can be used
+
+
+def _error(text):
+    '''Red text on screen and an error in the BMM log.  BMM.functions
+    cannot be used here, this module is imported by BMM.user_ns.base.'''
+    cprint(f'[red1]{text}[/red1]')
+    logger.error(text)
+
+
+def _jsonable(obj):
+    '''Let json.dumps serialize numpy scalars and arrays found in documents.'''
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f'{type(obj)} is not JSON serializable')
+
+
+class TiledDocumentWriter():
+    '''A RunEngine subscription which saves documents to Tiled without
+    ever making the RunEngine wait on the network.
+
+    When called by the RunEngine, a document is appended to a spool
+    file for its run (one JSON line per document, written to local
+    disk) and placed on a bounded in-memory queue.  A worker thread
+    takes documents off the queue, coalesces runs of datum documents
+    into datum pages and runs of event documents into event pages,
+    and posts the batch to Tiled.  Failed posts are retried by the
+    worker, never by the RunEngine.
+
+    After a run's stop document is posted, its spool file is removed.
+    If the queue overflows, the rest of that run is skipped by the
+    queue and sent from its spool file by the worker once the queue
+    drains.  The spool file of a run which did not make it to Tiled --
+    because of a Tiled outage or because bsui was shut down -- stays on
+    disk and can be re-sent with replay().
+
+    Anything in bsui which reads a run back from Tiled soon after it
+    was measured -- like the bmm_catalog lookup at the end of an XAS
+    scan sequence -- must first call wait(uid), which blocks until the
+    run's stop document has been posted.  The kafka consumers wait on
+    their side (see consumer/tools.py), so sending a message never
+    waits.  The RunEngine subscription itself never waits.
+
+    attributes
+    ==========
+    client:
+      the Tiled writing client
+
+    spool: (str)
+      folder for spool files
+
+    maxsize: (int)
+      size of the in-memory queue [10000]
+
+    batch: (int)
+      largest number of documents coalesced into one post [500]
+
+    '''
+    def __init__(self, client, spool, maxsize=10000, batch=500):
+        self.client   = client
+        self.spool    = spool
+        self.batch    = batch
+        self.attempts = 6
+        self.queue    = queue.Queue(maxsize=maxsize)
+        self.current  = None    # uid of the run currently being spooled
+        self.sequence = 0       # line number of the next document in the current spool file
+        self.overflow = set()   # runs which overflowed the queue, sent from the spool file when the queue drains
+        self.stalled  = set()   # runs which Tiled failed to accept, to be sent by replay()
+        self.posted   = 0
+        self.failures = 0
+        self.latency  = deque(maxlen=200)
+        self.spoolfile = None
+        self.runs     = OrderedDict()   # uid : threading.Event, set once the stop document is posted
+        self.replay_lock = threading.Lock()
+        os.makedirs(self.spool, exist_ok=True)
+        self.thread = threading.Thread(target=self.work, name='tiled writer', daemon=True)
+        self.thread.start()
+
+    def spool_name(self, uid):
+        return os.path.join(self.spool, f'{uid}.jsonl')
+
+    def offset_name(self, uid):
+        return os.path.join(self.spool, f'{uid}.offset')
+
+    def __call__(self, name, doc):
+        if name == 'start':
+            if self.spoolfile is not None:
+                self.spoolfile.close()
+            self.current  = doc['uid']
+            self.sequence = 0
+            self.runs[self.current] = threading.Event()
+            while len(self.runs) > REMEMBER:
+                self.runs.popitem(last=False)
+            self.spoolfile = open(self.spool_name(self.current), 'a')
+        if self.spoolfile is None:   # a document outside of a run, nothing to spool it to
+            return
+        uid, sequence = self.current, self.sequence
+        self.spoolfile.write(json.dumps([name, doc], default=_jsonable) + '\n')
+        self.spoolfile.flush()
+        self.sequence += 1
+        if name == 'stop':
+            self.spoolfile.close()
+            self.spoolfile = None
+            self.current = None
+
+        if uid in self.overflow or uid in self.stalled:
+            return
+        try:
+            self.queue.put_nowait((uid, sequence, name, doc))
+        except queue.Full:
+            ## the rest of this run will be sent from its spool file
+            logger.warning(f'Tiled writer queue is full, run {uid} will be sent from its spool file')
+            self.overflow.add(uid)
+
+    def work(self):
+        '''Worker thread: coalesce queued documents and post them to Tiled.'''
+        pending = None
+        while True:
+            if pending is None:
+                try:
+                    pending = self.queue.get(timeout=5)
+                except queue.Empty:
+                    for uid in list(self.overflow):
+                        if uid != self.current:
+                            self.replay(uid)
+                    continue
+            if pending[0] in self.stalled:
+                pending = None
+                continue
+            batch = [pending]
+            pending = None
+            while len(batch) < self.batch and batch[-1][2] in ('datum', 'event'):
+                try:
+                    this = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if this[0] != batch[0][0] or not self.coalescable(batch[-1], this):
+                    pending = this
+                    break
+                batch.append(this)
+            self.flush(batch)
+
+    def coalescable(self, previous, this):
+        if this[2] != previous[2]:
+            return False
+        if this[2] == 'event':
+            return this[3]['descriptor'] == previous[3]['descriptor']
+        return True
+
+    def flush(self, batch):
+        uid, last, name = batch[0][0], batch[-1][1], batch[-1][2]
+        docs = [b[3] for b in batch]
+        if len(docs) > 1 and name == 'datum':
+            name, doc = 'datum_page', pack_datum_page(*docs)
+        elif len(docs) > 1 and name == 'event':
+            name, doc = 'event_page', pack_event_page(*docs)
+        else:
+            doc = docs[0]
+        if self.post(name, doc) is False:
+            ## give up on this run, what remains in the spool file can be sent by replay()
+            self.stalled.add(uid)
+            return False
+        self.posted += len(batch)
+        if name == 'stop':
+            self.finish(uid)
+        else:
+            with open(self.offset_name(uid), 'w') as fh:
+                fh.write(str(last+1))
+        return True
+
+    def post(self, name, doc):
+        '''Post a document to Tiled, retrying with exponential backoff.
+        This runs in the worker thread, so the RunEngine never waits on it.'''
+        for attempt in range(self.attempts):
+            tz = time.monotonic()
+            try:
+                self.client.post_document(name, doc)
+            except Exception as exc:
+                self.failures += 1
+                logger.warning(f'Tiled writer, document saving failure ({name}): {exc!r}')
+                time.sleep(2**attempt)
+            else:
+                self.latency.append(time.monotonic() - tz)
+                return True
+        _error(f'Tiled writer gave up posting a {name} document at {datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")}.  Use tiled_writer.replay() once Tiled is available.')
+        return False
+
+    def finish(self, uid):
+        self.overflow.discard(uid)
+        self.stalled.discard(uid)
+        for fname in (self.spool_name(uid), self.offset_name(uid)):
+            if os.path.isfile(fname):
+                os.remove(fname)
+        if uid in self.runs:
+            self.runs[uid].set()
+
+    def latest(self):
+        '''Return the uid of the most recent finished run written in this
+        session, or None.'''
+        for uid in reversed(list(self.runs.keys())):
+            if uid != self.current:
+                return uid
+        return None
+
+    def wait(self, uid=None, timeout=WAIT_TIMEOUT):
+        '''Block until the stop document of a run has been posted to
+        Tiled.  With uid=None, wait for every finished run which is
+        still on its way to Tiled -- a run which stalled before this
+        call is left to replay().  Return True when the run(s) are in
+        Tiled, False if a run stalls or timeout seconds pass.  A run
+        not written in this session is presumed to be in Tiled.'''
+        if uid is None:
+            uids = [u for u, event in list(self.runs.items())
+                    if u != self.current and u not in self.stalled and not event.is_set()]
+        else:
+            uids = [uid]
+        deadline = time.monotonic() + timeout
+        for u in uids:
+            event = self.runs.get(u)
+            if event is None:
+                continue
+            while not event.wait(0.25):
+                if u in self.stalled:
+                    _error(f'Run {u} has not been saved to Tiled, use tiled_writer.replay()')
+                    return False
+                if time.monotonic() > deadline:
+                    _error(f'Timed out after {timeout} seconds waiting for run {u} to be saved to Tiled')
+                    return False
+        return True
+
+    def spooled(self):
+        '''Return a list of uids of runs with documents not yet sent to Tiled.'''
+        return sorted(f[:-6] for f in os.listdir(self.spool) if f.endswith('.jsonl') and f[:-6] != self.current)
+
+    def replay(self, uid=None):
+        '''Re-send the spooled documents of a run, or of every spooled run,
+        to Tiled, starting after the last document known to have been
+        posted.  Documents are coalesced just as they are by the
+        worker.  When used by hand, replay should be done when no scan
+        is running, for instance after a Tiled outage or at the start
+        of a bsui session.  Replays by hand and by the worker thread
+        take turns.
+
+        '''
+        with self.replay_lock:
+            self._replay(uid)
+
+    def _replay(self, uid):
+        if uid is None:
+            uids = self.spooled()
+        else:
+            uids = [uid]
+        for u in uids:
+            offset = 0
+            if os.path.isfile(self.offset_name(u)):
+                with open(self.offset_name(u)) as fh:
+                    offset = int(fh.read().strip() or 0)
+            with open(self.spool_name(u)) as fh:
+                lines = fh.readlines()
+            print(f'replaying {len(lines)-offset} documents from run {u}')
+            self.stalled.discard(u)
+            batch = []
+            for i, line in enumerate(lines[offset:], start=offset):
+                this = (u, i, *json.loads(line))
+                if len(batch) > 0 and (len(batch) >= self.batch or batch[-1][2] not in ('datum', 'event')
+                                       or not self.coalescable(batch[-1], this)):
+                    if self.flush(batch) is False:
+                        batch = []
+                        break
+                    batch = []
+                batch.append(this)
+            if len(batch) > 0:
+                self.flush(batch)
+            self.overflow.discard(u)
+
+    def metrics(self):
+        '''Return a dict of queue depth, flush latency, and counts.'''
+        latency = list(self.latency)
+        return {'queue_depth'     : self.queue.qsize(),
+                'posted'          : self.posted,
+                'failures'        : self.failures,
+                'spooled_runs'    : len(self.spooled()),
+                'latency_mean'    : sum(latency)/len(latency) if len(latency) > 0 else 0,
+                'latency_max'     : max(latency) if len(latency) > 0 else 0,
+                }
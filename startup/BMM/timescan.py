@@ -29,7 +29,7 @@ from BMM.resting_state import resting_state, resting_state_plan
 from BMM.suspenders    import BMM_suspenders, BMM_clear_to_start, BMM_clear_suspenders
 from BMM.xafs          import scan_metadata, file_exists
 
-from BMM.user_ns.base      import bmm_catalog
+from BMM.user_ns.base      import bmm_catalog, tiled_writer
 from BMM.user_ns.detectors import quadem1, ic0, ic1, ic2, xs, xs1, xs4, xs7, ION_CHAMBERS
 from BMM.user_ns.dwelltime import _locked_dwell_time, use_7element, use_4element, use_1element
 
@@ -375,6 +375,7 @@ def sead(inifile=None, force=False, **kwargs):
         print('Cleaning up after single energy absorption detection measurement')
         BMM_clear_suspenders()
         how = 'finished  :tada:'
+        tiled_writer.wait()
         try:
             if 'primary' not in bmm_catalog[-1].metadata['stop']['num_events']:
                 how = '*stopped*'
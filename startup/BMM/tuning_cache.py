@@ -0,0 +1,190 @@
+'''Remember the outcomes of the alignment scans run by change_edge.
+
+A rocking curve, slit height or mirror pitch scan finds much the same
+optimum each time the beamline comes back to an energy in the same
+photon delivery mode.  Each optimum is recorded in redis, keyed by the
+kind of scan, the photon delivery mode, the mono crystal and an energy
+bin, along with the ring current and the time it took to find.
+
+When change_edge comes back to that mode and energy bin:
+
+  * a fresh entry is used as is -- the motor is moved to the recorded
+    optimum and the scan is skipped
+  * an older entry is verified -- the motor is moved to the recorded
+    optimum and a narrow scan is run around it
+  * an entry which has expired, or which was recorded at a very
+    different ring current, is ignored and the full scan is run
+
+An outcome is recorded only when the scan fit a peak and moved to it
+with the ring current above RING_MINIMUM.  A dry run, a scan which was
+not clear to start, or a failed wiggle_bct records nothing.
+
+The windows, bins and verification scans are module constants which
+can be changed at the command line.
+
+    >>> tuning_cache.show()
+    >>> tuning_cache.forget('rocking_curve')
+
+'''
+import json, time
+
+from BMM.workspace import rkvs
+from BMM.motion    import mv_needed
+
+TUNING_REDIS   = 'BMM:tuning:cache'
+## kind : (fresh, verify) -- seconds for which an entry is used as is, then verified by a narrow scan
+TUNING_WINDOWS = {'rocking_curve'   : (1800,  8*3600),
+                  'slit_height'     : (3600, 24*3600),
+                  'mirror_pitch_m2' : (3600, 24*3600),
+                  'mirror_pitch_m3' : (3600, 24*3600),
+                  }
+## kind : width in eV of an energy bin
+TUNING_BINS    = {'rocking_curve'   : 100,
+                  'slit_height'     : 1000,
+                  'mirror_pitch_m2' : 1000,
+                  'mirror_pitch_m3' : 1000,
+                  }
+## kind : keyword arguments of the narrow scan which verifies an entry
+TUNING_VERIFY  = {'rocking_curve'   : {'start': -0.03,  'stop': 0.03,  'nsteps': 31},
+                  'slit_height'     : {'start': -0.5,   'stop': 0.5,   'nsteps': 21},
+                  'mirror_pitch_m2' : {'start': -0.02,  'stop': 0.02,  'nsteps': 21},
+                  'mirror_pitch_m3' : {'start': -0.035, 'stop': 0.035, 'nsteps': 21},
+                  }
+RING_TOLERANCE = 0.1            # an entry is ignored if the ring current has changed by more than this fraction
+RING_MINIMUM   = 10             # mA, nothing is used or recorded below this, as when the beam is down
+
+
+class TuningCache():
+    '''Persistent record of alignment scan outcomes.
+
+    attributes
+    ==========
+    enabled: (bool)
+      False to always run the full scans (but still record their outcomes) [True]
+
+    stats: (dict)
+      number of fresh, verified, and missed lookups since startup or reset_stats()
+      and the estimated number of seconds saved by the fresh and verified ones
+
+    last: (dict)
+      kind : (outcome, age of the entry in seconds, seconds saved) from
+      the most recent change_edge, recorded in the metadata of each scan
+
+    '''
+    def __init__(self, store=rkvs):
+        self.store   = store
+        self.enabled = True
+        self.last    = dict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'fresh': 0, 'verified': 0, 'missed': 0, 'saved': 0.0}
+
+    def entries(self):
+        try:
+            return json.loads(self.store.get(TUNING_REDIS).decode('utf-8'))
+        except Exception:       # nothing in redis yet, or NoRedis
+            return dict()
+
+    def key(self, kind, mode, crystal, energy):
+        return f'{kind}:{mode}:Si({crystal}):{int(energy // TUNING_BINS[kind])}'
+
+    def lookup(self, kind, mode, crystal, energy, ring_current=None):
+        '''Return ('fresh'|'verify'|'stale', entry or None) for a kind of
+        scan in this photon delivery mode at this energy.'''
+        entry = self.entries().get(self.key(kind, mode, crystal, energy))
+        if entry is None or self.enabled is False:
+            return 'stale', entry
+        if not self.beam_ok(ring_current) or not self.beam_ok(entry['ring_current']):
+            return 'stale', entry
+        if abs(ring_current - entry['ring_current']) / entry['ring_current'] > RING_TOLERANCE:
+            return 'stale', entry
+        fresh, verify = TUNING_WINDOWS[kind]
+        age = time.time() - entry['timestamp']
+        if age < fresh:
+            return 'fresh', entry
+        elif age < verify:
+            return 'verify', entry
+        return 'stale', entry
+
+    def beam_ok(self, ring_current):
+        return ring_current is not None and ring_current >= RING_MINIMUM
+
+    def record(self, kind, mode, crystal, energy, position, seconds, ring_current=None):
+        entries = self.entries()
+        entries[self.key(kind, mode, crystal, energy)] = {'position': position, 'seconds': seconds, 'timestamp': time.time(),
+                                                          'energy': energy, 'ring_current': ring_current}
+        self.store.set(TUNING_REDIS, json.dumps(entries))
+
+    def forget(self, kind=None, mode=None):
+        '''Remove entries, all of them if kind and mode are None.'''
+        entries = {k: v for k, v in self.entries().items()
+                   if not ((kind is None or k.split(':')[0] == kind) and (mode is None or k.split(':')[1] == mode))}
+        self.store.set(TUNING_REDIS, json.dumps(entries))
+
+    def tune(self, kind, motor, mode, crystal, energy, scan, ring_current=None):
+        '''Bring motor to its optimum for this mode and energy, using
+        the cache if possible.
+
+        Parameters
+        ----------
+        kind : str
+            key of TUNING_WINDOWS, e.g. 'rocking_curve'
+        motor : positioner
+            the motor which the scan optimizes, e.g. dcm_pitch
+        mode : str
+            photon delivery mode
+        crystal : str
+            '111' or '311'
+        energy : float
+            energy at which the scan is made
+        scan : callable
+            function returning the plan of the scan, called with no arguments
+            for the full scan or with TUNING_VERIFY[kind] for a narrow one.
+            The plan returns the fitted peak position or None if no peak
+            was found.
+        ring_current : float
+            ring current in mA [None]
+
+        '''
+        state, entry = self.lookup(kind, mode, crystal, energy, ring_current)
+        begin = time.monotonic()
+        top = None
+        if state == 'fresh':
+            yield from mv_needed(motor, entry['position'])
+        elif state == 'verify':
+            yield from mv_needed(motor, entry['position'])
+            top = yield from scan(**TUNING_VERIFY[kind])
+        else:
+            top = yield from scan()
+
+        elapsed = time.monotonic() - begin
+        if state == 'stale':
+            saved, seconds = 0.0, elapsed
+            self.stats['missed'] += 1
+        else:
+            saved, seconds = max(entry['seconds'] - elapsed, 0.0), entry['seconds']
+            self.stats['fresh' if state == 'fresh' else 'verified'] += 1
+            self.stats['saved'] += saved
+        age = None if entry is None else round(time.time() - entry['timestamp'])
+        self.last[kind] = (state, age, round(saved, 1))
+        ## a fresh entry keeps its timestamp, so it will be verified in due course
+        if top is not None and self.beam_ok(ring_current):
+            self.record(kind, mode, crystal, energy, top, seconds, ring_current)
+
+    def metadata(self):
+        '''Summary of the cache for the start document of a scan.'''
+        lookups = self.stats['fresh'] + self.stats['verified'] + self.stats['missed']
+        return {'last': dict(self.last),
+                'hit_rate': round((self.stats['fresh'] + self.stats['verified']) / lookups, 3) if lookups > 0 else None,
+                'saved': round(self.stats['saved'], 1)}
+
+    def show(self):
+        now = time.time()
+        print(f'   {"entry":40} {"position":>10} {"energy":>8} {"age (min)":>10} {"scan (s)":>9}')
+        for key, entry in sorted(self.entries().items()):
+            print(f'   {key:40} {entry["position"]:10.4f} {entry["energy"]:8.1f} {(now-entry["timestamp"])/60:10.1f} {entry["seconds"]:9.1f}')
+        print(f'\n   {self.stats["fresh"]} fresh, {self.stats["verified"]} verified, {self.stats["missed"]} missed, {self.stats["saved"]:.0f} seconds saved')
+
+
+tuning_cache = TuningCache()
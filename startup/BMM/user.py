@@ -23,6 +23,7 @@ facility_dict = md = user_ns["RE"].md
 import BMM.functions
 from BMM.functions import BMM_STAFF, LUSTRE_XAS, LUSTRE_DATA_ROOT, proposal_base
 from BMM.functions import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
+from BMM.lookup_cache import read_json
 from BMM.kafka     import kafka_message
 from BMM.logging   import BMM_user_log, BMM_unset_user_log, report
 from BMM.periodictable import edge_energy
@@ -155,6 +156,8 @@ class BMM_User(Borg):
         measuring in pseudo-channel-cut mode
     ththth : bool
         measuring with the Si(333) reflection
+    fly : bool
+        measuring with the mono in continuous motion
     mode : str
         in-scan plotting mode
 
@@ -269,6 +272,7 @@ class BMM_User(Borg):
         self.bothways      = False
         self.channelcut    = True
         self.ththth        = False
+        self.fly           = False
         self.lims          = True
         self.mode          = 'transmission'
         self.url           = False
@@ -316,7 +320,7 @@ class BMM_User(Borg):
         self.bmm_booleans = ("prompt", "final_log_entry", "staff",
                              "use_slack", "trigger", "running_macro", "suspenders_engaged",
                              "macro_dryrun", "snapshots", "usbstick", "rockingcurve",
-                             "htmlpage", "bothways", "channelcut", "ththth", "lims", "url",
+                             "htmlpage", "bothways", "channelcut", "ththth", "fly", "lims", "url",
                              "doi", "cif", "syns", "enable_live_plots",
                              "post_webcam", "post_anacam", "post_usbcam1", "post_usbcam2", "post_xrf")
         self.bmm_none     = ("slack_channel", "extra_metadata")
@@ -406,9 +410,7 @@ class BMM_User(Borg):
                 if el.capitalize() in ('Pb', 'Au', 'Pt') and edge.capitalize() in ('L2', 'L1'):
                     forceit = True # Pb and Pt L3 edges are "standard" ROIs
                 if el not in xs.slots or forceit:
-                    with open(os.path.join(startup_dir, 'rois.json'), 'r') as fl:
-                        js = fl.read()
-                    allrois = json.loads(js)
+                    allrois = read_json(os.path.join(startup_dir, 'rois.json'))
                     xs.slots[-2] = el
                     for channel in xs.iterate_channels():
                         xs.set_roi_channel(channel, index=19, name=f'{el.capitalize()}',
@@ -492,7 +494,7 @@ class BMM_User(Borg):
             print('\nScan control attributes:')
             for att in ('pds_mode', 'bounds', 'steps', 'times', 'folder', 'workspace', 'filename',
                         'experimenters', 'element', 'edge', 'sample', 'prep', 'comment', 'nscans', 'start', 'inttime',
-                        'snapshots', 'usbstick', 'rockingcurve', 'htmlpage', 'bothways', 'channelcut', 'ththth', 'mode', 'npoints',
+                        'snapshots', 'usbstick', 'rockingcurve', 'htmlpage', 'bothways', 'channelcut', 'ththth', 'fly', 'mode', 'npoints',
                         'dwell', 'delay'):
                 print('\t%-15s = %s' % (att, str(getattr(self, att))))
 
@@ -987,6 +989,7 @@ Your data folder: `/nsls2/data/bmm/proposals/{user_ns["RE"].md["cycle"]}/pass-{g
         self.bothways = False
         self.channelcut = True
         self.ththth = False
+        self.fly = False
         self.lims = True
 
     def cycles(self):
@@ -64,3 +64,7 @@ if BMMuser.trigger is True:     # provide feedback if importing persistent user
     print('')
     whoami()
     BMMuser.trigger = False
+
+from BMM.functions import startup_finished, whisper
+whisper(f'profile loaded in {startup_finished():.1f} s, see startup_report()')
+warm_lazy_objects()
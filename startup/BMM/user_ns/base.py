@@ -1,8 +1,6 @@
 import nslsii
-import os, time, datetime, configparser
-from collections import deque
+import os, configparser
 
-from event_model import pack_datum_page
 from bluesky.plan_stubs import mv, mvr, sleep
 from databroker import Broker
 from tiled.client import from_uri, show_logs
@@ -63,57 +61,17 @@ RE.unsubscribe(0)  # remove databroker, which was subscribed first by configure_
 tiled_writing_client = from_uri(profile_configuration.get('services', 'tiled'),
                                 api_key=os.environ["TILED_BLUESKY_WRITING_API_KEY_BMM"])
 
-datum_docs_cache = deque()
-def create_datum_page_cb(name, doc):
-    if name == "datum":
-        datum_docs_cache.append(doc)
-        return
-
-    if len(datum_docs_cache) > 0:
-        datum_page = pack_datum_page(*datum_docs_cache)
-        datum_docs_cache.clear()
-        post_document("datum_page", datum_page)
-
-    post_document(name, doc)
-
-
-def post_document(name, doc):
-    #tz = time.monotonic()
-
-    ATTEMPTS = 6
-    error = None
-    #cprint(f'[orange1]{name}[/orange1]')
-    for attempt in range(ATTEMPTS):
-        try:
-            tiled_writing_client.post_document(name, doc)
-        except Exception as exc:
-            print("Document saving failure:", repr(exc))
-            error = exc
-        else:
-            break
-        print(f'sleeping {2**attempt} seconds before trying again...')
-        time.sleep(2**attempt)
-    else:
-        # out of attempts
-        print('***************************************************')
-        print('One last try to connect to tiled.  Wating 2 minutes')
-        print(f'Begin sleeping for 2 minutes at {datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")}')
-        print('***************************************************')
-        time.sleep(120)
-        try:
-            tiled_writing_client.post_document(name, doc)
-        except Exception as exc:
-            print("Document saving failure:", repr(exc))
-            print("Likeliest cause is a network failure or a Tiled service failure.  Contact beamline staff.")
-            error = exc
-            raise error
-        else:
-            pass
-
-    #print(f"post_document timing: {time.monotonic() - tz:.3}\n")
-    
-# RE.subscribe(post_document)
-RE.subscribe(create_datum_page_cb)
+## documents are spooled to local disk and posted to Tiled by a
+## worker thread, so the RunEngine never waits on Tiled.  Use
+## tiled_writer.replay() to re-send runs left in the spool by an
+## outage and tiled_writer.metrics() to see queue depth and latency.
+from BMM.tiled_writer import TiledDocumentWriter
+tiled_writer = TiledDocumentWriter(tiled_writing_client,
+                                   spool=profile_configuration.get('services', 'tiled_spool',
+                                                                   fallback=os.path.join(WORKSPACE, '.tiled_spool')))
+if len(tiled_writer.spooled()) > 0:
+    cprint(f'[orange1]{len(tiled_writer.spooled())} run(s) have not been saved to Tiled, use tiled_writer.replay()[/orange1]')
+RE.subscribe(tiled_writer)
 
 # this prefix needs to be the same (but with a dash) as the call to sync_experiment in user.py
 from redis_json_dict import RedisJSONDict
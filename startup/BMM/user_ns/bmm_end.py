@@ -6,7 +6,7 @@ except ImportError:
         return False
 
 import os, textwrap
-from BMM.functions import boxedtext, run_report, disconnected_msg, error_msg, whisper, verbosebold_msg, proposal_base, bounds
+from BMM.functions import boxedtext, run_report, disconnected_msg, error_msg, whisper, verbosebold_msg, proposal_base, bounds, startup_report
 from BMM.workspace import rkvs
 
 from BMM import user_ns as user_ns_module
@@ -316,6 +316,7 @@ XDI_record = {'xafs_linx'                        : (True,  'Sample.x'),
 run_report('\t'+'xafs')
 from BMM.xafs import howlong, xafs, xanes
 from BMM.xafs_functions import xrfat
+from BMM.xspress3_roi import reprocess_scans, rois_from_json, roi_from_energy, widen
 from BMM.dossier import lims
 
 run_report('\t'+'areascan')
@@ -329,6 +330,7 @@ from BMM.timescan import timescan, ts2dat, sead
 
 run_report('\t'+'raster scans')
 from BMM.raster import raster #, difference_data
+from BMM.map_stack import MapStack
 
 
 ################################################################################################################
@@ -342,8 +344,15 @@ from BMM.raster import raster #, difference_data
                                                                                                            
 
 
+## Larch, scikit-learn, and the telemetry index are slow to import or
+## to set up and are not needed until well after bsui starts, so they
+## are loaded on first use.  clf and tele are loaded in the background
+## once the profile is done, see BMM.lazy.warm_lazy_objects
+from BMM.lazy import Lazy, warm_lazy_objects
+
 run_report('\t'+'Larch')
-from BMM.larch_interface import Pandrosus, Kekropidai
+Pandrosus  = Lazy('Pandrosus',  'BMM.larch_interface', 'Pandrosus')
+Kekropidai = Lazy('Kekropidai', 'BMM.larch_interface', 'Kekropidai')
 ## examples that only work at BMM...
 # se = Pandrosus()
 # se.fetch('8e293af3-811c-4e96-a4e5-733d0dc77dad', name\='Se metal', mode='transmission')
@@ -359,13 +368,14 @@ run_report('\t'+'Demeter')
 from BMM.demeter import run_hephaestus
 
 run_report('\t'+'machine learning and data evaluation')
-from BMM.ml import BMMDataEvaluation
-clf = BMMDataEvaluation()
+clf = Lazy('clf', 'BMM.ml', 'BMMDataEvaluation', call=True, warm=True)
     
     
 run_report('\t'+'telemetry')
-from BMM.telemetry import BMMTelemetry
-tele = BMMTelemetry()
+tele = Lazy('tele', 'BMM.telemetry', 'BMMTelemetry', call=True, warm=True)
+def telemetry_callback(name, doc):
+    tele.callback(name, doc)
+user_ns['RE'].subscribe(telemetry_callback)      # add each XAS scan to the telemetry index as it finishes
 
 
 if BMMuser.element is None:
@@ -4,7 +4,7 @@ from bluesky.plan_stubs import mv
 from numpy import array
 from sympy import geometry
 
-from BMM.kafka         import kafka_message
+from BMM.kafka         import kafka_message, kafka_request
 from BMM.linescans     import linescan, prepare_alignment_scan, fetch_peak_position_via_redis
 from BMM.functions     import whisper
 from BMM.resting_state import resting_state_plan
@@ -89,12 +89,12 @@ class Wafer():
         uid = yield from linescan(motor, 'it', -2, 2, 41, dopluck=False)
         kafka_message({'close': 'last'})
 
-        kafka_message({'stepfit'    : True,
-                       'uid'        : 'last',
-                       'motor_name' : motor.name,
-                       'signal'     : 'It',
-                       'choice'     : 'peak'})
-        target = fetch_peak_position_via_redis()
+        reply_to = kafka_request({'stepfit'    : True,
+                                  'uid'        : 'last',
+                                  'motor_name' : motor.name,
+                                  'signal'     : 'It',
+                                  'choice'     : 'peak'})
+        target = fetch_peak_position_via_redis(reply_to)
         yield from mv(motor, target)
         
         # table  = user_ns['db'][-1].table()
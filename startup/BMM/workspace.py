@@ -16,6 +16,12 @@ class NoRedis():
         return None
     def get(self, thing):
         return None
+    def blpop(self, thing, timeout=0):
+        return None
+    def delete(self, thing):
+        return None
+    def brpoplpush(self, thing, otherthing, timeout=0):
+        return None
     
 ###################################################################
 # things that are configurable                                    #
@@ -1,11 +1,12 @@
 from bluesky.plans import scan_nd, count
-from bluesky.plan_stubs import sleep, mv, null
+from bluesky.plan_stubs import sleep, mv, null, abs_set
 from bluesky.preprocessors import subs_decorator, finalize_wrapper
 #from databroker.core import SingleRunCache
 
 import numpy, os, re, shutil, uuid, time
 import textwrap, configparser, datetime
 from cycler import cycler
+from ophyd import Kind
 import matplotlib
 import matplotlib.pyplot as plt
 
@@ -15,10 +16,12 @@ from tiled.client import from_profile
 from urllib.parse import quote
 
 from BMM.dossier         import DossierTools
-from BMM.functions       import countdown, boxedtext, now, isfloat, inflect, e2l, etok, ktoe, present_options, plotting_mode
+from BMM.electrometer    import Nanoize
+from BMM.flyscan         import fly_energy_scan, fly_time, FLY_FRAME_TIME
+from BMM.functions       import countdown, boxedtext, isfloat, inflect, e2l, etok, ktoe, present_options, plotting_mode
 from BMM.functions       import PROMPT, DEFAULT_INI, proposal_base, PROMPTNC, animated_prompt
 from BMM.functions       import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
-from BMM.kafka           import kafka_message, close_plots
+from BMM.kafka           import kafka_message, kafka_request, fetch_reply, close_plots
 from BMM.linescans       import rocking_curve
 from BMM.logging         import BMM_log_info, BMM_msg_hook, report
 from BMM.metadata        import bmm_metadata, display_XDI_metadata, metadata_at_this_moment
@@ -28,11 +31,12 @@ from BMM.periodictable   import edge_energy, Z_number, element_name
 from BMM.resting_state   import resting_state_plan
 from BMM.suspenders      import BMM_suspenders, BMM_clear_to_start, BMM_clear_suspenders
 from BMM.xafs_functions  import conventional_grid, sanitize_step_scan_parameters
+from BMM.set_on_change   import dwell_regions
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
 
-from BMM.user_ns.base      import bmm_catalog, WORKSPACE
+from BMM.user_ns.base      import bmm_catalog, tiled_writer
 from BMM.user_ns.dwelltime import _locked_dwell_time, use_7element, use_4element, use_1element
 from BMM.user_ns.detectors import quadem1, xs, xs1, xs4, xs7, ic0, ic1, ic2, pilatus, dante, ION_CHAMBERS
 
@@ -48,14 +52,14 @@ except ImportError:
 
 
 
-def next_index(folder=None, stub=None, maxtries=6, verbose=False):
+def next_index(folder=None, stub=None, timeout=10, verbose=False):
     '''Find the next numeric filename extension for a filename stub in the
     specified folder in the proposals directory.
 
-    This sends a message over kafka asking the file manager worker to
-    search for the next index.  The worker posts the value to redis.
-    This function sets that redis key to "None" and polls the
-    appropriate redis key for a value interpretable integer.
+    This sends a request over kafka asking the file manager worker to
+    search for the next index.  The worker posts the value to a redis
+    key unique to this request.  This function blocks on that key
+    until the answer arrives.
    
     arguments
     =========
@@ -65,11 +69,11 @@ def next_index(folder=None, stub=None, maxtries=6, verbose=False):
     stub: (str)
       filename stub to check, i.e. filename without extension
 
-    maxtries: (int)
-      maximum number of attempts to read before giving up and returning None [6]
+    timeout: (float)
+      number of seconds to wait for an answer before giving up and returning None [10]
 
     verbose: (bool)
-      if True, be noisy as we wait for a result
+      if True, report how long it took to get a result
 
     '''
     if folder is None:
@@ -77,31 +81,23 @@ def next_index(folder=None, stub=None, maxtries=6, verbose=False):
     if stub is None:
         error_msg('No stub supplied to next_index')
         return(None)
-    rkvs = user_ns['rkvs']
-    rkvs.set('BMM:next_index', 'None')
-    kafka_message({'next_index': True, 'folder': folder, 'stub': stub})
-    time.sleep(1)
-    answer = rkvs.get('BMM:next_index').decode('utf8')
-    count = 0
-    if verbose: print(f"{count = }, {answer = }")
-    while answer == 'None':
-        time.sleep(0.1*2**count)
-        answer = rkvs.get('BMM:next_index').decode('utf8')
-        count += 1
-        if verbose: print(f"{count = }, {answer = }")
-        if count > maxtries:
-            return(None)
+    t0 = time.time()
+    reply_to = kafka_request({'next_index': True, 'folder': folder, 'stub': stub})
+    answer = fetch_reply(reply_to, timeout=timeout)
+    if verbose: print(f"{answer = }, {time.time()-t0:.3f} seconds")
+    if answer is None:
+        return(None)
     return int(answer)
 
 
-def file_exists(folder=None, filename=None, start=1, stop=2, maxtries=15, number=True, verbose=False):
+def file_exists(folder=None, filename=None, start=1, stop=2, timeout=10, number=True, verbose=False):
     '''Determine if a file of the specified filename exists in a specified
     folder in the proposals directory.
 
-    This sends a message over kafka asking the file manager worker to
-    search for the file.  The worker posts "true" or "false" to redis.
-    This function sets that redis key to "None" and polls the
-    appropriate redis key for a "true"/"false" value.
+    This sends a request over kafka asking the file manager worker to
+    search for the file.  The worker posts "true" or "false" to a
+    redis key unique to this request.  This function blocks on that
+    key until the answer arrives.
    
     arguments
     =========
@@ -117,14 +113,14 @@ def file_exists(folder=None, filename=None, start=1, stop=2, maxtries=15, number
     stop: (int)
       end of extension number range to check
 
-    maxtries: (int)
-      maximum number of attempts to read before giving up and returning None
+    timeout: (float)
+      number of seconds to wait for an answer before giving up and returning None [10]
 
     number: (bool)
       if True, search for numbered extensions.  if False, search for filename as specified
 
     verbose: (bool)
-      if True, be noisy as we wait for a result
+      if True, report how long it took to get a result
 
     '''
     if folder is None:
@@ -132,19 +128,12 @@ def file_exists(folder=None, filename=None, start=1, stop=2, maxtries=15, number
     if filename is None:
         error_msg('No filename supplied to file_exists')
         return(None)
-    rkvs = user_ns['rkvs']
-    rkvs.set('BMM:file_exists', 'None')
-    kafka_message({'file_exists': True, 'folder': folder, 'filename': filename, 'start': start, 'stop': stop, 'number': number})
-    answer = rkvs.get('BMM:file_exists').decode('utf8')
-    count = 0
-    if verbose: print(f"{count = }, {answer = }")
-    while answer == 'None':
-        time.sleep(0.1)
-        answer = rkvs.get('BMM:file_exists').decode('utf8')
-        count += 1
-        if verbose: print(f"{count = }, {answer = }")
-        if count > maxtries:
-            return(None)
+    t0 = time.time()
+    reply_to = kafka_request({'file_exists': True, 'folder': folder, 'filename': filename, 'start': start, 'stop': stop, 'number': number})
+    answer = fetch_reply(reply_to, timeout=timeout)
+    if verbose: print(f"{answer = }, {time.time()-t0:.3f} seconds")
+    if answer is None:
+        return(None)
     if answer == 'true':
         return True
     else:
@@ -217,6 +206,8 @@ def scan_metadata(inifile=None, **kwargs):
         True = measure in pseudo-channel-cut mode
     ththth : bool
         True = measure using the Si(333) reflection
+    fly : bool
+        True = measure with the mono in continuous motion (see BMM.flyscan)
     mode : str
         transmission, fluorescence, or reference -- how to display the data
     bounds : list
@@ -345,7 +336,7 @@ def scan_metadata(inifile=None, **kwargs):
             found[a] = True
 
     ## ----- booleans
-    for a in ('snapshots', 'htmlpage', 'lims', 'bothways', 'channelcut', 'usbstick', 'rockingcurve', 'ththth', 'shutter'):
+    for a in ('snapshots', 'htmlpage', 'lims', 'bothways', 'channelcut', 'usbstick', 'rockingcurve', 'ththth', 'shutter', 'fly'):
         found[a] = False
         if a not in kwargs:
             try:
@@ -494,6 +485,67 @@ def xas2xdi(datafile, key):
 
 
 
+######################################################
+# --- energy scan with the mono in continuous motion #
+######################################################
+def fly_xafs(p, energy_grid, time_grid, md, more_kafka, frame_time=FLY_FRAME_TIME):
+    '''Fly scan counterpart of the scan_nd calls in xafs().
+
+    The hinted channels of the ion chambers and, in fluorescence or
+    yield mode, the Xspress3 ROIs in md['_dtc'] are recorded while the
+    mono moves continuously, then binned onto the energy grid.  The
+    primary stream has the same data keys as a step scan.  The full
+    MCA spectra are not saved in a fly scan.  The grids may run
+    backward, as for the even repetitions of a bothways scan.
+
+    See BMM.flyscan for details.
+    '''
+    BMMuser, dcm, dcm_bragg = user_ns['BMMuser'], user_ns['dcm'], user_ns['dcm_bragg']
+    fluorescence = plotting_mode(p['mode']) in ('fluorescence', 'yield')
+    signals = dict()
+    for ic in ION_CHAMBERS:
+        for name in ('I0', 'It', 'Ir', 'Iy', 'Ia', 'Ib'):
+            this = getattr(ic, name, None)
+            if isinstance(this, Nanoize) and this.kind & Kind.hinted:
+                signals[this.name] = (this.derived_from, 'current')
+    if fluorescence:
+        for n in range(1, 9):
+            if getattr(BMMuser, f'xs{n}', None) in md['XDI']['_dtc']:
+                signals[getattr(BMMuser, f'xs{n}')] = (getattr(BMMuser, f'xschannel{n}'), 'counts')
+
+    if plotting_mode(p['mode']) == 'fluorescence':
+        detectors, plan_name, hint = [*ION_CHAMBERS, xs], 'fly xafs fluorescence', 'xafs xs'
+    elif plotting_mode(p['mode']) == 'yield':
+        detectors, plan_name, hint = [*ION_CHAMBERS, xs], 'fly xafs yield + fluorescence', 'xafs yield'
+    else:
+        detectors, plan_name, hint = ION_CHAMBERS, f'fly xafs {p["mode"]}', f'xafs {p["mode"]}'
+
+    averaging = [ic.averaging_time.get() for ic in ION_CHAMBERS]
+    nframes   = int(1.5 * fly_time(energy_grid, time_grid, dcm._twod) / frame_time) + 100
+    def prepare():
+        for ic in ION_CHAMBERS:
+            yield from mv(ic.averaging_time, frame_time)
+        if fluorescence:
+            ## free-running in internal trigger mode, the ROI PVs update with every frame
+            yield from mv(xs.cam.trigger_mode, 1, xs.cam.acquire_time, frame_time, xs.cam.num_images, nframes)
+            yield from abs_set(xs.cam.acquire, 1)     # do not wait, acquisition runs until restore()
+    def restore():
+        if fluorescence:
+            yield from mv(xs.cam.acquire, 0)
+            yield from mv(xs.cam.num_images, 1)
+        for ic, value in zip(ION_CHAMBERS, averaging):
+            yield from mv(ic.averaging_time, value)
+
+    md = {**md,
+          'plan_name' : plan_name,
+          'detectors' : [d.name for d in detectors],
+          'hints'     : {'dimensions': [(['dcm_energy'], 'primary')]},
+          'BMM_kafka' : {'hint': hint, **more_kafka},
+          'XDI'       : {**md['XDI'], '_kind': 'xafs fly'}, }   # keep fly scans out of the step scan telemetry
+    return (yield from fly_energy_scan(energy_grid, time_grid, bragg=dcm_bragg, twod=dcm._twod, signals=signals, md=md,
+                                       frame_time=frame_time, prepare=prepare, restore=restore))
+
+
 #########################
 # -- the main XAFS scan #
 #########################
@@ -565,6 +617,9 @@ def xafs(inifile=None, **kwargs):
             BMMuser.lims = True
         if not any(p):          # scan_metadata returned having printed an error message
             return(yield from null())
+        if p['fly'] and (plotting_mode(p['mode']) in ('pilatus', 'dante') or p['ththth']):
+            warning_msg(f'A fly scan cannot be made in {p["mode"]} mode{" with the Si(333) reflection" if p["ththth"] else ""}, making a step scan instead.')
+            p['fly'] = False
 
         
         
@@ -749,15 +804,17 @@ def xafs(inifile=None, **kwargs):
         )
 
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-        ## measure XRF spectrum at Eave
+        ## measure XRF spectrum at Eave and snap photos, with the
+        ## Xspress3 triggered along with the cameras when doing both
+        xrf = None
         if plotting_mode(p['mode']) in ('fluorescence', 'yield', 'pilatus', 'dante') and BMMuser.lims is True:
-            print('capturing XRF for "xs" mode')
-            yield from dossier.capture_xrf(p['filename'], plotting_mode(p['mode']), md)
-
-        ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-        ## snap photos
+            xrf = plotting_mode(p['mode'])
+        if xrf is not None and (xrf == 'dante' or not p['snapshots']):
+            print(f'capturing XRF for "{xrf}" mode')
+            yield from dossier.capture_xrf(p['filename'], xrf, md)
+            xrf = None
         if p['snapshots']:
-            yield from dossier.cameras(p['folder'], p['filename'], md)
+            yield from dossier.cameras(p['folder'], p['filename'], md, xrf=xrf)
 
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
         ## capture dossier metadata for start document
@@ -815,7 +872,9 @@ def xafs(inifile=None, **kwargs):
             ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
             ## compute energy and dwell grids
             bold_msg('computing energy and dwell time grids')
-            (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
+            (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'], mode=p['mode'])
+            if p['fly']:
+                approx_time = fly_time(energy_grid, time_grid, dcm._twod) / 60
 
 
             ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
@@ -994,6 +1053,16 @@ def xafs(inifile=None, **kwargs):
                     yield from mv(dcm_bragg.acceleration, BMMuser.acc_fast)
                     whisper('  Resetting DCM acceleration time to %.2f sec' % dcm_bragg.acceleration.get())
 
+                ## set the dwell time of the first region while the mono is parked.  scan_nd
+                ## then only moves dwell_time when it changes and each signal chain skips a
+                ## put of the value it already has (see BMM/set_on_change.py), so the
+                ## signal chains are written only at the region boundaries
+                regions = dwell_regions(time_grid if md['Mono']['direction'] == 'forward' else time_grid[::-1])
+                if verbose: verbosebold_msg(f'{len(regions)} dwell time regions: ' + ', '.join(f'{t}s from point {i}' for i, t in regions))
+                _locked_dwell_time.reset_counts()
+                if not p['fly']:
+                    yield from mv(dwell_time, regions[0][1])
+
 
                 if plotting_mode(p['mode']) in ('fluorescence', 'yield', 'pilatus'):
                     #yield from mv(xs.cam.acquire_time, time_grid[0])
@@ -1046,9 +1115,19 @@ def xafs(inifile=None, **kwargs):
                               'edge': p["edge"],
                               'repetitions': p["nscans"],
                               'count': cnt, }
+                ## the plot manager evaluates the data when it sees the stop document
+                if any(md in p['mode'] for md in ('trans', 'fluo', 'flou', 'both', 'ref', 'xs', 'xs1', 'xs4', 'xs7', 'yield')):
+                    more_kafka['evaluate'] = plotting_mode(p['mode'])
                 kafka_message({'xafsscan': 'next',
                                'count': cnt })
-                if any(md in p['mode'] for md in ('trans', 'ref', 'test')):
+                if p['fly']:
+                    ## a backward repetition flies down from the top of the grid
+                    if md['Mono']['direction'] == 'backward':
+                        uid = yield from fly_xafs(p, energy_grid[::-1], time_grid[::-1], md={**xdi, **supplied_metadata}, more_kafka=more_kafka)
+                    else:
+                        uid = yield from fly_xafs(p, energy_grid, time_grid, md={**xdi, **supplied_metadata}, more_kafka=more_kafka)
+
+                elif any(md in p['mode'] for md in ('trans', 'ref', 'test')):
                     uid = yield from scan_nd([*ION_CHAMBERS], energy_trajectory + dwelltime_trajectory,
                                              md={**xdi, **supplied_metadata, 'plan_name' : f'scan_nd xafs {p["mode"]}',
                                                  'BMM_kafka': { 'hint': f'xafs {p["mode"]}', **more_kafka }})
@@ -1083,27 +1162,16 @@ def xafs(inifile=None, **kwargs):
                     hdf5_uid = xs.hdf5.file_name.value
                     
                 uidlist.append(uid)
-                kafka_message({'xasxdi': True, 'uid' : uid, 'filename': os.path.basename(datafile)})
+                kafka_message({'xasxdi': True, 'uid' : uid, 'filename': os.path.basename(datafile), 'streamed': True})
                 bold_msg('wrote %s' % datafile)
-                if not is_re_worker_active():
-                    BMM_log_info(f'energy scan finished, uid = {uid}, scan_id = {bmm_catalog[uid].metadata["start"]["scan_id"]}\ndata file written to {datafile}')
-                else:
-                    BMM_log_info(f'energy scan finished, uid = {uid}\ndata file written to {datafile}')
+                if verbose: whisper(_locked_dwell_time.put_report())
+                ## the scan_id of the run just finished, without waiting for it to reach Tiled
+                BMM_log_info(f'energy scan finished, uid = {uid}, scan_id = {user_ns["RE"].md.get("scan_id")}\ndata file written to {datafile}')
                     
                 ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-                ## data evaluation + message to Slack
-                ## also sync data with Google Drive
-                if any(md in p['mode'] for md in ('trans', 'fluo', 'flou', 'both', 'ref', 'xs', 'xs1', 'xs4', 'xs7', 'yield')):
-                    try:
-                        score, emoji = user_ns['clf'].evaluate(uid, mode=plotting_mode(p['mode']))
-                        report(f"ML data evaluation model: {emoji}", level='bold', slack=True)
-                        if score == 0:
-                            report(f'An {emoji} may not mean that there is anything wrong with your data. See https://tinyurl.com/2xp2bhbx', level='whisper', slack=True)
-                            with open(os.path.join(WORKSPACE, 'logs', 'failed_data_evaluation.txt'), 'a') as f:
-                                f.write(f'{now()}\n\tmode = {p["mode"]}/{plotting_mode(p["mode"])}\n\t{uid}\n\n')
-                    except:
-                        pass
-                        
+                ## data evaluation + message to Slack is done by the plot
+                ## manager (consumer/data_evaluation.py) so that the next
+                ## repetition need not wait for it, see clf.result(uid)
 
 
 
@@ -1127,6 +1195,7 @@ def xafs(inifile=None, **kwargs):
 
         if not is_re_worker_active():
             how = 'finished  :tada:'
+            tiled_writer.wait()
             try:
                 if 'primary' not in bmm_catalog[-1].metadata['stop']['num_events']:
                     how = '*stopped*  :warning:'
@@ -1334,10 +1403,15 @@ def howlong(inifile=None, interactive=True, **kwargs):
     if not ok:
         error_msg('\nThe following keywords are missing from your INI file: '), '%s\n' % str.join(', ', missing)
         return(orig, -1)
-    (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
+    (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'], mode=p['mode'])
+    if p['fly']:
+        step_time   = approx_time
+        approx_time = fly_time(energy_grid, time_grid, user_ns['dcm']._twod) / 60
     #if delta == 0:
     text = f'One scan of {len(energy_grid)} points will take about {approx_time:.1f} minutes\n'
     text +=f'The sequence of {inflect("scan", p["nscans"])} will take about {approx_time * int(p["nscans"])/60:.1f} hours'
+    if p['fly']:
+        text +=f'\nas a fly scan (a step scan would take about {step_time:.1f} minutes)'
     #else:
     #    text = f'One scan of {len(energy_grid)} points will take {approx_time:.1f} minutes +/- {delta:.1f} minutes \n'
     #    text +=f'The sequence of {inflect("scan", p["nscans"])} will take about {approx_time * int(p["nscans"])/60:.1f} hours +/- {delta*numpy.sqrt(int(p["nscans"])):.1f} minutes'
@@ -1397,6 +1471,6 @@ def xafs_grid(inifile=None, **kwargs):
     if not ok:
         error_msg('\nThe following keywords are missing from your INI file: '), '%s\n' % str.join(', ', missing)
         return(orig, -1)
-    (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
+    (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'], mode=p['mode'])
     print(f'{p["element"]} {p["edge"]}')
     return(energy_grid, time_grid)
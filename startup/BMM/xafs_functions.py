@@ -104,7 +104,7 @@ def sanitize_step_scan_parameters(bounds, steps, times):
     
 
 
-def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112, element=None, edge=None, ththth=False):
+def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112, element=None, edge=None, ththth=False, mode=None):
     '''
     Parameters
     ----------
@@ -118,6 +118,8 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
         edge energy, reference for boundary values
     ththth : Boolean
         using the Si(333) reflection
+    mode : str
+        measurement mode, used with the telemetry overhead model
 
     Output
     ------
@@ -213,6 +215,12 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
 
     #if element in ('Kr', 'Hg', 'Pu', 'Th', 'Ru', 'Am'):
     #    overhead, uncertainty = tele.average()
+    if mode is not None:
+        ## energy-dependent model: accounts for mono motion, detector readout, and the like
+        overhead, uncertainty = tele.predict(grid, timegrid, mode=mode, element=element)
+        approximate_time = (sum(timegrid) + overhead) / 60
+        delta = uncertainty / 60.0
+        return (grid, timegrid, approximate_time, delta)
     try:
         overhead, uncertainty, maxdpp, mindpp = tele.overhead_per_point(element) #, edge)
     except:
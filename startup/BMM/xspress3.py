@@ -1,5 +1,5 @@
-import numpy, h5py, json
-import xraylib, math
+import numpy, h5py
+import math
 import itertools, os, sys, re
 import time as ttime
 from collections import deque, OrderedDict
@@ -44,7 +44,8 @@ md = user_ns["RE"].md
 
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper, boxedtext
 from BMM.kafka         import kafka_message
-from BMM.periodictable import Z_number, edge_number
+from BMM.periodictable import Z_number, edge_energy, line_energy
+from BMM.lookup_cache  import read_json
 
 from BMM.user_ns.base import startup_dir, profile_configuration
         
@@ -346,9 +347,7 @@ class BMMXspress3DetectorBase(Xspress3Trigger, Xspress3Detector):
     def set_rois(self):
         '''Read ROI values from a JSON serialization on disk and set all 16 ROIs for channels 1-4.
         '''
-        with open(os.path.join(startup_dir, 'rois.json'), 'r') as fl:
-            js = fl.read()
-        allrois = json.loads(js)
+        allrois = read_json(os.path.join(startup_dir, 'rois.json'))
         for i, el in enumerate(self.slots):
             if el == 'OCR':
                 for channel in self.iterate_channels():
@@ -527,9 +526,7 @@ class BMMXspress3DetectorBase(Xspress3Trigger, Xspress3Detector):
     def check_element(self, element, edge):
         '''Check that the current element and edge is tabulated in rois.json
         '''
-        with open(os.path.join(startup_dir, 'rois.json'), 'r') as fl:
-            js = fl.read()
-        allrois = json.loads(js)
+        allrois = read_json(os.path.join(startup_dir, 'rois.json'))
         if element.capitalize() not in allrois:
             #print(f'{element} is not a tabulated element')
             return False
@@ -608,18 +605,17 @@ class BMMXspress3DetectorBase(Xspress3Trigger, Xspress3Detector):
             roicolor = '#aaaaaadd'
             if BMMuser.edge.lower() == 'k':
                 label = f'{BMMuser.element} Kα ROI'
-                ke = (2*xraylib.LineEnergy(z, xraylib.KL3_LINE) + xraylib.LineEnergy(z, xraylib.KL2_LINE))*1000/3
-                plt.axvline(x = ke/1.0016,  color = roicolor, linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'K')/1.0016,  color = roicolor, linewidth=1, label=label)
                     
             elif BMMuser.edge.lower() == 'l3':
                 label = f'{BMMuser.element} Lα ROI'
-                plt.axvline(x = xraylib.LineEnergy(z, xraylib.L3M5_LINE)*1000, color = roicolor, linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'L3'), color = roicolor, linewidth=1, label=label)
             elif BMMuser.edge.lower() == 'l2':
                 label = f'{BMMuser.element} Kβ1 ROI'
-                plt.axvline(x = xraylib.LineEnergy(z, xraylib.L2M4_LINE)*1000, color = roicolor, linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'L2'), color = roicolor, linewidth=1, label=label)
             elif BMMuser.edge.lower() == 'l1':
                 label = f'{BMMuser.element} Kβ3 ROI'
-                plt.axvline(x = xraylib.LineEnergy(z, xraylib.L1M3_LINE)*1000, color = roicolor, linewidth=1, label=label)
+                plt.axvline(x = line_energy(z, 'L1'), color = roicolor, linewidth=1, label=label)
 
             ## highlight the ROI
             if show_roi is True:
@@ -640,7 +636,7 @@ class BMMXspress3DetectorBase(Xspress3Trigger, Xspress3Detector):
         '''
         BMMuser, dcm = user_ns['BMMuser'], user_ns['dcm']
 
-        edge = xraylib.EdgeEnergy(Z_number(BMMuser.element), int(edge_number(BMMuser.edge)))*1000
+        edge = edge_energy(BMMuser.element, BMMuser.edge)
 
         if dcm.energy.position > edge:
             print(f'{BMMuser.element} {BMMuser.edge} -- current energy: {round(dcm.energy.position, 1)}\n')
@@ -0,0 +1,208 @@
+'''Recompute Xspress3 ROI sums from the MCA spectra saved in the HDF5
+file of a fluorescence XAFS scan.
+
+During a scan, the IOC sums each channel's spectrum over the ROIs set
+from rois.json and those sums are what get recorded in the primary
+stream, written to the XDI file, and used by Pandrosus.make_xmu.  The
+full spectrum at every point is in the HDF5 file, though, so the ROI
+can be widened, narrowed, or moved to a different emission line after
+the fact.
+
+The spectra are read in blocks of points, aligned with the HDF5
+chunks, or memory-mapped when the dataset is stored contiguously.
+Each block is reduced at once for all ROIs and channels: the
+cumulative sum along the MCA axis is computed once, then each ROI sum
+is a difference of two of its columns.
+
+Nothing in this module depends on the bsui profile, so it can be used
+in bsui, in the kafka consumer, or in a notebook.
+
+ROIs are given in MCA bins of 10 eV, as in rois.json, as a (low,
+high) pair covering bins low through high-1 -- the same as the IOC's
+min_x and size_x.  A ROI may also be a list of such pairs, one for
+each channel.
+
+    >>> from BMM.xspress3_roi import roi_sums, rois_from_json, widen
+    >>> rois = {'Fe': widen(rois_from_json('Fe', 'K'), 100), 'Mn': rois_from_json('Mn', 'K')}
+    >>> sums = roi_sums('/path/to/file.h5', rois)
+    >>> mu = sums['Fe'].sum(axis=1) / I0
+
+'''
+import os, re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy, h5py
+
+from BMM.lookup_cache import read_json
+
+DATASET  = 'entry/data/data'                   # where the HDF5 plugin puts the spectra
+NDATTRS  = 'entry/instrument/NDAttributes'     # where it puts per-frame attributes, like the dead-time factors
+BINWIDTH = 10                                  # eV per MCA bin
+BLOCKSIZE = 64 * 2**20                         # bytes of spectra to reduce at one go
+
+
+def rois_from_json(element, edge='K', filename=None):
+    '''Return the (low, high) ROI from rois.json for an element and edge.'''
+    if filename is None:
+        filename = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rois.json')
+    this = read_json(filename)[element.capitalize()][edge.lower()]
+    return (this['low'], this['high'])
+
+
+def roi_from_energy(center, width):
+    '''Return the (low, high) ROI spanning width eV centered at center eV,
+    e.g. at a fluorescence line energy.'''
+    return (int(round((center - width/2) / BINWIDTH)), int(round((center + width/2) / BINWIDTH)) + 1)
+
+
+def widen(roi, amount):
+    '''Widen a ROI by amount eV at each end (narrow it, if amount is negative).'''
+    step = int(round(amount / BINWIDTH))
+    return (max(roi[0] - step, 0), roi[1] + step)
+
+
+def xspress3_file(run):
+    '''Return the path to the Xspress3 HDF5 file of a run, or None.'''
+    for name, doc in run.documents():
+        if name == 'resource':
+            this = os.path.join(doc['root'], doc['resource_path'])
+            if '_%d' in this:
+                this = this % 0
+            if 'xspress3' in this:
+                return this
+    return None
+
+
+def deadtime_factors(handle, npoints, nchannels):
+    '''Return the per-point, per-channel dead-time correction factors
+    recorded by the IOC as NDAttributes, or ones if there are none.'''
+    factors = numpy.ones((npoints, nchannels))
+    if NDATTRS not in handle:
+        return factors
+    for name, dset in handle[NDATTRS].items():
+        found = re.fullmatch(r'chan0?(\d+)_?dt_?factor', name, flags=re.I)
+        if found is not None and int(found.group(1)) <= nchannels:
+            factors[:, int(found.group(1))-1] = dset[:npoints]
+    return factors
+
+
+def _bounds(rois, nchannels):
+    '''Return arrays of lower and upper bins, shape (nrois, nchannels).'''
+    lows, highs = [], []
+    for roi in rois.values():
+        roi = numpy.asarray(roi, dtype=int)
+        if roi.ndim == 1:
+            roi = numpy.tile(roi, (nchannels, 1))
+        lows.append(roi[:, 0])
+        highs.append(roi[:, 1])
+    return numpy.array(lows), numpy.array(highs)
+
+
+def _blocks(dset, blocksize):
+    '''Yield (first, last, array) for blocks of points of an MCA dataset.
+    A contiguous, uncompressed dataset is memory-mapped.  A chunked
+    dataset is read in whole chunks along the point axis.'''
+    npoints = dset.shape[0]
+    perpoint = int(numpy.prod(dset.shape[1:])) * dset.dtype.itemsize
+    step = max(1, blocksize // perpoint)
+    if dset.chunks is None and dset.compression is None and dset.id.get_offset() is not None:
+        mapped = numpy.memmap(dset.file.filename, dtype=dset.dtype, mode='r',
+                              offset=dset.id.get_offset(), shape=dset.shape)
+        for first in range(0, npoints, step):
+            yield first, min(first+step, npoints), mapped[first:first+step]
+        return
+    if dset.chunks is not None:
+        step = max(dset.chunks[0], step // dset.chunks[0] * dset.chunks[0])
+    buffer = numpy.empty((step, *dset.shape[1:]), dtype=dset.dtype)
+    for first in range(0, npoints, step):
+        last = min(first+step, npoints)
+        dset.read_direct(buffer, numpy.s_[first:last], numpy.s_[0:last-first])
+        yield first, last, buffer[:last-first]
+
+
+def roi_sums(filename, rois, channels=None, dtc=True, blocksize=BLOCKSIZE):
+    '''Sum the spectra in an Xspress3 HDF5 file over a set of ROIs.
+
+    Parameters
+    ----------
+    filename : str
+        the Xspress3 HDF5 file of a scan
+    rois : dict
+        name : ROI, where a ROI is a (low, high) pair of MCA bins or a list
+        of such pairs, one for each channel
+    channels : list of int
+        channels (counting from 1) to sum over, default is all
+    dtc : bool
+        multiply each sum by the dead-time correction factor of its point and
+        channel, as the IOC does for the ROI values in the primary stream
+    blocksize : int
+        approximate number of bytes of spectra to reduce at one go
+
+    Output
+    ------
+    dict of name : array of shape (npoints, nchannels)
+
+    '''
+    with h5py.File(filename, 'r') as handle:
+        dset = handle[DATASET]
+        npoints, nchannels, nbins = dset.shape
+        if channels is None:
+            channels = list(range(1, nchannels+1))
+        index = numpy.array(channels) - 1
+        lows, highs = _bounds(rois, nchannels)
+        lows, highs = lows[:, index], highs[:, index]
+        results = numpy.empty((len(rois), npoints, len(index)))
+        column = numpy.arange(len(index))
+        for first, last, block in _blocks(dset, blocksize):
+            ## cumulative sum with a leading zero, so that the sum over bins [lo, hi) is cs[hi] - cs[lo]
+            cs = numpy.zeros((last-first, len(index), nbins+1))
+            numpy.cumsum(block[:, index, :], axis=-1, out=cs[:, :, 1:])
+            for r in range(len(rois)):
+                results[r, first:last] = (cs[:, column, numpy.clip(highs[r], 0, nbins)] -
+                                          cs[:, column, numpy.clip(lows[r], 0, nbins)])
+        if dtc:
+            results *= deadtime_factors(handle, npoints, nchannels)[:, index]
+    return {name: results[r] for r, name in enumerate(rois)}
+
+
+def reprocess(filenames, rois, channels=None, dtc=True, workers=4):
+    '''Compute roi_sums for many HDF5 files concurrently.  Return a dict
+    of filename : result, with None for any file which could not be read.'''
+    results = dict()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {f: pool.submit(roi_sums, f, rois, channels, dtc) for f in filenames}
+        for f, future in futures.items():
+            try:
+                results[f] = future.result()
+            except Exception as E:
+                print(f'could not reprocess {f}: {E}')
+                results[f] = None
+    return results
+
+
+def reprocess_scans(catalog, uids, rois, channels=None, dtc=True, workers=4):
+    '''Recompute ROI sums for a list of fluorescence XAFS scans.
+
+    Return a dict of uid : pandas DataFrame with the energy, I0, It,
+    and Ir columns from the primary stream, plus, for each ROI, a
+    column for each channel (e.g. Fe1, Fe2, ...) and their sum (Fe).
+    Scans without an Xspress3 file are skipped.
+    '''
+    files = {uid: xspress3_file(catalog[uid]) for uid in uids}
+    files = {uid: f for uid, f in files.items() if f is not None}
+    sums = reprocess(list(files.values()), rois, channels=channels, dtc=dtc, workers=workers)
+    found = dict()
+    for uid, f in files.items():
+        if sums[f] is None:
+            continue
+        table = catalog[uid].primary.read(['dcm_energy', 'I0', 'It', 'Ir']).to_pandas()
+        for name, values in sums[f].items():
+            if len(values) != len(table):
+                print(f'{uid}: {len(values)} spectra for {len(table)} points, skipping')
+                break
+            for i, ch in enumerate(channels or range(1, values.shape[1]+1)):
+                table[f'{name}{ch}'] = values[:, i]
+            table[name] = values.sum(axis=1)
+        else:
+            found[uid] = table
+    return found
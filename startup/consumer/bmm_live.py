@@ -1,18 +1,18 @@
-import os, json
+import os, time
 from matplotlib import get_backend
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 from matplotlib.patches import Rectangle
 #from mpl_multitab import MplTabs
 import numpy, pandas
-import xraylib
 import datetime
 from bluesky import __version__ as bluesky_version
 
 from slack import img_to_slack
 from tools import experiment_folder, echo_slack, file_resource, profile_configuration
 
-from BMM.periodictable import Z_number, edge_number
+from BMM.periodictable import Z_number, edge_number, line_energy
+from BMM.lookup_cache import read_json
 
 #from nslsii.kafka_utils import _read_bluesky_kafka_config_file
 #from bluesky_kafka.produce import BasicProducer
@@ -23,6 +23,194 @@ bmm_redis = profile_configuration.get('services', 'bmm_redis')
 rkvs = redis.Redis(host=bmm_redis, port=6379, db=0)
 
 
+LIVE_FPS      = 10      # the most frames per second drawn for a live plot
+LIVE_HEADROOM = 0.1     # fraction of the axis range added to each end when a live plot rescales
+
+
+class GrowableBuffer():
+    '''A one-dimensional numpy array which is appended to like a list.
+
+    Storage is preallocated and its size is doubled when it fills, so
+    appending an event is cheap and the data are handed to matplotlib
+    as an array view, rather than converting a list to an array for
+    every event.
+
+    attributes
+    ==========
+    values (numpy array)
+      a view of the data appended thus far
+
+    '''
+    def __init__(self, size=512):
+        self.data = numpy.empty(size)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            bigger = numpy.empty(2*len(self.data))
+            bigger[:self.size] = self.data
+            self.data = bigger
+        self.data[self.size] = value
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+
+class LiveRenderer():
+    '''Redraw the live plots at a bounded frame rate.
+
+    The add method of a live plot class updates its lines, then calls
+    request.  Requests which arrive faster than max_fps are coalesced:
+    the figure is drawn once, showing every event received since the
+    previous frame.  A frame still pending when the consumer is waiting
+    for kafka messages is drawn by render.  flush draws the final frame
+    at the end of a scan, with the axes scaled tightly to the data.
+
+    When the data still fit within the axis limits, only the lines
+    which changed are drawn (blitted) over the background saved at
+    the last full redraw.  When an axis must be rescaled, its limits
+    are padded by LIVE_HEADROOM so that the next several points fit
+    without another full redraw.  With the Agg backend nothing is
+    drawn until the figure is saved.
+
+    attributes
+    ==========
+    max_fps (float)
+      the most frames drawn per second
+
+    pending (dict)
+      figure : (dict of axes : [artists], rescale, blit) waiting to be drawn
+
+    latest (dict)
+      figure : the most recent request for that figure
+
+    backgrounds (dict)
+      figure : (canvas size, dict of axes : saved background)
+
+    events, frames, blits, redraws (int)
+      requests received, frames drawn, and how those frames were drawn
+
+    '''
+    def __init__(self, max_fps=LIVE_FPS):
+        self.max_fps     = max_fps
+        self.pending     = dict()
+        self.latest      = dict()
+        self.backgrounds = dict()
+        self.last        = 0
+        self.reset()
+
+    def reset(self):
+        self.events, self.frames, self.blits, self.redraws = 0, 0, 0, 0
+
+    def report(self):
+        return(f'live plot: {self.events} events, {self.frames} frames drawn ' +
+               f'({self.blits} blitted, {self.redraws} full redraws), ' +
+               f'{max(self.events - self.frames, 0)} events coalesced into other frames')
+
+    def request(self, figure, artists, rescale=True, blit=True):
+        '''Ask for a figure to be redrawn.
+
+        Parameters
+        ----------
+        figure : matplotlib figure
+            the live plot
+        artists : dict
+            axes : list of the artists in those axes which have changed
+        rescale : bool
+            autoscale the axes to the data
+        blit : bool
+            False to always redraw the whole figure, e.g. when a colorbar changes
+
+        '''
+        self.events += 1
+        self.pending[figure] = self.latest[figure] = (artists, rescale, blit)
+        self.render()
+
+    def render(self, force=False):
+        '''Draw pending frames, if it has been long enough since the last one.'''
+        if len(self.pending) == 0:
+            return
+        if force is False:
+            if get_backend().lower() == 'agg' or time.monotonic() - self.last < 1/self.max_fps:
+                return
+        self.last = time.monotonic()
+        for figure, (artists, rescale, blit) in self.pending.items():
+            self.draw(figure, artists, rescale, blit)
+        self.pending = dict()
+
+    def flush(self, figure):
+        '''Draw the final frame of a figure, with its axes scaled tightly to the data.'''
+        self.pending.pop(figure, None)
+        if figure in self.latest:
+            self.draw(figure, *self.latest[figure], final=True)
+
+    def invalidate(self, figure):
+        '''Force a full redraw of a figure on its next frame, e.g. after a legend or title changes.'''
+        self.backgrounds.pop(figure, None)
+
+    def forget(self, figure):
+        self.pending.pop(figure, None)
+        self.latest.pop(figure, None)
+        self.backgrounds.pop(figure, None)
+
+    def fits(self, ax):
+        '''Do the data in an axes lie within its present limits?'''
+        (x0, x1), (y0, y1) = sorted(ax.get_xlim()), sorted(ax.get_ylim())
+        data = ax.dataLim
+        return x0 <= data.x0 and data.x1 <= x1 and y0 <= data.y0 and data.y1 <= y1
+
+    def pad(self, ax):
+        '''Widen the limits of the linear axes of an autoscaled plot.'''
+        if ax.get_xscale() == 'linear':
+            low, high = ax.get_xlim()
+            ax.set_xlim(low - LIVE_HEADROOM*(high-low), high + LIVE_HEADROOM*(high-low), auto=None)
+        if ax.get_yscale() == 'linear':
+            low, high = ax.get_ylim()
+            ax.set_ylim(low - LIVE_HEADROOM*(high-low), high + LIVE_HEADROOM*(high-low), auto=None)
+
+    def draw(self, figure, artists, rescale=True, blit=True, final=False):
+        canvas = figure.canvas
+        full   = (final or not blit or not canvas.supports_blit or figure not in self.backgrounds or
+                  self.backgrounds[figure][0] != canvas.get_width_height() or
+                  any(ax not in self.backgrounds[figure][1] for ax in artists))
+        if rescale:
+            for ax in artists:
+                ax.relim()
+                if final:
+                    ax.autoscale_view(True,True,True)
+                elif full or not self.fits(ax):
+                    ax.autoscale_view(True,True,True)
+                    self.pad(ax)
+                    full = True
+        if get_backend().lower() == 'agg':
+            return              # savefig will draw the figure
+        self.frames += 1
+        if full:
+            canvas.draw()
+            if canvas.supports_blit:
+                self.backgrounds[figure] = (canvas.get_width_height(), {ax: canvas.copy_from_bbox(ax.bbox) for ax in figure.axes})
+            self.redraws += 1
+        else:
+            ## the lines only grow during a scan, so drawing them over
+            ## the background from the last full redraw is correct
+            saved = self.backgrounds[figure][1]
+            for ax, these in artists.items():
+                canvas.restore_region(saved[ax])
+                for artist in these:
+                    ax.draw_artist(artist)
+                canvas.blit(ax.bbox)
+            self.blits += 1
+        canvas.flush_events()
+
+renderer = LiveRenderer()
+
+
+
 
 class LineScan():
     '''Manage the live plot for a motor scan or a time scan.
@@ -60,11 +248,11 @@ class LineScan():
     ongoing (bool)
       a flag indicating whether a line or time scan is in progress
 
-    xdata (list)
-      a list containing all x-axis values measured thus far
+    xdata (GrowableBuffer)
+      all x-axis values measured thus far
 
-    ydata (list)
-      a list containing all y-axis values measured thus far
+    ydata (GrowableBuffer)
+      all y-axis values measured thus far
 
     motor (str)
       the name of the motor in motion or None for a time scan
@@ -130,11 +318,11 @@ class LineScan():
         #if self.figure is not None:
         #    plt.close(self.figure.number)
         self.ongoing = True
-        self.xdata = []
-        self.ydata = []
-        self.y2data = []
-        self.y3data = []
-        self.trdata = []
+        self.xdata = GrowableBuffer()
+        self.ydata = GrowableBuffer()
+        self.y2data = GrowableBuffer()
+        self.y3data = GrowableBuffer()
+        self.trdata = GrowableBuffer()
         if 'motor' in kwargs: self.motor = kwargs['motor']
         self.numerator = kwargs['detector'].capitalize()
         self.denominator = None
@@ -323,6 +511,10 @@ class LineScan():
 
 
     def stop(self, catalog, **kwargs):
+        renderer.flush(self.figure)
+        self.logger.info(renderer.report())
+        renderer.forget(self.figure)
+        renderer.reset()
         if get_backend().lower() == 'agg':
             if 'fname' in kwargs and 'uid' in kwargs:
                 fname = os.path.join(experiment_folder(catalog, kwargs["uid"]), 'snapshots', kwargs["fname"])
@@ -443,26 +635,21 @@ class LineScan():
             if self.fluo_detector == '1-element SDD':
                 self.y2data.append(signal2/kwargs['data'][self.denominator])
                 self.y3data.append(signal3/kwargs['data'][self.denominator])
-        self.line.set_data(self.xdata, self.ydata)
+        self.line.set_data(self.xdata.values, self.ydata.values)
         if self.numerator == 'Eiger':
-            self.line2.set_data(self.xdata, self.y2data)
+            self.line2.set_data(self.xdata.values, self.y2data.values)
         if self.fluo_detector == '1-element SDD':
-            self.line2.set_data(self.xdata, self.y2data)
-            self.line3.set_data(self.xdata, self.y3data)
+            self.line2.set_data(self.xdata.values, self.y2data.values)
+            self.line3.set_data(self.xdata.values, self.y3data.values)
         if self.fluo_detector is not None and self.stack is True:
-            self.linetr.set_data(self.xdata, self.trdata)
-            self.fl.relim()
-            self.fl.autoscale_view(True,True,True)
-            self.tr.relim()
-            self.tr.autoscale_view(True,True,True)
+            self.linetr.set_data(self.xdata.values, self.trdata.values)
+            changed = {self.fl: list(self.fl.lines), self.tr: [self.linetr]}
         else:
-            self.axes.relim()
-            self.axes.autoscale_view(True,True,True)
-
+            changed = {self.axes: list(self.axes.lines)}
 
+        ## rescale and redraw at no more than LIVE_FPS frames per second
         #self.figure.show()      # in case the user has closed the window
-        self.figure.canvas.draw()
-        self.figure.canvas.flush_events()
+        renderer.request(self.figure, changed)
 
     def close_all_lineplots(self):
         for i in self.plots:
@@ -554,12 +741,12 @@ class XAFSScan():
         '''Begin a sequence of XAFS live plots.
         '''
         self.ongoing     = True
-        self.energy      = []
-        self.i0sig       = []
-        self.trans       = []
-        self.fluor       = []
-        self.refer       = []
-        self.iysig       = []
+        self.energy      = GrowableBuffer()
+        self.i0sig       = GrowableBuffer()
+        self.trans       = GrowableBuffer()
+        self.fluor       = GrowableBuffer()
+        self.refer       = GrowableBuffer()
+        self.iysig       = GrowableBuffer()
         self.mode        = kwargs['mode']
         self.filename    = kwargs['filename']
         self.repetitions = kwargs['repetitions']
@@ -702,12 +889,14 @@ class XAFSScan():
         '''
         self.count = kwargs['count']
         self.fig.suptitle(f'{self.filename}: scan {self.count} of {self.repetitions}')
-        self.energy      = []
-        self.i0sig       = []
-        self.trans       = []
-        self.fluor       = []
-        self.refer       = []
-        self.iysig       = []
+        self.energy      = GrowableBuffer()
+        self.i0sig       = GrowableBuffer()
+        self.trans       = GrowableBuffer()
+        self.fluor       = GrowableBuffer()
+        self.refer       = GrowableBuffer()
+        self.iysig       = GrowableBuffer()
+        renderer.flush(self.fig)   # finish drawing the previous scan
+        renderer.invalidate(self.fig)
         if self.mode not in ('pilatus', 'eiger'):
             self.line_mut,   = self.mut.plot([],[], label=f'scan {self.count}')
         self.line_i0,    = self.i0.plot([],[],  label=f'scan {self.count}')
@@ -726,6 +915,10 @@ class XAFSScan():
         '''Done with a sequence of XAFS live plots.
         '''
         filename = kwargs['filename']
+        renderer.flush(self.fig)
+        self.logger.info(renderer.report())
+        renderer.forget(self.fig)
+        renderer.reset()
         #self.figure.show(block=False)
         self.ongoing     = False
         # self.xdata       = []
@@ -772,9 +965,11 @@ class XAFSScan():
         self.i0sig.append(kwargs['data']['I0']/kwargs['data']['dwti_dwell_time'])  # this should be the same number as cadashboard....
         self.trans.append(numpy.log(abs(kwargs['data']['I0']/kwargs['data']['It'])))
         ## push the updated data arrays to the various lines
-        self.line_i0.set_data(self.energy, self.i0sig)
+        self.line_i0.set_data(self.energy.values, self.i0sig.values)
+        changed = {self.i0: [self.line_i0], self.ref: [self.line_ref]}
         if self.mode not in ('pilatus', 'eiger'):
-            self.line_mut.set_data(self.energy, self.trans)
+            self.line_mut.set_data(self.energy.values, self.trans.values)
+            changed[self.mut] = [self.line_mut]
 
 
         if self.mode in ('transmission', 'fluorescence', 'yield', 'dante', 'reference'):
@@ -783,14 +978,16 @@ class XAFSScan():
         if self.mode in ('pilatus', 'eiger'):  # re-purpose refer and iysig
             self.refer.append(kwargs['data']['diffuse']/kwargs['data']['I0'])
             self.iysig.append(kwargs['data']['specular']/kwargs['data']['I0'])
-            self.line_iy.set_data(self.energy, self.iysig)
+            self.line_iy.set_data(self.energy.values, self.iysig.values)
+            changed[self.iy] = [self.line_iy]
 
         if self.mode == 'yield':
             self.iysig.append(kwargs['data']['Iy']/kwargs['data']['I0'])
-            self.line_iy.set_data(self.energy, self.iysig)
+            self.line_iy.set_data(self.energy.values, self.iysig.values)
+            changed[self.iy] = [self.line_iy]
 
 
-        self.line_ref.set_data(self.energy, self.refer)
+        self.line_ref.set_data(self.energy.values, self.refer.values)
 
 
         ## and do all that for the fluorescence spectrum if it is being plotted.
@@ -818,20 +1015,16 @@ class XAFSScan():
                                     kwargs['data'][self.xs5] +
                                     kwargs['data'][self.xs6] +
                                     kwargs['data'][self.xs7]   ) / kwargs['data']['I0'])
-            self.line_muf.set_data(self.energy, self.fluor)
+            self.line_muf.set_data(self.energy.values, self.fluor.values)
+            changed[self.muf] = [self.line_muf]
         #if self.mode in ('eyield'):
         #    self.fluor.append( kwargs['data']['Iy'] / kwargs['data']['I0'] )
         #    self.line_muf.set_data(self.energy, self.fluor)
 
-        ## rescale everything
-        for ax in self.axis_list:
-            ax.relim()
-            ax.autoscale_view(True,True,True)
+        ## rescale and redraw at no more than LIVE_FPS frames per second
         #self.fig.show()         # in case the user has closed the window
-        ## redraw and flush the canvas
         ## Tom's explanation for how to do multiple plots: https://stackoverflow.com/a/31686953
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        renderer.request(self.fig, changed)
 
 
 
@@ -868,9 +1061,7 @@ class XRF():
 
     def reset_rois(self):
         startup_dir = profile_configuration.get('services', 'startup')
-        with open(os.path.join(startup_dir, 'rois.json'), 'r') as fl:
-            js = fl.read()
-        self.allrois = json.loads(js)
+        self.allrois = read_json(os.path.join(startup_dir, 'rois.json'))
         print('Set ROI values')
 
 
@@ -949,16 +1140,16 @@ class XRF():
                     z = Z_number(el)
                     if ed.lower() == 'k':
                         label = f'{el} Kα ROI'
-                        eline = (2*xraylib.LineEnergy(z, xraylib.KL3_LINE) + xraylib.LineEnergy(z, xraylib.KL2_LINE))*1000/3
+                        eline = line_energy(z, 'K')
                     elif ed.lower() == 'l3':
                         label = f'{el} Lα ROI'
-                        eline = xraylib.LineEnergy(z, xraylib.L3M5_LINE)*1000
+                        eline = line_energy(z, 'L3')
                     elif ed.lower() == 'l2':
                         label = f'{el} Kβ1 ROI'
-                        eline = xraylib.LineEnergy(z, xraylib.L2M4_LINE)*1000
+                        eline = line_energy(z, 'L2')
                     elif ed.lower() == 'l1':
                         label = f'{el} Kβ3 ROI'
-                        eline = xraylib.LineEnergy(z, xraylib.L1M3_LINE)*1000
+                        eline = line_energy(z, 'L1')
 
                     roicolor = '#aaaaaadd'
                     self.axes.axvline(x=eline, color=roicolor, linewidth=1, label=label)
@@ -1177,6 +1368,10 @@ class AreaScan():
         rkvs.set('BMM:mouse_event:motor2', ev.canvas.figure.axes[0].get_ylabel())
 
     def stop(self, catalog, **kwargs):
+        renderer.flush(self.figure)
+        self.logger.info(renderer.report())
+        renderer.forget(self.figure)
+        renderer.reset()
         if get_backend().lower() == 'agg':
             if 'filename' in kwargs and kwargs['filename'] is not None and kwargs['filename'] != '':
                 fname = os.path.join(experiment_folder(catalog, kwargs["uid"]), 'maps', kwargs["filename"])
@@ -1221,9 +1416,11 @@ class AreaScan():
             signal  = (kwargs['data'][f'{self.element}1']+kwargs['data'][f'{self.element}2']+kwargs['data'][f'{self.element}3']+kwargs['data'][f'{self.element}4']) / kwargs['data']['I0']
 
         self.cdata[self.count] = signal
-        self.axes.pcolormesh(self.fast, self.slow, self.cdata.reshape(self.slow_steps, self.fast_steps), cmap=plt.cm.viridis)
+        self.im.set_array(self.cdata.reshape(self.slow_steps, self.fast_steps))
         self.im.set_clim(self.cdata.min(), self.cdata.max())
         self.count += 1
+        ## the colorbar changes with every point, so redraw the whole figure
+        renderer.request(self.figure, {self.axes: [self.im]}, rescale=False, blit=False)
 
 
 
@@ -1256,9 +1453,9 @@ class XRR():
         #if self.figure is not None:
         #    plt.close(self.figure.number)
         self.ongoing = True
-        self.xdata = []
-        self.rawdata = []
-        self.xrrdata = []
+        self.xdata = GrowableBuffer()
+        self.rawdata = GrowableBuffer()
+        self.xrrdata = GrowableBuffer()
         print(kwargs)
         if 'motor'    in kwargs: self.motor    = kwargs['motor']
         if 'detector' in kwargs: self.detector = kwargs['detector']
@@ -1296,6 +1493,10 @@ class XRR():
     
 
     def stop(self, catalog, **kwargs):
+        renderer.flush(self.figure)
+        self.logger.info(renderer.report())
+        renderer.forget(self.figure)
+        renderer.reset()
         if get_backend().lower() == 'agg':
             if 'filename' in kwargs and kwargs['filename'] is not None and kwargs['filename'] != '':
                 folder = os.path.join(experiment_folder(catalog, kwargs["uid"]), 'pictures')
@@ -1332,15 +1533,9 @@ class XRR():
         rando = 5000 * numpy.random.rand()
         self.xrrdata.append(rando + factor * kwargs['data']['mca_full'] / kwargs['data']['dwti_dwell_time'])
         
-        self.lineraw.set_data(self.xdata, self.rawdata)
-        self.linexrr.set_data(self.xdata, self.xrrdata)
+        self.lineraw.set_data(self.xdata.values, self.rawdata.values)
+        self.linexrr.set_data(self.xdata.values, self.xrrdata.values)
 
-        self.raw.relim()
-        self.raw.autoscale_view(True,True,True)
-        self.xrr.relim()
-        self.xrr.autoscale_view(True,True,True)
-        
         #self.figure.show()      # in case the user has closed the window
-        self.figure.canvas.draw()
-        self.figure.canvas.flush_events()
+        renderer.request(self.figure, {self.raw: [self.lineraw], self.xrr: [self.linexrr]})
         
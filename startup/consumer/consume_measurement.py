@@ -7,7 +7,8 @@ import nslsii
 import nslsii.kafka_utils
 
 from tiled.client import from_profile
-bmm_catalog = from_profile('bmm')
+from BMM.run_cache import RunCache
+bmm_catalog = RunCache(from_profile('bmm'))   # each run is fetched from Tiled only once
 
 import matplotlib.pyplot as plt
 import bmm_plot
@@ -46,7 +47,7 @@ aw.logger = logger
 be_verbose = True
 doing = None
 
-from bmm_live import LineScan, XAFSScan, XRF, AreaScan, XRR
+from bmm_live import LineScan, XAFSScan, XRF, AreaScan, XRR, renderer
 ls  = LineScan()
 ls.logger = logger
 xs  = XAFSScan()
@@ -61,7 +62,13 @@ asc.logger = logger
 xrr = XRR()
 xrr.logger = logger
 
-from tools import peakfit, rectanglefit, stepfit
+from tools import peakfit, rectanglefit, stepfit, profile_configuration, rkvs, wait_for_run, RunArrivals
+arrivals = RunArrivals(bmm_catalog)
+from data_evaluation import DataEvaluator
+evaluator = DataEvaluator(os.path.join(profile_configuration.get('services', 'startup'), 'ML'), bmm_catalog,
+                          rkvs      = rkvs,
+                          workspace = profile_configuration.get('services', 'workspace'))
+evaluator.logger = logger
 
 if os.getenv('USER') == 'workflow-bmm':
     matplotlib.use('Agg')
@@ -73,11 +80,30 @@ if os.getenv('USER') == 'workflow-bmm':
 plt.ion()
 plt.rcParams["figure.raise_window"] = False
 
-from slack import refresh_slack, describe_slack
+from slack import refresh_slack, describe_slack, post_to_slack
+evaluator.post = post_to_slack
+
+def between_messages():
+    '''While waiting for kafka, draw any live plot frame that was
+    coalesced away while events were streaming in, then let the GUI
+    event loop run.'''
+    renderer.render()
+    plt.pause(.1)
+
+
+def after_stop(uid):
+    '''Once a run is in Tiled, submit it for data evaluation if it
+    asked for one.  This runs in a worker thread of arrivals.'''
+    if not wait_for_run(bmm_catalog, uid):
+        return
+    start = bmm_catalog[uid].metadata['start']
+    if 'evaluate' in start.get('BMM_kafka', dict()):
+        evaluator.submit(uid, start['BMM_kafka']['evaluate'])
+
 
 def plot_from_kafka_messages(beamline_acronym):
 
-    def examine_message(consumer, doctype, doc):
+    def examine_message(consumer, doctype, doc, held=False):
         global doing, be_verbose
         # print(
         #     f"\n[{datetime.datetime.now().isoformat(timespec='seconds')}] document topic: {doctype}\n"
@@ -90,6 +116,14 @@ def plot_from_kafka_messages(beamline_acronym):
         #     pprint.pprint(message)
         #     print('\n')
 
+        ## a message naming a run waits for it to reach Tiled, messages
+        ## already held are handled first, in order, once they are ready
+        if held is False:
+            for ready in arrivals.ready():
+                examine_message(consumer, doctype, ('bmm', ready), held=True)
+            if name == 'bmm' and arrivals.hold(message):
+                return
+
         if name == 'bmm':
             if any(x in message for x in ('xafs_sequence', 'glancing_angle', 'align_wheel', 'wafer', 'mono_calibration',
                                           'xrfat', 'linescan', 'xafsscan', 'timescan', 'xrf', 'areascan', 'close', 'logger', 'refresh_slack',
@@ -210,7 +244,8 @@ def plot_from_kafka_messages(beamline_acronym):
                         signal  = message['signal'],
                         choice  = message['choice'],
                         spinner = spinner,
-                        ga      = ga)
+                        ga      = ga,
+                        reply_to = message.get('reply_to'))
                     
             elif 'rectanglefit' in message:
                 if 'drop' in message:
@@ -222,7 +257,8 @@ def plot_from_kafka_messages(beamline_acronym):
                              motor   = message['motor_name'],
                              signal  = message['signal'],
                              drop    = drop,
-                             aw      = aw)
+                             aw      = aw,
+                             reply_to = message.get('reply_to'))
 
             elif 'stepfit' in message:
                 if 'spinner' in message:
@@ -234,7 +270,8 @@ def plot_from_kafka_messages(beamline_acronym):
                         motor   = message['motor_name'],
                         signal  = message['signal'],
                         spinner = spinner,
-                        ga      = ga)
+                        ga      = ga,
+                        reply_to = message.get('reply_to'))
 
 
                     
@@ -314,10 +351,8 @@ def plot_from_kafka_messages(beamline_acronym):
             #)
             #return
             uid = message['run_start']  # stop document is the second item in the doc list
-            record = bmm_catalog[uid]
-            verbose = False
-            if 'BMM_kafka' in record.metadata['start']:
-                hint = record.metadata['start']['BMM_kafka']['hint']
+            ## the run may not be in Tiled yet, so it is read in a worker thread
+            arrivals.submit(after_stop, uid)
                 #print(f'[{datetime.datetime.now().isoformat(timespec="seconds")}]   {uid}')
                 # for k in record.metadata['start']['BMM_kafka'].keys():
                 #     if k == 'hint':
@@ -342,6 +377,11 @@ def plot_from_kafka_messages(beamline_acronym):
         #             #plt.close('all')
         #             #bmm_plot.plot_xafs(bmm_catalog, uid)
     ## end of examine_message ##################################################################
+
+    def work_during_wait():
+        for message in arrivals.ready():
+            examine_message(None, None, ('bmm', message), held=True)
+        between_messages()
     
     kafka_config = nslsii.kafka_utils._read_bluesky_kafka_config_file(config_file_path="/etc/bluesky/kafka.yml")
 
@@ -358,7 +398,7 @@ def plot_from_kafka_messages(beamline_acronym):
     )
 
     try:
-        kafka_consumer.start_polling(work_during_wait=lambda : plt.pause(.1))
+        kafka_consumer.start_polling(work_during_wait=work_during_wait)
     except KeyboardInterrupt:
         print('\n\nExiting Kafka consumer (plotting tool)')
         return()
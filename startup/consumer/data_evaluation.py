@@ -0,0 +1,101 @@
+import os, json, datetime, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from joblib import load
+
+from BMM.ml_core import GOOD_EMOJI, BAD_EMOJI, classify, evaluation_key
+
+EVALUATION_LIFETIME = 86400     # evaluations stay in redis for a day
+
+
+class DataEvaluator():
+    '''Evaluate XAFS scans with BMM's data evaluation model in a pool of
+    worker threads, so that neither bsui nor the kafka consumer waits
+    on the classifier.  The model is loaded once, by the first
+    evaluation, and runs are read through the consumer's catalog.
+
+    An evaluation is submitted when the plot manager sees the stop
+    document of an XAFS scan which asked for one (the 'evaluate' item
+    in the BMM_kafka metadata).  When it finishes, the score and emoji
+    are posted to redis (see BMM.ml_core.evaluation_key) and to Slack,
+    and failures are recorded in the failed_data_evaluation.txt log.
+
+    In bsui, clf.result(uid, timeout) waits for and returns the
+    evaluation.  The dossier shows it in the list of scans.
+
+    attributes
+    ==========
+    folder: (str)
+      location of the joblib files for the model
+
+    catalog:
+      Tiled catalog (or BMM.run_cache.RunCache) holding the scans
+
+    rkvs:
+      redis client
+
+    post:
+      function which posts text to Slack
+
+    workspace: (str)
+      location of the logs folder
+
+    logger:
+      python logger
+
+    '''
+    def __init__(self, folder, catalog, rkvs=None, post=None, workspace=None, workers=2):
+        self.folder    = folder
+        self.catalog   = catalog
+        self.rkvs      = rkvs
+        self.post      = post
+        self.workspace = workspace
+        self.logger    = None
+        self.pending   = dict()
+        self.model     = None
+        self.scaler    = None
+        self.lock      = threading.Lock()
+        self.pool      = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='data evaluation')
+
+    def load(self):
+        '''Load the model and scaler, if that has not yet been done.'''
+        with self.lock:
+            if self.model is None:
+                self.scaler = load(os.path.join(self.folder, 'scaler.joblib'))
+                self.model  = load(os.path.join(self.folder, 'data_evaluation.joblib'))
+
+    def evaluate(self, uid, mode):
+        self.load()
+        return classify(self.model, self.scaler, self.catalog[uid], mode=mode)
+
+    def submit(self, uid, mode):
+        '''Queue a scan for evaluation and return immediately.'''
+        future = self.pool.submit(self.evaluate, uid, mode)
+        self.pending[uid] = future
+        future.add_done_callback(lambda f: self.done(uid, mode, f))
+        return future
+
+    def done(self, uid, mode, future):
+        self.pending.pop(uid, None)
+        try:
+            score = future.result()
+        except Exception as E:
+            if self.logger is not None:
+                self.logger.error(f'data evaluation of {uid} failed: {E}')
+            return
+        if score is None:
+            return
+        emoji = GOOD_EMOJI if score == 1 else BAD_EMOJI
+        if self.rkvs is not None:
+            key = evaluation_key(uid)
+            self.rkvs.set(key, json.dumps({'score': score, 'emoji': emoji, 'mode': mode}), ex=EVALUATION_LIFETIME)
+            self.rkvs.rpush(key+':done', 1)
+            self.rkvs.expire(key+':done', EVALUATION_LIFETIME)
+        if self.post is not None:
+            self.post(f'ML data evaluation model: {emoji}')
+        if score == 0:
+            if self.post is not None:
+                self.post(f'An {emoji} may not mean that there is anything wrong with your data. See https://tinyurl.com/2xp2bhbx')
+            if self.workspace is not None:
+                with open(os.path.join(self.workspace, 'logs', 'failed_data_evaluation.txt'), 'a') as f:
+                    f.write(f'{datetime.datetime.now().isoformat(timespec="seconds")}\n\tmode = {mode}\n\t{uid}\n\n')
@@ -1,7 +1,7 @@
-import os, sys, re, socket, json, datetime, pathlib, uuid
+import os, sys, re, socket, json, datetime, pathlib, uuid, time, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import quote
-import numpy, pandas, openpyxl
-from scipy.io import savemat
+import numpy, pandas
 from bluesky import __version__ as bluesky_version
 import traceback
 
@@ -16,6 +16,9 @@ from pygments.formatters import HtmlFormatter
 from BMM.periodictable import edge_energy, Z_number, element_symbol, element_name
 from tools import echo_slack, experiment_folder, file_resource, profile_configuration
 from slack import img_to_slack, post_to_slack
+from BMM.ml_core import fetch_evaluation
+from xdi_writer import plot_hint, xdi_header, write_xdi, SDD_DETECTORS
+from BMM.map_export import write_xlsx, write_mat, write_hdf5, write_parquet
 
 
 import redis
@@ -466,6 +469,7 @@ class BMMDossier():
      title="This is the scan number for {filename}.{ext:03d}, click to show/hide its UID">
          #{scanid}
   </a>
+  {evaluation}
   <div id="{filename}.{ext:03d}" style="display:none;"><small>{uid}</small></div>
   <br>&nbsp;&nbsp;'''
         hdf5template = '''<a href="javascript:void(0)"
@@ -495,10 +499,18 @@ class BMMDossier():
             pilatusfile = self.pilatus_filename(bmm_catalog, u)
             if len(filename) > 11:
                 printedname = filename[0:6] + '&middot;&middot;&middot;' + filename[-5:]
+            evaluation = fetch_evaluation(rkvs, u)
+            if evaluation is None:
+                evaluation = ''
+            elif evaluation[0] == 1:
+                evaluation = '<span title="ML data evaluation: good">&#10004;</span>'
+            else:
+                evaluation = '<span title="ML data evaluation: may have a problem">&#10006;</span>'
             text += template.format(filename    = filename,
                                     printedname = printedname,
                                     ext         = ext,
                                     scanid      = bmm_catalog[u].metadata['start']['scan_id'],
+                                    evaluation  = evaluation,
                                     uid         = u,)
             if hdf5file is not None:
                 text += hdf5template.format(filename    = filename,
@@ -1071,25 +1083,77 @@ class BMMDossier():
 
         
 
+class EveryXASCheckpoint():
+    '''Remember which XDI files XASFile.everyxas has written, so that an
+    interrupted job resumes where it left off and a repeated job skips
+    scans which have not changed.
+
+    The record is kept in a hidden JSON file in each experiment folder,
+    mapping each scan's uid to a fingerprint of its stop document.  The
+    file is rewritten (atomically) at most every `interval` seconds and
+    when the job ends.
+
+    attributes
+    ==========
+    folders: (dict)
+      experiment folder : {uid : fingerprint}
+
+    dirty: (set)
+      folders with new entries not yet saved
+
+    '''
+    name = '.everyxas.json'
+
+    def __init__(self, interval=10):
+        self.folders  = dict()
+        self.dirty    = set()
+        self.interval = interval
+        self.last     = time.monotonic()
+        self.lock     = threading.Lock()
+
+    @staticmethod
+    def fingerprint(metadata):
+        stop = metadata['stop']
+        return f"{stop['uid']}:{stop['time']}:{stop['num_events'].get('primary', 0)}"
+
+    def entries(self, folder):
+        if folder not in self.folders:
+            try:
+                with open(os.path.join(folder, self.name), 'r') as fh:
+                    self.folders[folder] = json.load(fh)
+            except (OSError, ValueError):
+                self.folders[folder] = dict()
+        return self.folders[folder]
+
+    def current(self, folder, uid, fingerprint):
+        with self.lock:
+            return self.entries(folder).get(uid) == fingerprint
+
+    def record(self, folder, uid, fingerprint):
+        with self.lock:
+            self.entries(folder)[uid] = fingerprint
+            self.dirty.add(folder)
+            if time.monotonic() - self.last > self.interval:
+                self.save()
+
+    def save(self):
+        for folder in self.dirty:
+            target = os.path.join(folder, self.name)
+            with open(target + '.tmp', 'w') as fh:
+                json.dump(self.folders[folder], fh)
+            os.replace(target + '.tmp', target)
+        self.dirty = set()
+        self.last = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self.save()
+
+
 class XASFile():
 
     def plot_hint(self, catalog=None, uid=None):
-        text = 'ln(I0/It)  --  ln($5/$6)'
-        el = catalog[uid].metadata['start']['XDI']['Element']['symbol']
-        
-        if '1-element SDD' in catalog[uid].metadata['start']['detectors']:
-            text = f'{el}8/I0  --  $8/$5'
-        elif '4-element SDD' in catalog[uid].metadata['start']['detectors']:
-            text = f'({el}1+{el}2+{el}3+{el}4)/I0  --  ($8+$9+$10+$11)/$5'
-        elif '7-element SDD' in catalog[uid].metadata['start']['detectors']:
-            text = f'({el}1+{el}2+{el}3+{el}4+{el}5+{el}6+{el}7)/I0  --  ($8+$9+$10+$11+$12+$13+$14)/$5'
-        elif 'reference' in catalog[uid].metadata['start']['plan_name']:
-            text = 'ln(It/Ir)  --  ln($6/$7)'
-        elif 'yield' in catalog[uid].metadata['start']['plan_name']:
-            text = 'ln(It/Ir)  --  ln($8/$5)'
-        elif 'test' in catalog[uid].metadata['start']['plan_name']:
-            text = 'I0  --  $5'
-        return text
+        return plot_hint(catalog[uid].metadata['start'])
 
     # def file_resource(self, catalog, uid):
     #     docs = catalog[uid].documents()
@@ -1101,137 +1165,67 @@ class XASFile():
     #                 this = this % 0
     #             found.append(this)
     #     return found
-    
+
+    def prepare(self, catalog, uid, include_yield=False):
+        '''Gather what is needed to write the XDI file of an XAS scan:
+        the header, the primary stream columns and their labels, and the
+        table of data.'''
+        metadata = catalog[uid].metadata
+        hdf5files = []
+        if any(x in metadata['start']['detectors'] for x in SDD_DETECTORS):
+            hdf5files = file_resource(catalog, uid)
+        header, column_list, column_labels = xdi_header(metadata['start'], metadata['stop'], uid,
+                                                        hdf5files=hdf5files, include_yield=include_yield)
+        table = catalog[uid].primary.read(column_list).to_pandas()
+        return header, table, column_list, column_labels
+
     def to_xdi(self, catalog=None, uid=None, filename=None, logger=None, include_yield=False):
         '''Write an XDI-style file for an XAS scan.
 
         '''
-        metadata = catalog[uid].metadata
-        xdi = metadata["start"]["XDI"]
+        start = catalog[uid].metadata["start"]
         if filename is None:
-            filename = xdi['_filename']
+            filename = start["XDI"]['_filename']
         fname = os.path.join(experiment_folder(catalog, uid), filename)
-        handle = open(fname, 'w')
-        handle.write(f'# XDI/1.0 BlueSky/{bluesky_version} BMM/{pathlib.Path(sys.executable).parts[-3]}\n')
-
-        ## header lines with metadata from the XDi dictionary
-        for family in ('Beamline', 'Detector', 'Element', 'Facility', 'Mono', 'Sample', 'Scan'):
-            for k in xdi[family].keys():
-                if family == 'Sample' and k == 'comment':
-                    continue
-                if family == 'Sample' and k == 'extra_metadata':
-                    continue
-                handle.write(f'# {family}.{k}: {xdi[family][k]}\n')
-        start = datetime.datetime.fromtimestamp(metadata['start']['time']).strftime("%Y-%m-%dT%H:%M:%S") # '%A, %d %B, %Y %I:%M %p')
-        end   = datetime.datetime.fromtimestamp(metadata['stop']['time']).strftime("%Y-%m-%dT%H:%M:%S") # '%A, %d %B, %Y %I:%M %p')
-        handle.write(f'# Scan.start_time: {start}\n')
-        handle.write(f'# Scan.end_time: {end}\n')
-        handle.write(f'# Scan.uid: {uid}\n')
-        handle.write(f'# Scan.transient_id: {metadata["start"]["scan_id"]}\n')
-        
-        if any(x in metadata['start']['detectors'] for x in ('1-element SDD', '4-element SDD', '7-element SDD')):
-            hdf5files = file_resource(catalog, uid)
-            for h in hdf5files:
-                relative = '/'.join(h.split('/')[-6:])
-                if 'xspress3' in relative:
-                    handle.write(f'# Scan.xspress3_hdf5_file: {relative}\n')
-                elif 'pilatus' in relative:
-                    handle.write(f'# Scan.pilatus100k_hdf5_file: {relative}\n')
-        ## is this correct?  need to test....
-            
-        handle.write(f'# Scan.plot_hint: {self.plot_hint(catalog=catalog, uid=uid)}\n')
-        handle.write( '# Column.1: energy eV\n')
-        handle.write( '# Column.2: requested_energy eV\n')
-        handle.write( '# Column.3: measurement_time seconds\n')
-        handle.write( '# Column.4: xmu\n')
-        handle.write( '# Column.5: I0 nA\n')
-        handle.write( '# Column.6: Itrans nA\n')
-        handle.write( '# Column.7: Irefer nA\n')
-
-        ## Column.N header lines
-        column_list = ['dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', 'I0', 'It', 'Ir']
-        column_labels = ['energy', 'requested_energy', 'measurement_time', 'xmu', 'I0', 'It', 'Ir']
-        if 'yield' in metadata['start']['plan_name'] or include_yield is True:
-            handle.write( '# Column.8: Iy nA\n')
-            column_list.append('Iy')
-            column_labels.append('Iy')
-
-        
-        el = metadata['start']['XDI']['Element']['symbol']
-        nchan = 0
-        if '1-element SDD' in metadata['start']['detectors']:
-            nchan = 1
-            column_list.append(f'{el}8')
-            column_labels.append(f'{el}8')
-            handle.write(f'# Column.8: {el}8\n')
-        elif '4-element SDD' in metadata['start']['detectors']:
-            column_list.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4'])
-            column_labels.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4'])
-            nchan = 4
-            if 'pilatus100k-1' in metadata['start']['detectors']:
-                column_list.extend(['diffuse', 'specular'])
-                column_labels.extend(['diffuse', 'specular'])
-                
-        elif '7-element SDD' in metadata['start']['detectors']:
-            column_list.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4', f'{el}5', f'{el}6', f'{el}7'])
-            column_labels.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4', f'{el}5', f'{el}6', f'{el}7'])
-            nchan = 7
-            if 'pilatus100k-1' in metadata['start']['detectors']:
-                column_list.extend(['diffuse', 'specular'])
-                column_labels.extend(['diffuse', 'specular'])
-                
-        if nchan > 0:
-            if 'yield' in metadata['start']['plan_name'] or include_yield is True:
-                for i in range(1, nchan+1):
-                    handle.write(f'# Column.{i+8}: {el}{i}\n')
-            else:
-                for i in range(1, nchan+1):
-                    handle.write(f'# Column.{i+7}: {el}{i}\n')
-        if 'pilatus100k-1' in metadata['start']['detectors']:
-            handle.write(f'# Column.{8+nchan}: diffuse\n')
-            handle.write(f'# Column.{9+nchan}: specular\n')
-
-                    
-        ## prepare data table and insert xmu column
-        xa = catalog[uid].primary.read(column_list)
-        p = xa.to_pandas()
-        column_list.insert(3, 'xmu')
-        if '1-element SDD' in metadata['start']['detectors']:
-            p['xmu'] = p[f'{el}8']/p['I0']
-        elif '4-element SDD' in metadata['start']['detectors']:
-            p['xmu'] = (p[f'{el}1']+p[f'{el}2']+p[f'{el}3']+p[f'{el}4'])/p['I0']
-        elif '7-element SDD' in metadata['start']['detectors']:
-            p['xmu'] = (p[f'{el}1']+p[f'{el}2']+p[f'{el}3']+p[f'{el}4']+p[f'{el}5']+p[f'{el}6']+p[f'{el}7'])/p['I0']
-        elif 'transmission' in metadata['start']['plan_name']:
-            p['xmu'] = numpy.log(p['It']/p['I0'])
-        elif 'reference' in metadata['start']['plan_name']:
-            p['xmu'] = numpy.log(p['Ir']/p['It'])
-        elif 'yield' in metadata['start']['plan_name']:
-            p['xmu'] = p['Iy']/p['It']
-        elif 'test' in metadata['start']['plan_name']:
-            p['xmu'] = p['I0']
-        else:
-            p['xmu'] = numpy.log(p['It']/p['I0'])
-
-        ## use energy as the pandas index
-        p.set_index('dcm_energy')
-        
-        ## comment and separator lines
-        handle.write('# //////////////////////////////////////////////////////////\n')
-        for l in xdi["_comment"]:
-            handle.write(f'# {l}\n')
-        handle.write('# ----------------------------------------------------------\n')
-        handle.write('# ')
-
-        ## dump the data table and close the file
-        handle.write(p.to_csv(None, sep=' ', columns=column_list, index=False, header=column_labels, float_format='%.6f'))
-        handle.flush()
-        handle.close()
-
+        header, table, column_list, column_labels = self.prepare(catalog, uid, include_yield=include_yield)
+        write_xdi(fname, header, table, column_list, column_labels,
+                  start['detectors'], start['plan_name'], start['XDI']['Element']['symbol'])
         log_entry(logger, f'wrote XAS data to {fname}')
 
-
-    def everyxas(self, catalog=None, gup=None, since=None, until=None, groupby='webcam', logger=None):
+    def export(self, catalog, uid, checkpoint, force=False, groupby=None):
+        '''Write the XDI file of one scan for everyxas, unless the scan is
+        incomplete or its file is up to date.  Return (outcome, grouping
+        uid).'''
+        metadata = catalog[uid].metadata
+        start, stop = metadata['start'], metadata['stop']
+        if stop is None or stop['num_events'].get('primary') != start['num_points']:
+            return 'incomplete', None
+        group = None
+        if groupby is not None:
+            group = start['XDI'].get('_snapshots', {}).get(groupby)
+        folder = experiment_folder(catalog, uid)
+        fname  = os.path.join(folder, start['XDI']['_filename'])
+        fingerprint = checkpoint.fingerprint(metadata)
+        if force is False and os.path.isfile(fname) and checkpoint.current(folder, uid, fingerprint):
+            return 'skipped', group
+        header, table, column_list, column_labels = self.prepare(catalog, uid)
+        write_xdi(fname, header, table, column_list, column_labels,
+                  list(start['detectors']), start['plan_name'], start['XDI']['Element']['symbol'])
+        checkpoint.record(folder, uid, fingerprint)
+        return 'written', group
+
+    def everyxas(self, catalog=None, gup=None, since=None, until=None, groupby='webcam', logger=None,
+                 fetchers=8, force=False, report=30):
+        '''Write the XDI file of every complete XAS scan of an experiment.
+
+        Runs are fetched from Tiled and their files written by a pool of
+        `fetchers` threads.  Most of the time is spent waiting on Tiled,
+        so threads are enough for writing the text files.  Scans
+        whose files were written by an earlier run of everyxas and whose
+        stop documents have not changed are skipped, unless force is
+        True, so an interrupted job picks up where it left off.
+        Progress is logged every `report` seconds.
+        '''
         if gup is None or since is None or until is None:
             print('insufficient information for generating XAS files')
             return
@@ -1240,7 +1234,7 @@ class XASFile():
         timequery = TimeRange(since=since, until=until, timezone="US/Eastern")
         timespan  = catalog.search(timequery)                         # all scans within the time window -->
         allscans  = timespan.search(Eq('proposal.proposal_id', gup))  # all scans within time window AND from GUP experimemt -->
-        allxas    = allscans.search(Regex('plan_name', 'scan_nd'))    # only the XAS scans
+        allxas    = allscans.search(Regex('plan_name', 'scan_nd|fly xafs'))    # only the XAS scans
 
         ## figure out how to recognize the scans in a sequence
         if groupby is not None:
@@ -1252,21 +1246,40 @@ class XASFile():
                 groupby = 'usbcam2_uid'
             else:
                 groupby = groupby + '_uid'
-            
-        ## weed out the incomplete scans
-        result = []
-        groups = {}
-        for x in allxas:
-            #print(x, allxas[x].metadata['stop']['num_events']['primary'], allxas[x].metadata['start']['num_points'])
-            if allxas[x].metadata['stop']['num_events']['primary'] == allxas[x].metadata['start']['num_points']:
-                ## if complete, generate the data file
-                self.to_xdi(catalog=catalog, uid=x, logger=logger)
+
+        uids       = list(allxas)
+        checkpoint = EveryXASCheckpoint()
+        counts     = {'written': 0, 'skipped': 0, 'incomplete': 0, 'failed': 0}
+        groups     = {}
+        began = last = time.monotonic()
+        if logger is not None:
+            logger.info(f'everyxas: {len(uids)} XAS scans for {gup} between {since} and {until}')
+
+        ## weed out the incomplete scans and generate the data files
+        with ThreadPoolExecutor(max_workers=fetchers) as fetch:
+            futures = {fetch.submit(self.export, catalog, x, checkpoint, force, groupby): x for x in uids}
+            for future in as_completed(futures):
+                x = futures[future]
+                try:
+                    outcome, grouping_uid = future.result()
+                except Exception as E:
+                    outcome, grouping_uid = 'failed', None
+                    if logger is not None:
+                        logger.error(f'everyxas: could not write XDI file for {x}: {E}')
+                counts[outcome] += 1
                 ## gather together scans from sequences for the purpose of generating dossier files
-                grouping_uid = allxas[x].metadata['start']['XDI']['_snapshots'][groupby]
-                if grouping_uid in groups:
-                    groups[grouping_uid].append(x)
-                else:
-                    groups[grouping_uid] = [x,]
+                if grouping_uid is not None:
+                    groups.setdefault(grouping_uid, []).append(x)
+                if logger is not None and time.monotonic() - last > report:
+                    last = time.monotonic()
+                    done = sum(counts.values())
+                    rate = done / (last - began)
+                    logger.info(f'everyxas: {done} of {len(uids)} scans ({counts["written"]} written, {counts["skipped"]} up to date, ' +
+                                f'{counts["failed"]} failed), about {(len(uids)-done)/max(rate, 1e-6)/60:.0f} minutes to go')
+        checkpoint.flush()
+        if logger is not None:
+            log_entry(logger, f'everyxas: wrote {counts["written"]} XDI files for {gup} in {(time.monotonic()-began)/60:.1f} minutes, ' +
+                      f'{counts["skipped"]} were up to date, {counts["incomplete"]} scans were incomplete, {counts["failed"]} failed')
 
         ## generate dossier files
         if groupby is not None:
@@ -1437,8 +1450,10 @@ class RasterFiles():
 
     def preserve_data(self, catalog, uid, logger):
         '''Save the data from an areascan as a .xlsx file (a simple spreadsheet
-        which can be ingested by many plotting programs) and as a .mat
-        file (which can be ingested by Matlab).
+        which can be ingested by many plotting programs), as a .mat
+        file (which can be ingested by Matlab), as a NeXus-style .h5
+        file holding each column as a 2-D map, and as a .parquet table.
+        See BMM.map_export.
 
         to do:
         1. save all Xspress3 columns
@@ -1446,48 +1461,55 @@ class RasterFiles():
         '''
 
         record  = catalog[uid]
-        xlsxout = os.path.join(experiment_folder(catalog, uid), record.metadata['start']['XDI']['_snapshots']['xlsxout'])
-        matout  = os.path.join(experiment_folder(catalog, uid), record.metadata['start']['XDI']['_snapshots']['matout'])
-
-        
-        motors = record.metadata['start']['motors']
-        #print('Reading data set...')
-        datatable = record.primary.read()
-
-        slow = numpy.array(datatable[motors[0]])
-        fast = numpy.array(datatable[motors[1]])
-        i0   = numpy.array(datatable['I0'])
-        it   = numpy.array(datatable['It'])
-        ir   = numpy.array(datatable['Ir'])
-
-        if '4-element SDD' in catalog[uid].metadata['start']['detectors'] or 'if' in catalog[uid].metadata['start']['detectors'] or 'xs' in catalog[uid].metadata['start']['detectors']:
-            det_name = catalog[uid].metadata['start']['plan_name'].split()[-1]
+        start   = record.metadata['start']
+        folder  = experiment_folder(catalog, uid)
+        xlsxout = os.path.join(folder, start['XDI']['_snapshots']['xlsxout'])
+        matout  = os.path.join(folder, start['XDI']['_snapshots']['matout'])
+        label   = start['XDI']['Sample']['name']
+        motors  = start['motors']
+
+        if '4-element SDD' in start['detectors'] or 'if' in start['detectors'] or 'xs' in start['detectors']:
+            det_name = start['plan_name'].split()[-1]
             det_name = det_name[:-1]
-            z = numpy.array(datatable[det_name+'1'])+numpy.array(datatable[det_name+'2'])+numpy.array(datatable[det_name+'3'])+numpy.array(datatable[det_name+'4'])
-        elif 'noisy_det' in catalog[uid].metadata['start']['detectors']:
+            signals  = [det_name+'1', det_name+'2', det_name+'3', det_name+'4']
+        elif 'noisy_det' in start['detectors']:
             det_name = 'noisy_det'
-            z = numpy.array(datatable['noisy_det'])
+            signals  = ['noisy_det']
         else:
-            det_name = catalog[uid].metadata['start']['plan_name'].split()[-1]
-            z = numpy.zeros(len(slow))
-            
-        ## save map in xlsx format
-        wb = openpyxl.Workbook()
-        ws1 = wb.active
-        ws1.title = record.metadata['start']['XDI']['Sample']['name']
-        ws1.append((motors[0], motors[1], f'{det_name}/I0', det_name, 'I0', 'It', 'Ir'))
-        for i in range(len(slow)):
-            ws1.append((slow[i], fast[i], z[i]/i0[i], z[i], i0[i], it[i], ir[i]))
-        wb.save(xlsxout)
-        log_entry(logger, f'wrote {xlsxout}')
+            det_name = start['plan_name'].split()[-1]
+            signals  = []
+
+        ## read only the columns needed, not the MCA spectra
+        #print('Reading data set...')
+        datatable = record.primary.read([motors[0], motors[1], 'I0', 'It', 'Ir', *signals])
+
+        slow = numpy.asarray(datatable[motors[0]], dtype=float)
+        fast = numpy.asarray(datatable[motors[1]], dtype=float)
+        i0   = numpy.asarray(datatable['I0'], dtype=float)
+        it   = numpy.asarray(datatable['It'], dtype=float)
+        ir   = numpy.asarray(datatable['Ir'], dtype=float)
+        z    = numpy.zeros(len(slow))
+        for s in signals:
+            z = z + numpy.asarray(datatable[s], dtype=float)
+
+        ## save map in xlsx format, unless it is too big for a spreadsheet to be sensible
+        if write_xlsx(xlsxout, {motors[0]: slow, motors[1]: fast, f'{det_name}/I0': z/i0, det_name: z, 'I0': i0, 'It': it, 'Ir': ir},
+                      title=label) is not None:
+            log_entry(logger, f'wrote {xlsxout}')
+        else:
+            logger.info(f'{len(slow)} pixels is too many for a spreadsheet, {xlsxout} not written')
 
         ## save map in matlab format 
-        savemat(matout, {'label'   : record.metadata['start']['XDI']['Sample']['name'],
-                         motors[0] : list(slow),
-                         motors[1] : list(fast),
-                         'I0'      : list(i0),
-                         'It'      : list(it),
-                         'Ir'      : list(ir),
-                         'signal'  : list(z),})
+        columns = {motors[0] : slow, motors[1] : fast, 'I0' : i0, 'It' : it, 'Ir' : ir, 'signal' : z}
+        write_mat(matout, columns, label=label)
         log_entry(logger, f'wrote {matout}')
 
+        ## save map as a 2-D NeXus/HDF5 file and as a Parquet table
+        stem = os.path.splitext(matout)[0]
+        columns['normalized'] = z/i0
+        h5out = write_hdf5(stem+'.h5', columns, start['shape'], signal='normalized', axes=motors, label=label,
+                           attrs={'uid': uid, 'detector': det_name})
+        log_entry(logger, f'wrote {h5out}')
+        if write_parquet(stem+'.parquet', columns) is not None:
+            logger.info(f'wrote {stem}.parquet')
+
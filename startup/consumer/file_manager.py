@@ -7,18 +7,20 @@ import os
 import re
 import time
 import shutil
+from collections import deque
 sys.path.append('/home/xf06bm/.ipython/profile_collection/startup')
 
 from bluesky_kafka.consume import BasicConsumer
 import nslsii
 import nslsii.kafka_utils
 
-from tools import echo_slack, next_index, file_exists, profile_configuration
+from tools import echo_slack, next_index, file_exists, profile_configuration, start_folder, wait_for_run
 from slack import img_to_slack, post_to_slack, refresh_slack, describe_slack
 
 
 from tiled.client import from_profile
-bmm_catalog = from_profile('bmm')
+from BMM.run_cache import RunCache
+bmm_catalog = RunCache(from_profile('bmm'))   # each run is fetched from Tiled only once
 
 
 import redis
@@ -44,7 +46,8 @@ from pygments import highlight
 from pygments.lexers import PythonLexer, HtmlLexer
 from pygments.formatters import Terminal256Formatter
 
-from dossier_kafka import BMMDossier, startup_dir, XASFile, SEADFile, LSFile, RasterFiles
+from dossier_kafka import BMMDossier, startup_dir, XASFile, SEADFile, LSFile, RasterFiles, log_entry
+from xdi_writer import StreamingXDI
 from gonio import XRRFile
 
 dossier = BMMDossier()
@@ -70,6 +73,33 @@ add_handler(sh, logger)
 
 be_verbose = True
 
+## run the work asked of the file manager in worker threads, so that a
+## long job does not hold up next_index or file_exists
+from task_scheduler import TaskScheduler, FAST
+scheduler = TaskScheduler(logger=logger)
+XDI_WRITERS = ('xdi', 'sead', 'ls', 'xrr')   # keys of tasks which write numbered data files
+
+## bsui posts documents to Tiled from a worker thread, so a run named in
+## a message may not yet be in Tiled.  Tasks which read a run wait for
+## it, in the task's thread, never in the kafka poll loop.
+stopped = deque(maxlen=200)     # runs whose stop documents have been seen, not yet waited for by the dossier
+
+def in_tiled(uid, task):
+    '''Return a task which runs task once the run uid is in Tiled.'''
+    def run():
+        if wait_for_run(bmm_catalog, uid):
+            task()
+    return run
+
+def wait_for_stopped():
+    '''Wait for every run whose stop document has been seen to be in
+    Tiled, as the dossier reads all the runs of a sequence.'''
+    while len(stopped) > 0:
+        wait_for_run(bmm_catalog, stopped.popleft())
+
+## write XDI files from the documents of XAS scans as they are measured
+streamer = StreamingXDI(start_folder, logger=logger)
+
 
 def pobj(text, style='monokai'):
     '''Pretty print a dictionary representation of an object to the
@@ -97,17 +127,123 @@ def usb_filename(self, bmm_catalog, uid):
 
 
 
+def device_resource(record, device):
+    '''Find the path/name of the file written by a device in a run in
+    which several devices wrote files, e.g. the single snapshot run
+    made by DossierTools.cameras.  Follow the datum ID in the event
+    back through its datum to its resource.
+    '''
+    resources, datums, datum_ids = {}, {}, []
+    for name, doc in record.documents():
+        if name == 'resource':
+            resources[doc['uid']] = doc
+        elif name == 'datum':
+            datums[doc['datum_id']] = (doc['resource'], doc['datum_kwargs'])
+        elif name == 'datum_page':
+            for i, d in enumerate(doc['datum_id']):
+                datums[d] = (doc['resource'], {k: v[i] for k, v in doc['datum_kwargs'].items()})
+        elif name == 'event':
+            datum_ids.extend(v for k,v in doc['data'].items() if k.startswith(device))
+        elif name == 'event_page':
+            for k,v in doc['data'].items():
+                if k.startswith(device):
+                    datum_ids.extend(v)
+    for d in datum_ids:
+        if d in datums and datums[d][0] in resources:
+            resource, kwargs = resources[datums[d][0]], datums[d][1]
+            this = os.path.join(resource['root'], resource['resource_path'])
+            if '_%d' in this or re.search(r'%\d\.\dd', this) is not None:
+                this = this % kwargs.get('index', 0)
+            return this
+    return None
+
+
+def dossier_task(message):
+    global dossier
+    if message['dossier'] == 'start':
+        dossier = BMMDossier()
+        logger.info(f'starting dossier for {message["stub"]}')
+
+    elif message['dossier'] == 'set':
+        dossier.set_parameters(**message)
+        # if len(message) > 2:
+        #     logger.info(f'set {len(message)-1} parameters')
+        # else:
+        #     logger.info('set 1 parameter')
+
+    elif message['dossier'] == 'show':
+        #logger.info(pprint.pformat(dossier.__dict__))
+        pobj(dossier)
+
+    elif message['dossier'] == 'motors':
+        try:
+            print(highlight(dossier.motor_sidebar(bmm_catalog),
+                            HtmlLexer(),
+                            Terminal256Formatter(style='monokai')))
+        except Exception as E:
+            logger.error(str(E))
+
+    elif message['dossier'] == 'write':
+        wait_for_stopped()
+        dossier.write_dossier(bmm_catalog, logger)
+
+    elif message['dossier'] == 'sead':
+        wait_for_stopped()
+        dossier.sead_dossier(bmm_catalog, logger)
+
+    elif message['dossier'] == 'raster':
+        wait_for_stopped()
+        dossier.raster_dossier(bmm_catalog, logger)
+
+
+def slack_task(message):
+    if 'img' not in message or message['img'] is None:
+        print(f'sending message "{message["text"]}" to slack')
+        # if 'icon'   not in message: message['icon'] = 'message'
+        if 'rid'    not in message: message['rid']  = None
+        post_to_slack(message['text'], rid = message['rid'])
+        # echo_slack(text   = message['text'],
+        #            icon   = message['icon'],
+        #            rid    = message['rid'] )
+
+    elif 'img' in message and os.path.exists(message['img']):
+        img_to_slack(message['img'])
+
+
+def copy_task(message):
+    if 'file' in message:
+        source = message['file']
+    elif 'uuid' in message:
+        if not wait_for_run(bmm_catalog, message['uuid']):
+            return
+        record = bmm_catalog[message['uuid']]
+        docs = record.documents()
+        found = []
+        for d in docs:
+            if d[0] == 'resource':
+                this = os.path.join(d[1]['root'], d[1]['resource_path'])
+                if '_%d' in this or re.search(r'%\d\.\dd', this) is not None:
+                    this = this % 0
+                found.append(this)
+        source = found[0]
+        if 'device' in message:  # several cameras captured in one run
+            source = device_resource(record, message['device']) or source
+    target = message['target']
+    shutil.copy(source, target)
+    logger.info(f'copied {source} to {target}')
+
+
 def manage_files_from_kafka_messages(beamline_acronym):
 
     def examine_message(consumer, doctype, doc):
-        global be_verbose, dossier, logger
+        global be_verbose, logger
         # print(
         #     f"\n[{datetime.datetime.now().isoformat(timespec='seconds')}] document topic: {doctype}\n"
         #     f"contents: {pprint.pformat(doc)}\n"
         # )
         name, message = doc
 
-        if be_verbose is True:
+        if be_verbose is True and name == 'bmm':
             print('\n\nVerbose mode is on:')
             pprint.pprint(message)
             print('\n')
@@ -121,37 +257,14 @@ def manage_files_from_kafka_messages(beamline_acronym):
                 #     print(f'\n[{datetime.datetime.now().isoformat(timespec="seconds")}]')
 
             if 'dossier' in message:
-                if message['dossier'] == 'start':
-                    dossier = BMMDossier()
-                    logger.info(f'starting dossier for {message["stub"]}')
-
-                elif message['dossier'] == 'set':
-                    dossier.set_parameters(**message)
-                    # if len(message) > 2:
-                    #     logger.info(f'set {len(message)-1} parameters')
-                    # else:
-                    #     logger.info('set 1 parameter')
-
-                elif message['dossier'] == 'show':
-                    #logger.info(pprint.pformat(dossier.__dict__))
-                    pobj(dossier)
-
-                elif message['dossier'] == 'motors':
-                    try:
-                        print(highlight(dossier.motor_sidebar(bmm_catalog),
-                                        HtmlLexer(),
-                                        Terminal256Formatter(style='monokai')))
-                    except Exception as E:
-                        logger.error(str(E))
-
-                elif message['dossier'] == 'write':
-                    dossier.write_dossier(bmm_catalog, logger)
-
-                elif message['dossier'] == 'sead':
-                    dossier.sead_dossier(bmm_catalog, logger)
+                ## every dossier message runs in order on the dossier key, after
+                ## the data files already asked for, which the dossier reads
+                scheduler.submit(f'dossier {message["dossier"]}', lambda: dossier_task(message), key='dossier',
+                                 after=scheduler.pending(*XDI_WRITERS))
 
-                elif message['dossier'] == 'raster':
-                    dossier.raster_dossier(bmm_catalog, logger)
+            elif 'file_manager' in message:
+                if message['file_manager'] == 'report':
+                    logger.info(scheduler.report())
 
 
             elif 'logger' in message:
@@ -169,23 +282,13 @@ def manage_files_from_kafka_messages(beamline_acronym):
 
 
             elif 'echoslack' in message:
-                if 'img' not in message or message['img'] is None:
-                    print(f'sending message "{message["text"]}" to slack')
-                    # if 'icon'   not in message: message['icon'] = 'message'
-                    if 'rid'    not in message: message['rid']  = None
-                    post_to_slack(message['text'], rid = message['rid'])
-                    # echo_slack(text   = message['text'],
-                    #            icon   = message['icon'],
-                    #            rid    = message['rid'] )
-
-                elif 'img' in message and os.path.exists(message['img']):
-                    img_to_slack(message['img'])
+                scheduler.submit('echoslack', lambda: slack_task(message), lane=FAST, key='slack')
 
             elif 'refresh_slack' in message:
-                refresh_slack()
+                scheduler.submit('refresh_slack', refresh_slack, lane=FAST, key='slack')
 
             elif 'describe_slack' in message:
-                describe_slack()
+                scheduler.submit('describe_slack', describe_slack, lane=FAST, key='slack')
 
             elif 'mkdir' in message:
                 if os.path.exists(message['mkdir']) is False:
@@ -193,23 +296,7 @@ def manage_files_from_kafka_messages(beamline_acronym):
                     logger.info(f'made directory {message["mkdir"]}')
 
             elif 'copy' in message:
-                if 'file' in message:
-                    source = message['file']
-                elif 'uuid' in message:
-                    record = bmm_catalog[message['uuid']]
-                    docs = record.documents()
-                    found = []
-                    for d in docs:
-                        if d[0] == 'resource':
-                            this = os.path.join(d[1]['root'], d[1]['resource_path'])
-                            if '_%d' in this or re.search(r'%\d\.\dd', this) is not None:
-                                this = this % 0
-                            found.append(this)
-                    source = found[0]
-                    uuid = True
-                target = message['target']
-                shutil.copy(source, target)
-                logger.info(f'copied {source} to {target}')
+                scheduler.submit('copy', lambda: copy_task(message), key='copy')
 
 
             elif 'touch' in message:
@@ -223,37 +310,67 @@ def manage_files_from_kafka_messages(beamline_acronym):
                     include_yield = True
                 else:
                     include_yield = False
-                xdi.to_xdi(catalog=bmm_catalog, uid=message['uid'], logger=logger, include_yield=include_yield) # , filename=message['filename']
+                def xasxdi():
+                    ## at the end of a scan, the file may already have been written from the documents
+                    if message.get('streamed') is True and include_yield is False:
+                        fname = streamer.wait(message['uid'])
+                        if fname is not None:
+                            log_entry(logger, f'wrote XAS data to {fname}')
+                            return
+                    if wait_for_run(bmm_catalog, message['uid']):
+                        xdi.to_xdi(catalog=bmm_catalog, uid=message['uid'], logger=logger, include_yield=include_yield) # , filename=message['filename']
+                scheduler.submit('xasxdi', xasxdi, key='xdi')
 
             elif 'everyxas' in message:
-                xdi.everyxas(catalog=bmm_catalog, gup=message['gup'], since=message['since'], until=message['until'], logger=logger)
+                scheduler.submit('everyxas', lambda: xdi.everyxas(catalog=bmm_catalog, gup=message['gup'], since=message['since'],
+                                                                  until=message['until'], force=message.get('force', False), logger=logger),
+                                 key='everyxas')
 
             elif 'seadxdi' in message:
-                sead.to_xdi(catalog=bmm_catalog, uid=message['uid'], filename=message['filename'], logger=logger)
+                scheduler.submit('seadxdi', in_tiled(message['uid'], lambda: sead.to_xdi(catalog=bmm_catalog, uid=message['uid'], filename=message['filename'], logger=logger)),
+                                 key='sead')
 
             elif 'lsxdi' in message:
-                ls.to_xdi(catalog=bmm_catalog, uid=message['uid'], filename=message['filename'], logger=logger)
+                scheduler.submit('lsxdi', in_tiled(message['uid'], lambda: ls.to_xdi(catalog=bmm_catalog, uid=message['uid'], filename=message['filename'], logger=logger)),
+                                 key='ls')
 
             elif 'raster' in message:
-                raster.preserve_data(catalog=bmm_catalog, uid=message['uid'], logger=logger)
+                scheduler.submit('raster', in_tiled(message['uid'], lambda: raster.preserve_data(catalog=bmm_catalog, uid=message['uid'], logger=logger)),
+                                 key='raster')
 
+            ## next_index and file_exists jump ahead of the bulk work,
+            ## but wait for data files already being written
             elif 'next_index' in message:
-                next_index(message['folder'], message['stub'])
+                scheduler.submit('next_index', lambda: next_index(message['folder'], message['stub'], reply_to=message.get('reply_to')),
+                                 lane=FAST, after=scheduler.pending(*XDI_WRITERS))
 
             elif 'file_exists' in message:
                 #pprint.pprint(message)
-                file_exists(message['folder'], message['filename'], message['start'], message['stop'], message['number'])
+                scheduler.submit('file_exists',
+                                 lambda: file_exists(message['folder'], message['filename'], message['start'], message['stop'], message['number'],
+                                                     reply_to=message.get('reply_to')),
+                                 lane=FAST, after=scheduler.pending(*XDI_WRITERS))
 
 
             elif 'xrrout' in message:
-                xrr.to_xdi(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], logger=logger)
-                xrr.to_txt(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], style='both', logger=logger)
+                def xrrout():
+                    xrr.to_xdi(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], logger=logger)
+                    xrr.to_txt(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], style='both', logger=logger)
+                scheduler.submit('xrrout', in_tiled(message['uid'], xrrout), key='xrr')
 
             elif 'xrrxdi' in message:
-                xrr.to_xdi(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], logger=logger)
+                scheduler.submit('xrrxdi', in_tiled(message['uid'], lambda: xrr.to_xdi(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], logger=logger)),
+                                 key='xrr')
 
             elif 'xrrtxt' in message:
-                xrr.to_txt(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], style=message['style'], logger=logger)
+                scheduler.submit('xrrtxt', in_tiled(message['uid'], lambda: xrr.to_txt(catalog=bmm_catalog, uid=message['uid'], stub=message['stub'], style=message['style'], logger=logger)),
+                                 key='xrr')
+
+        ## documents from the run engine feed the streaming XDI writer
+        elif name in ('start', 'descriptor', 'resource', 'event', 'stop'):
+            streamer.document(name, message)
+            if name == 'stop':
+                stopped.append(message['run_start'])
                 
     kafka_config = nslsii.kafka_utils._read_bluesky_kafka_config_file(config_file_path="/etc/bluesky/kafka.yml")
 
@@ -261,8 +378,7 @@ def manage_files_from_kafka_messages(beamline_acronym):
     #   so generate a unique consumer group id for it
     unique_group_id = f"echo-{beamline_acronym}-{str(uuid.uuid4())[:8]}"
     kafka_consumer = BasicConsumer(
-        #topics            = [f"{beamline_acronym}.bluesky.runengine.documents", f"{beamline_acronym}.test"],
-        topics            = [f"{beamline_acronym}.test"],
+        topics            = [f"{beamline_acronym}.bluesky.runengine.documents", f"{beamline_acronym}.test"],
         bootstrap_servers = kafka_config["bootstrap_servers"],
         group_id          = unique_group_id,
         consumer_config   = kafka_config["runengine_producer_config"],
@@ -273,7 +389,10 @@ def manage_files_from_kafka_messages(beamline_acronym):
         kafka_consumer.start_polling(work_during_wait=lambda : time.sleep(0.1))
     except KeyboardInterrupt:
         print('\n\nExiting Kafka consumer (file manager)')
+        logger.info(scheduler.report())
         return()
 
-print('Ready to receive documents...')
-manage_files_from_kafka_messages('bmm')
+## XASFile.everyxas writes files in spawned worker processes, which import this module
+if __name__ == '__main__':
+    print('Ready to receive documents...')
+    manage_files_from_kafka_messages('bmm')
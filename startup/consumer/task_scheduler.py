@@ -0,0 +1,202 @@
+import threading, time, traceback
+from collections import deque
+
+## lanes in order of priority
+FAST = 'fast'
+BULK = 'bulk'
+LANES = (FAST, BULK)
+
+
+class Task():
+    '''One piece of work handed to the TaskScheduler.
+
+    attributes
+    ==========
+    name: (str)
+      the kind of work, e.g. "xasxdi", used to gather metrics
+
+    lane: (str)
+      FAST or BULK
+
+    key: (str or None)
+      tasks with the same key run one at a time, in the order submitted
+
+    after: (list)
+      tasks which must finish before this one starts
+
+    submitted, started, finished: (float)
+      monotonic times at which the task was queued, began, and ended
+
+    '''
+    def __init__(self, name, func, lane=BULK, key=None, after=None):
+        self.name      = name
+        self.func      = func
+        self.lane      = lane
+        self.key       = key
+        self.after     = list(after or [])
+        self.submitted = time.monotonic()
+        self.started   = None
+        self.finished  = None
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+
+class TaskMetrics():
+    '''Running totals for one kind of task.'''
+    def __init__(self):
+        self.count, self.failed = 0, 0
+        self.wait, self.run, self.longest = 0.0, 0.0, 0.0
+
+    def add(self, task, failed):
+        self.count   += 1
+        self.failed  += int(failed)
+        self.wait    += task.started - task.submitted
+        self.run     += task.finished - task.started
+        self.longest  = max(self.longest, task.finished - task.submitted)
+
+
+class TaskScheduler():
+    '''Run the work requested of the file manager in a pool of worker
+    threads, so that a long job, like regenerating every XDI file of an
+    experiment, does not hold up a quick request, like next_index,
+    which a plan in bsui is waiting on.
+
+    Work is queued in two lanes.  The FAST lane is for small requests
+    with a reply.  The BULK lane is for writing files.  Some workers
+    only serve the FAST lane, the rest serve the FAST lane first and
+    the BULK lane when it is empty.
+
+    Order is kept where it matters: tasks with the same key run one at
+    a time in the order they were submitted (e.g. "dossier set" before
+    "dossier write"), and a task can be made to wait for other tasks
+    to finish (e.g. next_index waits for XDI files being written).
+
+    attributes
+    ==========
+    queues: (dict)
+      lane : deque of tasks waiting to run
+
+    busy: (set)
+      keys of tasks which are running
+
+    running: (set)
+      tasks which are running
+
+    metrics: (dict)
+      task name : TaskMetrics
+
+    peak: (dict)
+      lane : largest number of tasks waiting in that lane
+
+    logger:
+      python logger
+
+    slow: (float)
+      tasks taking longer than this, in seconds, are reported to the logger
+
+    '''
+    def __init__(self, fast_workers=2, bulk_workers=3, logger=None, slow=60):
+        self.queues    = {lane: deque() for lane in LANES}
+        self.busy      = set()
+        self.running   = set()
+        self.metrics   = dict()
+        self.peak      = {lane: 0 for lane in LANES}
+        self.logger    = logger
+        self.slow      = slow
+        self.condition = threading.Condition()
+        self.stopping  = False
+        self.workers   = []
+        for i in range(fast_workers):
+            self.workers.append(threading.Thread(target=self.work, args=((FAST,),), name=f'fast-{i}', daemon=True))
+        for i in range(bulk_workers):
+            self.workers.append(threading.Thread(target=self.work, args=(LANES,), name=f'bulk-{i}', daemon=True))
+        for w in self.workers:
+            w.start()
+
+    def submit(self, name, func, lane=BULK, key=None, after=None):
+        '''Queue func (a callable without arguments) and return its Task.'''
+        task = Task(name, func, lane=lane, key=key, after=after)
+        with self.condition:
+            self.queues[lane].append(task)
+            self.peak[lane] = max(self.peak[lane], len(self.queues[lane]))
+            self.condition.notify_all()
+        return task
+
+    def pending(self, *keys):
+        '''Return the queued or running tasks with any of these keys.'''
+        with self.condition:
+            return [t for lane in LANES for t in self.queues[lane] if t.key in keys] + \
+                [t for t in self.running if t.key in keys]
+
+    def runnable(self, lanes):
+        '''Remove and return the first task which may start now, or None.
+        Call with the condition held.'''
+        blocked = set(self.busy)
+        for lane in lanes:
+            for task in self.queues[lane]:
+                if task.key is not None:
+                    if task.key in blocked:
+                        continue
+                    blocked.add(task.key)
+                if all(t.done for t in task.after):
+                    self.queues[lane].remove(task)
+                    return task
+        return None
+
+    def work(self, lanes):
+        while True:
+            with self.condition:
+                task = self.runnable(lanes)
+                while task is None:
+                    if self.stopping:
+                        return
+                    self.condition.wait()
+                    task = self.runnable(lanes)
+                if task.key is not None:
+                    self.busy.add(task.key)
+                self.running.add(task)
+                task.started = time.monotonic()
+
+            failed = False
+            try:
+                task.func()
+            except Exception as E:
+                failed = True
+                if self.logger is not None:
+                    self.logger.error(f'{task.name} failed: {E}\n{traceback.format_exc()}')
+
+            with self.condition:
+                task.finished = time.monotonic()
+                self.busy.discard(task.key)
+                self.running.discard(task)
+                self.metrics.setdefault(task.name, TaskMetrics()).add(task, failed)
+                self.condition.notify_all()
+            if self.logger is not None and task.finished - task.submitted > self.slow:
+                self.logger.info(f'{task.name} took {task.finished - task.submitted:.1f} s ' +
+                                 f'({task.started - task.submitted:.1f} s waiting in the {task.lane} lane)')
+
+    def depth(self):
+        '''Return the number of waiting tasks in each lane.'''
+        with self.condition:
+            return {lane: len(self.queues[lane]) for lane in LANES}
+
+    def report(self):
+        '''Return a table of queue depths and task latencies.'''
+        with self.condition:
+            text = ['queues: ' + ', '.join(f'{lane} {len(self.queues[lane])} waiting (peak {self.peak[lane]})' for lane in LANES) +
+                    f', {len(self.running)} running']
+            text.append(f'   {"task":16} {"count":>6} {"failed":>6} {"wait (s)":>9} {"run (s)":>9} {"longest (s)":>11}')
+            for name, m in sorted(self.metrics.items()):
+                text.append(f'   {name:16} {m.count:6d} {m.failed:6d} {m.wait/m.count:9.2f} {m.run/m.count:9.2f} {m.longest:11.2f}')
+        return '\n'.join(text)
+
+    def shutdown(self, wait=True):
+        '''Let the workers finish the queued tasks, then stop them.'''
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if wait:
+            for w in self.workers:
+                w.join()
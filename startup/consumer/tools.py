@@ -1,4 +1,6 @@
-import os, datetime, emojis, re, configparser, numpy
+import os, datetime, emojis, re, configparser, numpy, threading, atexit, fcntl, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from lmfit.models import StepModel, RectangleModel
 from matplotlib import get_backend
 import matplotlib
@@ -43,14 +45,19 @@ rkvs = redis.Redis(host=bmm_redis, port=6379, db=0)
 DATA_SECURITY = True
 
 def experiment_folder(catalog, uid):
+    return start_folder(catalog[uid].metadata['start'])
 
+def start_folder(start):
+    '''The experiment folder of a run, from its start document.  This
+    is used when the run is not yet in the catalog, e.g. by the
+    streaming XDI writer.'''
     facility_dict = RedisJSONDict(redis_client=redis_client, prefix='xas-')
-    if 'data_session' in catalog[uid].metadata['start']:
-        proposal = catalog[uid].metadata['start']['data_session'] #[5:]
+    if 'data_session' in start:
+        proposal = start['data_session'] #[5:]
     else:
         proposal = facility_dict['xas-data_session']
-    if 'XDI' in catalog[uid].metadata['start'] and 'Facility' in catalog[uid].metadata['start']['XDI']:
-        cycle = catalog[uid].metadata['start']['XDI']['Facility']['cycle']
+    if 'XDI' in start and 'Facility' in start['XDI']:
+        cycle = start['XDI']['Facility']['cycle']
     else:
         if 'xas_cycle' in facility_dict:
             cycle = facility_dict['xas-cycle']
@@ -60,8 +67,8 @@ def experiment_folder(catalog, uid):
     if DATA_SECURITY:
         folder    = os.path.join('/nsls2', 'data3', 'bmm', 'proposals', cycle, f'{proposal}')
     else:
-        proposal  = catalog[uid].metadata['start']['XDI']['Facility']['SAF']
-        startdate = catalog[uid].metadata['start']['XDI']['_user']['startdate']
+        proposal  = start['XDI']['Facility']['SAF']
+        startdate = start['XDI']['_user']['startdate']
         folder = os.path.join('/nsls2', 'data3', 'bmm', 'XAS', cycle, str(proposal), startdate)
     #print(f'folder is {folder}')
     return folder
@@ -85,24 +92,102 @@ def file_resource(catalog, uid):
 
 
 
-def echo_slack(text='', img=None, icon='message', rid=None, measurement='xafs'):
-    facility_dict = RedisJSONDict(redis_client=redis_client, prefix='xas-')
-    base   = os.path.join('/nsls2', 'data3', 'bmm', 'proposals', facility_dict['cycle'], facility_dict['data_session'])
-    rawlogfile = os.path.join(base, 'dossier', '.rawlog')
-    rawlog = open(rawlogfile, 'a')
-    rawlog.write(message_div(text, img=img, icon=icon, rid=rid, measurement=measurement))
-    rawlog.close()
+class MessageLog():
+    '''Maintain the messagelog.html page of Slack messages in the
+    dossier folder of a proposal.
+
+    Messages are collected for a short interval then written as a
+    batch.  Each batch is appended to the .rawlog file and inserted
+    into messagelog.html just before the closing tags of the page,
+    which are found at the end of the file.  Thus the cost of a
+    message is proportional to its own size, not to the size of the
+    whole log.  The page is re-rendered from scratch using .rawlog
+    and the template only when it is missing or its ending is not
+    what is expected (for instance, if the template has changed).
+    Both files are written while holding an fcntl lock on .rawlog, as
+    the file manager and the plot manager both post messages.
 
-    with open(os.path.join(startup_dir, 'tmpl', 'messagelog.tmpl')) as f:
-        content = f.readlines()
+    attributes
+    ==========
+    interval: (float)
+      seconds to collect messages before writing them [2]
 
-    with open(rawlogfile, 'r') as fd:
-        allmessages = fd.read()
+    '''
+    def __init__(self, interval=2):
+        self.interval = interval
+        self.pending  = dict()     # dossier folder : list of message divs
+        self.lock     = threading.Lock()
+        self.writing  = threading.Lock()
+        self.timer    = None
+        atexit.register(self.flush)
+
+    def add(self, folder, div):
+        with self.lock:
+            self.pending.setdefault(folder, []).append(div)
+            if self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def shell(self):
+        '''Return the parts of the page before and after the messages.'''
+        with open(os.path.join(startup_dir, 'tmpl', 'messagelog.tmpl')) as f:
+            head, tail = f.read().split('{text}')
+        return(head.format(channel = 'BMM #beamtime'), tail.format())
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, dict()
+            self.timer = None
+        with self.writing:
+            for folder, divs in pending.items():
+                text = ''.join(divs)
+                ## the file manager and the plot manager both post messages,
+                ## each batch goes into both files under a lock on .rawlog
+                with open(os.path.join(folder, '.rawlog'), 'a') as rawlog:
+                    fcntl.lockf(rawlog, fcntl.LOCK_EX)
+                    rawlog.write(text)
+                    rawlog.flush()
+                    self.insert(folder, text)
+
+    def insert(self, folder, text):
+        messagelog = os.path.join(folder, 'messagelog.html')
+        head, tail = self.shell()
+        tail = tail.encode('utf8')
+        if os.path.isfile(messagelog):
+            with open(messagelog, 'r+b') as fh:
+                fcntl.lockf(fh, fcntl.LOCK_EX)
+                end = fh.seek(0, os.SEEK_END)
+                if end >= len(tail):
+                    fh.seek(end - len(tail))
+                    if fh.read() == tail:
+                        fh.seek(end - len(tail))
+                        fh.write(text.encode('utf8') + tail)
+                        fh.truncate()
+                        return
+        self.render(folder)
+
+    def render(self, folder):
+        '''Rewrite messagelog.html from the template and the entire .rawlog.
+        The file is truncated only once it is locked.'''
+        head, tail = self.shell()
+        with open(os.path.join(folder, '.rawlog'), 'r') as fd:
+            allmessages = fd.read()
+        with open(os.path.join(folder, 'messagelog.html'), 'a+') as o:
+            fcntl.lockf(o, fcntl.LOCK_EX)
+            o.seek(0)
+            o.truncate()
+            o.write(head + allmessages + tail)
+
+messagelog = MessageLog()
 
-    messagelog = os.path.join(base, 'dossier', 'messagelog.html')
-    o = open(messagelog, 'w')
-    o.write(''.join(content).format(text = allmessages, channel = 'BMM #beamtime'))
-    o.close()
+def echo_slack(text='', img=None, icon='message', rid=None, measurement='xafs'):
+    facility_dict = RedisJSONDict(redis_client=redis_client, prefix='xas-')
+    base   = os.path.join('/nsls2', 'data3', 'bmm', 'proposals', facility_dict['cycle'], facility_dict['data_session'])
+    div = message_div(text, img=img, icon=icon, rid=rid, measurement=measurement)
+    if div is None:
+        return
+    messagelog.add(os.path.join(base, 'dossier'), div)
 
 # this bit of html+css is derived from https://www.w3schools.com/howto/howto_css_chat.asp
 def message_div(text='', img=None, icon='message', rid=None, measurement='xafs'):
@@ -151,7 +236,102 @@ def message_div(text='', img=None, icon='message', rid=None, measurement='xafs')
 
 
 
-def next_index(folder, stub):
+REPLY_LIFETIME = 60
+
+def wait_for_run(catalog, uid, timeout=60, poll=0.5):
+    '''bsui posts documents to Tiled from a worker thread (see
+    BMM.tiled_writer), so a stop document published through kafka can
+    arrive here before the run is in Tiled.  Wait until the run and its
+    stop document can be read.  Return False after timeout seconds.
+    This polls Tiled, so it should be used from a worker thread, not
+    from the kafka poll loop.  'last' is not waited for.'''
+    if uid == 'last':
+        return True
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if catalog[uid].metadata.get('stop') is not None:
+                return True
+        except KeyError:
+            pass
+        time.sleep(poll)
+    print(f'*** run {uid} did not appear in Tiled within {timeout} seconds')
+    return False
+
+
+class RunArrivals():
+    '''Hold messages from bsui which name runs until those runs can be
+    read from Tiled, without making the kafka poll loop wait.
+
+    A message naming a run (its 'uid' or 'uidlist'), and every message
+    after it, is held while a worker thread waits for the runs (see
+    wait_for_run).  ready() hands back the held messages, in the order
+    they arrived, once the runs they name are in Tiled.  It is called
+    from the poll loop between messages, so the messages are handled
+    in the main thread, as the plotting requires.
+
+    attributes
+    ==========
+    catalog:
+      Tiled catalog (or BMM.run_cache.RunCache)
+
+    timeout: (float)
+      seconds to wait for a run [60]
+
+    '''
+    def __init__(self, catalog, timeout=60, workers=2):
+        self.catalog = catalog
+        self.timeout = timeout
+        self.held    = deque()
+        self.pool    = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='run arrivals')
+
+    def runs(self, message):
+        uids = list(message.get('uidlist', None) or [])
+        if isinstance(message.get('uid'), str):
+            uids.insert(0, message['uid'])
+        return uids
+
+    def wait(self, uids):
+        return all([wait_for_run(self.catalog, u, timeout=self.timeout) for u in uids])
+
+    def submit(self, func, *args):
+        '''Run func in a worker thread, e.g. something else which waits for a run.'''
+        return self.pool.submit(func, *args)
+
+    def hold(self, message):
+        '''Return True if the message is held, i.e. if it names a run or
+        if earlier messages are still held.'''
+        uids = self.runs(message)
+        if len(uids) == 0 and len(self.held) == 0:
+            return False
+        self.held.append((message, self.pool.submit(self.wait, uids)))
+        return True
+
+    def ready(self):
+        '''Return the held messages, in order, up to the first one whose
+        runs are not yet in Tiled.  A message whose runs never arrived
+        is dropped.'''
+        found = []
+        while len(self.held) > 0 and self.held[0][1].done():
+            message, future = self.held.popleft()
+            if future.exception() is None and future.result() is True:
+                found.append(message)
+        return found
+
+
+def post_reply(reply_to, answer):
+    '''Answer a request made from bsui with BMM.kafka.kafka_request by
+    pushing the answer onto the request's reply key.  The key expires
+    in case the requester has already given up waiting.'''
+    if reply_to is None:
+        return
+    pipe = rkvs.pipeline()
+    pipe.rpush(reply_to, answer)
+    pipe.expire(reply_to, REPLY_LIFETIME)
+    pipe.execute()
+
+
+def next_index(folder, stub, reply_to=None):
     '''Find the next numeric filename extension for a filename stub in folder.'''
     listing = os.listdir(folder)
     r = re.compile(re.escape(stub) + r'\.\d+')
@@ -161,10 +341,11 @@ def next_index(folder, stub):
     else:
         answer = int(results[-1][-3:]) + 1
     rkvs.set('BMM:next_index', answer)
+    post_reply(reply_to, answer)
     print(f"Next index for {stub} in {folder} is {answer}.")
 
 
-def file_exists(folder, filename, start, stop, number):
+def file_exists(folder, filename, start, stop, number, reply_to=None):
     '''Return true is a file of the supplied name exists in the supplied folder.'''
     target = os.path.join(folder, filename)
     found, text = False, []
@@ -183,9 +364,11 @@ def file_exists(folder, filename, start, stop, number):
 
     if found is True:
         rkvs.set('BMM:file_exists', 'true')
+        post_reply(reply_to, 'true')
         print(f"{', '.join(text)} found in {folder}.")
     else:
         rkvs.set('BMM:file_exists', 'false')
+        post_reply(reply_to, 'false')
         print(f'"{filename}" not found in {folder} in range {start} - {stop}.')
 
 
@@ -200,7 +383,7 @@ def peak(signal):
     return numpy.argmax(signal)
 
 
-def peakfit(catalog=None, uid=None, motor=None, signal='I0', choice='peak', spinner=None, ga=None):
+def peakfit(catalog=None, uid=None, motor=None, signal='I0', choice='peak', spinner=None, ga=None, reply_to=None):
 
     if uid == 'last':
         uid = catalog[-1].metadata['start']['uid']
@@ -269,6 +452,7 @@ def peakfit(catalog=None, uid=None, motor=None, signal='I0', choice='peak', spin
         top      = positions[position]
 
     rkvs.set('BMM:peak_position', top)
+    post_reply(reply_to, top)
     print(f'*** peak found at {motor} position {top}')
 
     #if self.fig is not None:
@@ -306,7 +490,7 @@ def peakfit(catalog=None, uid=None, motor=None, signal='I0', choice='peak', spin
             ga.fluo_data      = list(sig)
             ga.complete       = True
 
-def rectanglefit(catalog=None, uid=None, motor=None, signal='It', drop=None, aw=None):
+def rectanglefit(catalog=None, uid=None, motor=None, signal='It', drop=None, aw=None, reply_to=None):
 
     top = 0
     t  = catalog[uid].primary['data']
@@ -338,6 +522,7 @@ def rectanglefit(catalog=None, uid=None, motor=None, signal='It', drop=None, aw=
     target = out.params["midpoint"].value
     amplitude = abs(out.params['amplitude'].value)
     rkvs.set('BMM:peak_position', target)
+    post_reply(reply_to, target)
     print(f'*** midpoint of rectangle scan found at {motor} position {target:.3f}')
 
     if get_backend().lower() != 'agg':
@@ -370,7 +555,7 @@ def rectanglefit(catalog=None, uid=None, motor=None, signal='It', drop=None, aw=
             aw.y_amplitude = amplitude
             aw.y_detector = signal.lower()
 
-def stepfit(catalog=None, uid=None, motor=None, signal='It', spinner=None, ga=None):
+def stepfit(catalog=None, uid=None, motor=None, signal='It', spinner=None, ga=None, reply_to=None):
 
     if uid == 'last':
         uid = catalog[-1].metadata['start']['uid']
@@ -402,6 +587,7 @@ def stepfit(catalog=None, uid=None, motor=None, signal='It', spinner=None, ga=No
 
     target = out.params['center'].value
     rkvs.set('BMM:peak_position', target)
+    post_reply(reply_to, target)
     print(f'*** edge of step function found at {motor} position {target:.3f}')
 
     if get_backend().lower() != 'agg':
@@ -1,5 +1,5 @@
 
-import os, gzip
+import os, gzip, numpy
 from matplotlib import get_backend
 
 from BMM.larch_interface import Pandrosus, Kekropidai, plt
@@ -25,8 +25,8 @@ class XAFSSequence():
 
     Future features
     ===============
-    (1) Evaluate noise level in data, for instance as epsilon_R, establish 
-        a criterion for leaving the repetition loop 
+    (1) Establish a criterion for leaving the repetition loop based on
+        the noise level tracked by the running merge
     (2) More & configurable plot types.  Some kind of representation of all 
         the views of the data, a la bluesky-widgets, maybe tabs
 
@@ -76,13 +76,20 @@ class XAFSSequence():
             this.folder = self.workspace
         this.fetch(uid, mode=self.mode)
         self.panlist.append(this)
-        self.kek.add(this)
+        self.kek.add(this)   # updates the running merge, the merge itself is prepped only when plotted
+        if len(self.uidlist) > 1:
+            noise = self.kek.running.noise()
+            self.logger.info(f'{len(self.uidlist)} scans merged, median point-by-point noise in mu(E): {numpy.median(noise):.2e}')
         if len(self.uidlist) != self.repetitions:
+            ## without a display, a plot is only needed when it will be posted to slack
+            posting = self.repetitions > 5 and len(self.uidlist) % 3 == 0
+            if get_backend().lower() == 'agg' and not posting:
+                return
             if self.fig is not None:
                 plt.close(self.fig.number)
             ok = self.merge()
             if ok == 1:
-                if self.repetitions > 5 and len(self.uidlist) % 3 == 0:
+                if posting:
                     if get_backend().lower() == 'agg':
                         post_to_slack('(Posting a plot every third scan in a sequence...)')
                         #tossfile = os.path.join(this.folder, 'snapshots', 'toss.png')
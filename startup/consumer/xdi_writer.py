@@ -0,0 +1,321 @@
+import os, sys, re, datetime, pathlib, threading
+import numpy
+from bluesky import __version__ as bluesky_version
+
+## This module is imported by the worker processes of XASFile.everyxas,
+## so it should not import anything (like the Slack bot or redis) which
+## does work at import time.
+
+SDD_DETECTORS = ('1-element SDD', '4-element SDD', '7-element SDD')
+
+
+def plot_hint(start):
+    '''Return the Scan.plot_hint for an XAS scan from its start document.'''
+    text = 'ln(I0/It)  --  ln($5/$6)'
+    el = start['XDI']['Element']['symbol']
+
+    if '1-element SDD' in start['detectors']:
+        text = f'{el}8/I0  --  $8/$5'
+    elif '4-element SDD' in start['detectors']:
+        text = f'({el}1+{el}2+{el}3+{el}4)/I0  --  ($8+$9+$10+$11)/$5'
+    elif '7-element SDD' in start['detectors']:
+        text = f'({el}1+{el}2+{el}3+{el}4+{el}5+{el}6+{el}7)/I0  --  ($8+$9+$10+$11+$12+$13+$14)/$5'
+    elif 'reference' in start['plan_name']:
+        text = 'ln(It/Ir)  --  ln($6/$7)'
+    elif 'yield' in start['plan_name']:
+        text = 'ln(It/Ir)  --  ln($8/$5)'
+    elif 'test' in start['plan_name']:
+        text = 'I0  --  $5'
+    return text
+
+
+def xdi_header(start, stop, uid, hdf5files=(), include_yield=False):
+    '''Make the header of the XDI file of an XAS scan.
+
+    Parameters
+    ----------
+    start, stop : dict
+        start and stop documents of the scan, stop is None for a scan
+        which is still running
+    uid : str
+        uid of the scan
+    hdf5files : list of str
+        files written by the SDD and Pilatus, as from tools.file_resource
+    include_yield : bool
+        True to write the Iy column
+
+    Output
+    ------
+    header text, list of primary stream columns, list of column labels
+
+    '''
+    xdi = start["XDI"]
+    lines = [f'# XDI/1.0 BlueSky/{bluesky_version} BMM/{pathlib.Path(sys.executable).parts[-3]}']
+
+    ## header lines with metadata from the XDi dictionary
+    for family in ('Beamline', 'Detector', 'Element', 'Facility', 'Mono', 'Sample', 'Scan'):
+        for k in xdi[family].keys():
+            if family == 'Sample' and k == 'comment':
+                continue
+            if family == 'Sample' and k == 'extra_metadata':
+                continue
+            lines.append(f'# {family}.{k}: {xdi[family][k]}')
+    lines.append(f'# Scan.start_time: {datetime.datetime.fromtimestamp(start["time"]).strftime("%Y-%m-%dT%H:%M:%S")}')
+    if stop is not None:
+        lines.append(f'# Scan.end_time: {datetime.datetime.fromtimestamp(stop["time"]).strftime("%Y-%m-%dT%H:%M:%S")}')
+    lines.append(f'# Scan.uid: {uid}')
+    lines.append(f'# Scan.transient_id: {start["scan_id"]}')
+
+    if any(x in start['detectors'] for x in SDD_DETECTORS):
+        for h in hdf5files:
+            relative = '/'.join(h.split('/')[-6:])
+            if 'xspress3' in relative:
+                lines.append(f'# Scan.xspress3_hdf5_file: {relative}')
+            elif 'pilatus' in relative:
+                lines.append(f'# Scan.pilatus100k_hdf5_file: {relative}')
+
+    lines.append(f'# Scan.plot_hint: {plot_hint(start)}')
+    lines.extend(['# Column.1: energy eV',
+                  '# Column.2: requested_energy eV',
+                  '# Column.3: measurement_time seconds',
+                  '# Column.4: xmu',
+                  '# Column.5: I0 nA',
+                  '# Column.6: Itrans nA',
+                  '# Column.7: Irefer nA'])
+
+    ## Column.N header lines
+    column_list = ['dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', 'I0', 'It', 'Ir']
+    column_labels = ['energy', 'requested_energy', 'measurement_time', 'xmu', 'I0', 'It', 'Ir']
+    if 'yield' in start['plan_name'] or include_yield is True:
+        lines.append('# Column.8: Iy nA')
+        column_list.append('Iy')
+        column_labels.append('Iy')
+
+    el = xdi['Element']['symbol']
+    nchan = 0
+    if '1-element SDD' in start['detectors']:
+        nchan = 1
+        column_list.append(f'{el}8')
+        column_labels.append(f'{el}8')
+        lines.append(f'# Column.8: {el}8')
+    elif '4-element SDD' in start['detectors']:
+        column_list.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4'])
+        column_labels.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4'])
+        nchan = 4
+        if 'pilatus100k-1' in start['detectors']:
+            column_list.extend(['diffuse', 'specular'])
+            column_labels.extend(['diffuse', 'specular'])
+    elif '7-element SDD' in start['detectors']:
+        column_list.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4', f'{el}5', f'{el}6', f'{el}7'])
+        column_labels.extend([f'{el}1', f'{el}2', f'{el}3', f'{el}4', f'{el}5', f'{el}6', f'{el}7'])
+        nchan = 7
+        if 'pilatus100k-1' in start['detectors']:
+            column_list.extend(['diffuse', 'specular'])
+            column_labels.extend(['diffuse', 'specular'])
+
+    if nchan > 0:
+        offset = 8 if ('yield' in start['plan_name'] or include_yield is True) else 7
+        for i in range(1, nchan+1):
+            lines.append(f'# Column.{i+offset}: {el}{i}')
+    if 'pilatus100k-1' in start['detectors']:
+        lines.append(f'# Column.{8+nchan}: diffuse')
+        lines.append(f'# Column.{9+nchan}: specular')
+
+    ## comment and separator lines
+    lines.append('# //////////////////////////////////////////////////////////')
+    for l in xdi["_comment"]:
+        lines.append(f'# {l}')
+    lines.append('# ----------------------------------------------------------')
+    return '\n'.join(lines) + '\n# ', column_list, column_labels
+
+
+def xmu(table, detectors, plan_name, el):
+    '''Return the xmu column for a table of primary stream data, as
+    appropriate to the detectors and plan of the scan.'''
+    if '1-element SDD' in detectors:
+        return table[f'{el}8']/table['I0']
+    elif '4-element SDD' in detectors:
+        return (table[f'{el}1']+table[f'{el}2']+table[f'{el}3']+table[f'{el}4'])/table['I0']
+    elif '7-element SDD' in detectors:
+        return (table[f'{el}1']+table[f'{el}2']+table[f'{el}3']+table[f'{el}4']+table[f'{el}5']+table[f'{el}6']+table[f'{el}7'])/table['I0']
+    elif 'transmission' in plan_name:
+        return numpy.log(table['It']/table['I0'])
+    elif 'reference' in plan_name:
+        return numpy.log(table['Ir']/table['It'])
+    elif 'yield' in plan_name:
+        return table['Iy']/table['It']
+    elif 'test' in plan_name:
+        return table['I0']
+    return numpy.log(table['It']/table['I0'])
+
+
+def write_xdi(fname, header, table, column_list, column_labels, detectors, plan_name, el):
+    '''Write an XDI file from its header and a pandas DataFrame of primary stream data.'''
+    table = table.copy()
+    table['xmu'] = xmu(table, detectors, plan_name, el)
+    columns = list(column_list)
+    columns.insert(3, 'xmu')
+    with open(fname, 'w') as handle:
+        handle.write(header)
+        handle.write(table.to_csv(None, sep=' ', columns=columns, index=False, header=column_labels, float_format='%.6f'))
+    return fname
+
+
+def format_value(value):
+    '''Format one value of a data row as pandas.to_csv does in write_xdi.'''
+    if isinstance(value, (float, numpy.floating)):
+        return '' if numpy.isnan(value) else f'{value:.6f}'
+    return str(value)
+
+
+class XDIStream():
+    '''The XDI file of one XAS scan, written as the scan runs.
+
+    The file is opened when the start document arrives, with a header
+    made from the XDI metadata, and a row is appended and flushed to
+    disk for every event in the primary stream.  At the stop document,
+    the file is rewritten with the end time and the HDF5 file names in
+    the header.  So the data are on disk as they are measured, and a
+    scan which dies part way through leaves a readable file.
+
+    attributes
+    ==========
+    fname: (str)
+      fully resolved path of the XDI file
+
+    columns, labels: (list)
+      primary stream data keys and column labels
+
+    rows: (list)
+      formatted data rows written thus far
+
+    resources: (list)
+      files written by detectors during the scan
+
+    '''
+    def __init__(self, start, fname):
+        self.start     = start
+        self.uid       = start['uid']
+        self.fname     = fname
+        self.rows      = []
+        self.resources = []
+        self.detectors = list(start['detectors'])
+        self.plan_name = start['plan_name']
+        self.element   = start['XDI']['Element']['symbol']
+        header, self.columns, self.labels = xdi_header(start, None, self.uid)
+        self.handle = open(fname, 'w')
+        self.handle.write(header + ' '.join(self.labels) + '\n')
+        self.handle.flush()
+
+    def add(self, data):
+        row = {k: numpy.float64(data[k]) for k in self.columns}
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            row['xmu'] = xmu(row, self.detectors, self.plan_name, self.element)
+        columns = list(self.columns)
+        columns.insert(3, 'xmu')
+        self.rows.append(' '.join(format_value(row[k]) for k in columns))
+        self.handle.write(self.rows[-1] + '\n')
+        self.handle.flush()
+
+    def finish(self, stop):
+        self.handle.close()
+        header, columns, labels = xdi_header(self.start, stop, self.uid, hdf5files=self.resources)
+        with open(self.fname + '.tmp', 'w') as handle:
+            handle.write(header + ' '.join(labels) + '\n')
+            handle.write('\n'.join(self.rows) + '\n')
+        os.replace(self.fname + '.tmp', self.fname)
+
+    def abandon(self):
+        self.handle.close()
+
+
+class StreamingXDI():
+    '''Write the XDI files of XAS scans from the documents of the scans,
+    as they are measured, rather than reading the whole primary stream
+    back from Tiled once the scan is over.
+
+    Feed every document to the document method.  When the xasxdi
+    message for a scan arrives, call wait to learn whether its file
+    was completed here.  If it was not -- the consumer started part way
+    through the scan, the scan was aborted, something went wrong --
+    write it from Tiled as usual.
+
+    attributes
+    ==========
+    folder: (callable)
+      returns the experiment folder from a start document
+
+    streams: (dict)
+      uid : XDIStream for each scan in progress
+
+    descriptors: (dict)
+      descriptor uid : uid of the run, for the primary streams of scans in progress
+
+    finished: (dict)
+      uid : (filename, True if every point was written) for scans that have ended
+
+    logger:
+      python logger
+
+    '''
+    def __init__(self, folder, logger=None):
+        self.folder      = folder
+        self.logger      = logger
+        self.streams     = dict()
+        self.descriptors = dict()
+        self.finished    = dict()
+        self.condition   = threading.Condition()
+
+    def wanted(self, start):
+        return (str(start.get('plan_name', '')).startswith(('scan_nd xafs', 'fly xafs')) and
+                'XDI' in start and '_filename' in start['XDI'])
+
+    def document(self, name, doc):
+        try:
+            if name == 'start' and self.wanted(doc):
+                fname = os.path.join(self.folder(doc), doc['XDI']['_filename'])
+                self.streams[doc['uid']] = XDIStream(doc, fname)
+
+            elif name == 'descriptor' and doc['run_start'] in self.streams and doc.get('name') == 'primary':
+                self.descriptors[doc['uid']] = doc['run_start']
+
+            elif name == 'resource' and doc.get('run_start') in self.streams:
+                this = os.path.join(doc['root'], doc['resource_path'])
+                if '_%d' in this or re.search(r'%\d\.\dd', this) is not None:
+                    this = this % 0
+                self.streams[doc['run_start']].resources.append(this)
+
+            elif name == 'event' and doc['descriptor'] in self.descriptors:
+                self.streams[self.descriptors[doc['descriptor']]].add(doc['data'])
+
+            elif name == 'stop' and doc['run_start'] in self.streams:
+                self.stop(doc)
+        except Exception as E:
+            uid = doc.get('run_start', doc.get('uid'))
+            if self.logger is not None:
+                self.logger.error(f'streaming XDI file for {uid} abandoned: {E}')
+            self.drop(uid)
+
+    def stop(self, doc):
+        stream = self.streams[doc['run_start']]
+        complete = (doc.get('exit_status') == 'success' and
+                    doc.get('num_events', {}).get('primary') == len(stream.rows))
+        stream.finish(doc)
+        self.drop(doc['run_start'], (stream.fname, complete))
+
+    def drop(self, uid, outcome=(None, False)):
+        stream = self.streams.pop(uid, None)
+        if stream is not None and not stream.handle.closed:
+            stream.abandon()
+        self.descriptors = {k: v for k, v in self.descriptors.items() if v != uid}
+        with self.condition:
+            self.finished[uid] = outcome
+            self.condition.notify_all()
+
+    def wait(self, uid, timeout=60):
+        '''Wait for a scan being streamed to end.  Return the name of its
+        XDI file if every point was written, otherwise None.'''
+        with self.condition:
+            self.condition.wait_for(lambda: uid in self.finished or uid not in self.streams, timeout=timeout)
+            fname, complete = self.finished.get(uid, (None, False))
+        return fname if complete else None
@@ -0,0 +1,86 @@
+'''Count the dwell time puts made during a sequence of XAFS scans, with
+and without BMM.set_on_change, using simulated signal chains.
+
+Each simulated chain charges a put latency plus its settle time to a
+clock rather than sleeping, so this runs in a moment.  Three ways of
+setting the dwell time are compared:
+
+  * every point: every chain written at every point of every scan
+  * scan_nd: the pseudo-axis moved only when its value changes within a
+    scan, as bluesky's scan_nd does, but every chain written each time
+  * set on change: as scan_nd, with the first region set before the
+    scan and every chain skipping a value it already has
+
+   python dwelltime_benchmark.py [repetitions]
+
+'''
+import os, sys, math
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup'))
+from ophyd.status import Status
+from BMM.set_on_change import SetOnChange, dwell_regions
+
+## name, put latency (s), settle time (s)
+CHAINS = (('quadem', 0.05, 0.5), ('ic0', 0.05, 0.5), ('ic1', 0.05, 0.5), ('ic2', 0.05, 0.5), ('xspress3', 0.02, 0.0))
+KTOE   = 3.8099819442818976
+
+
+class SimulatedDwellTime():
+    def __init__(self, name, latency, settle):
+        self.name, self.latency, self.settle_time = name, latency, settle
+        self.position, self.clock, self.writes = None, 0.0, 0
+
+    def move(self, position, wait=True, timeout=None, moved_cb=None):
+        self.clock += self.latency + self.settle_time
+        self.writes += 1
+        self.position = round(position, 4)
+        status = Status(obj=self)
+        status.set_finished()
+        if moved_cb is not None:
+            moved_cb(obj=self)
+        return status
+
+
+class SetOnChangeDwellTime(SetOnChange, SimulatedDwellTime):
+    pass
+
+
+def time_grid(e0=7112):
+    '''The time grid of the default XAFS scan: 10 eV steps at 0.5 s, 0.5 eV
+    steps at 0.5 s through the edge, then 0.05/Å steps with the time
+    growing as 0.25*k out to k=14.'''
+    times = [0.5] * 17 + [0.5] * 91
+    k = math.sqrt(15.3/KTOE)
+    while k < 14:
+        times.append(round(0.25*k, 2))
+        k += 0.05
+    return times
+
+
+def run(kind, grid, repetitions):
+    cls = SetOnChangeDwellTime if kind == 'set on change' else SimulatedDwellTime
+    chains = [cls(*c) for c in CHAINS]
+    for rep in range(repetitions):
+        trajectory = grid if rep % 2 == 0 else grid[::-1]
+        if kind == 'set on change':
+            for c in chains:
+                c.move(dwell_regions(trajectory)[0][1])
+        last = None
+        for t in trajectory:
+            if kind != 'every point' and t == last:
+                continue
+            for c in chains:
+                c.move(t, wait=False)
+            last = t
+    return sum(c.writes for c in chains), sum(c.clock for c in chains)/len(chains)
+
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    grid = time_grid()
+    regions = dwell_regions(grid)
+    print(f'{len(grid)} points, {len(regions)} dwell time regions, {repetitions} repetitions in both directions, {len(CHAINS)} signal chains')
+    print(f'   {"":16} {"puts":>8} {"seconds per chain":>18}')
+    for kind in ('every point', 'scan_nd', 'set on change'):
+        puts, seconds = run(kind, grid, repetitions)
+        print(f'   {kind:16} {puts:8d} {seconds:18.1f}')
@@ -0,0 +1,182 @@
+'''Compare a fly scan (BMM.flyscan.fly_energy_scan) with a step scan
+(scan_nd, as in BMM.xafs.xafs) using simulated ophyd devices.
+
+The simulated mono moves its Bragg angle at the requested speed and
+the simulated electrometer free-runs, posting a frame of I0 and It
+every frame time, with It following a model Fe K edge.  For the step
+scan, each point pays a settling and re-arming overhead, as measured
+by BMM.telemetry at the beamline.  Time is compressed by SPEEDUP so
+that the comparison runs in a few seconds.
+
+   python flyscan_benchmark.py
+
+'''
+import os, sys, time, threading
+import numpy
+
+from ophyd import Device, Signal, Component as Cpt
+from ophyd.status import DeviceStatus
+from bluesky import RunEngine
+from bluesky.plans import scan_nd
+from cycler import cycler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup'))
+from BMM.flyscan import fly_energy_scan, fly_time, energy_to_angle, angle_to_energy, FLY_FRAME_TIME
+
+SPEEDUP  = 50
+OVERHEAD = 1.0                  # seconds per point of a step scan, see BMM.telemetry
+TWOD     = 2*3.1355285          # Si(111)
+E0       = 7112
+
+
+def model_mu(energy):
+    '''A Fe K edge, more or less.'''
+    k = numpy.sqrt(numpy.clip(energy-E0, 0, None) * 0.2625)
+    return 0.3 + numpy.arctan((energy-E0)/2)/numpy.pi + 0.5 + 0.05*numpy.sin(2*2.5*k)*numpy.exp(-0.01*k**2)
+
+
+def xanes_grid():
+    grid = numpy.concatenate((numpy.arange(E0-200, E0-30, 10), numpy.arange(E0-30, E0+40, 0.5), numpy.arange(E0+40, E0+200, 2)))
+    return list(grid), [0.5]*len(grid)
+
+
+def exafs_grid():
+    pre  = numpy.arange(E0-200, E0-30, 10)
+    xan  = numpy.arange(E0-30, E0+15.3, 0.3)
+    k    = numpy.arange(2, 14, 0.05)
+    grid = numpy.concatenate((pre, xan, E0 + k**2/0.2625))
+    time = [0.5]*len(pre) + [0.5]*len(xan) + list(0.25*k)
+    return list(grid), time
+
+
+class SimBragg(Device):
+    '''The Bragg axis of a mono, moving at the speed in velocity.'''
+    user_readback = Cpt(Signal, value=energy_to_angle(E0-250, TWOD))
+    velocity      = Cpt(Signal, value=2.0)
+
+    def set(self, target):
+        status = DeviceStatus(self)
+        def move():
+            start, t0 = self.user_readback.get(), time.time()
+            direction = numpy.sign(target-start)
+            while True:
+                where = start + direction * self.velocity.get() * (time.time()-t0)
+                if direction * (where-target) >= 0:
+                    self.user_readback.put(target)
+                    break
+                self.user_readback.put(where)
+                time.sleep(0.002)
+            status.set_finished()
+        threading.Thread(target=move, daemon=True).start()
+        return status
+
+
+class SimElectrometer(Device):
+    '''Free-running electrometer: I0 and It post a frame every frame_time.'''
+    I0 = Cpt(Signal, value=0.0)
+    It = Cpt(Signal, value=0.0)
+
+    def __init__(self, *args, bragg=None, frame_time=FLY_FRAME_TIME, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bragg, self.frame_time, self.running = bragg, frame_time, False
+
+    def prepare(self):
+        self.running = True
+        threading.Thread(target=self.frames, daemon=True).start()
+        yield from []
+
+    def restore(self):
+        self.running = False
+        yield from []
+
+    def frames(self):
+        while self.running:
+            ## integrate over the frame by sampling the mono position
+            samples = []
+            stop = time.time() + self.frame_time
+            while time.time() < stop:
+                samples.append(angle_to_energy(self.bragg.user_readback.get(), TWOD))
+                time.sleep(self.frame_time/10)
+            mu = model_mu(numpy.array(samples)).mean()
+            i0 = 1e5 * (1 + 0.001*numpy.random.randn())
+            self.I0.put(i0)
+            self.It.put(i0*numpy.exp(-mu))
+
+
+class SimStepMono(Device):
+    '''The mono as moved by a step scan: each move pays the per-point overhead.'''
+    energy = Cpt(Signal, value=E0)
+    def set(self, value):
+        status = DeviceStatus(self, settle_time=OVERHEAD/SPEEDUP)
+        self.energy.put(value)
+        status.set_finished()
+        return status
+    def read(self):
+        return self.energy.read()
+    def describe(self):
+        return self.energy.describe()
+
+
+class SimStepDetector(Device):
+    '''Triggered detector which integrates for the dwell time.'''
+    I0    = Cpt(Signal, value=0.0)
+    It    = Cpt(Signal, value=0.0)
+    dwell = Cpt(Signal, value=0.5)
+    def __init__(self, *args, mono=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mono = mono
+    def trigger(self):
+        status = DeviceStatus(self)
+        def done():
+            self.I0.put(1e5)
+            self.It.put(1e5*numpy.exp(-model_mu(self.mono.energy.get())))
+            status.set_finished()
+        threading.Timer(self.dwell.get()/SPEEDUP, done).start()
+        return status
+
+
+def fly(RE, grid, times):
+    frame_time = FLY_FRAME_TIME/SPEEDUP
+    bragg = SimBragg(name='dcm_bragg')
+    em = SimElectrometer(name='em', bragg=bragg, frame_time=frame_time)
+    em.I0.name, em.It.name = 'I0', 'It'
+    uids = []
+    RE.subscribe(lambda name, doc: uids.append(doc['uid']) if name == 'start' else None)
+    data = []
+    RE.subscribe(lambda name, doc: data.append(doc['data']) if name == 'event' else None)
+    start = time.time()
+    RE(fly_energy_scan(grid, [t/SPEEDUP for t in times], bragg=bragg, twod=TWOD, vmax=100,
+                       signals={'I0': (em.I0, 'current'), 'It': (em.It, 'current')},
+                       frame_time=frame_time, prepare=em.prepare, restore=em.restore))
+    elapsed = (time.time()-start)*SPEEDUP
+    mu = numpy.log(numpy.array([d['I0'] for d in data])/numpy.array([d['It'] for d in data]))
+    energy = numpy.array([d['dcm_energy'] for d in data])
+    return elapsed, mu, energy
+
+
+def step(RE, grid, times):
+    mono = SimStepMono(name='dcm')
+    mono.energy.name = 'dcm_energy'
+    det = SimStepDetector(name='det', mono=mono)
+    det.I0.name, det.It.name = 'I0', 'It'
+    start = time.time()
+    RE(scan_nd([det], cycler(mono, grid) + cycler(det.dwell, times)))
+    return (time.time()-start)*SPEEDUP
+
+
+if __name__ == '__main__':
+    RE = RunEngine({})
+    grid, times = xanes_grid()
+    stepped = step(RE, grid, times)
+    flown, mu, energy = fly(RE, grid, times)
+    error = numpy.abs(mu - model_mu(numpy.array(grid))).max()
+    print(f'XANES, {len(grid)} points, {sum(times):.0f} s of dwell time (simulated, {SPEEDUP}x speedup)')
+    print(f'   step scan: {stepped:6.0f} s')
+    print(f'   fly scan:  {flown:6.0f} s')
+    print(f'   largest difference between binned and model mu: {error:.4f}')
+    print(f'   largest difference between binned and requested energy: {numpy.abs(energy-grid).max():.3f} eV')
+
+    grid, times = exafs_grid()
+    print(f'\nEXAFS, {len(grid)} points, {sum(times):.0f} s of dwell time (estimated)')
+    print(f'   step scan: {sum(times) + OVERHEAD*len(grid):6.0f} s')
+    print(f'   fly scan:  {fly_time(grid, times, TWOD):6.0f} s')
@@ -0,0 +1,66 @@
+'''Time reading the profile's lookup tables (lookup_table/Modes.xlsx and
+rois.json) through BMM.lookup_cache, against parsing them directly.
+
+Each case is run in a fresh python process, as at bsui startup or a
+queue server worker restart, using an empty, temporary cache folder.
+
+  * parse:  openpyxl and json, as the profile did before
+  * cold:   through the cache, with no pickles yet
+  * warm:   through the cache, with the pickles written by "cold"
+
+The "change_edge" column is what change_edge used to do: rois.json read
+three times (check_element, verify_roi and set_rois) and Modes.xlsx read
+once.
+
+   python lookup_table_benchmark.py [repeats]
+
+'''
+import os, sys, subprocess, tempfile, shutil, json, statistics
+
+STARTUP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup')
+MODES   = os.path.join(STARTUP, 'lookup_table', 'Modes.xlsx')
+ROIS    = os.path.join(STARTUP, 'rois.json')
+
+SNIPPET = '''
+import time, json
+start = time.perf_counter()
+from BMM.lookup_cache import lookup_table, read_json, parse_json, modes_from_xlsx
+if {direct}:
+    read_json, read_modes = parse_json, modes_from_xlsx
+else:
+    read_modes = lambda source: lookup_table(source, modes_from_xlsx)
+modes = read_modes({modes!r})
+rois  = read_json({rois!r})
+startup = time.perf_counter() - start
+start = time.perf_counter()
+for i in range(3):
+    rois = read_json({rois!r})
+modes = read_modes({modes!r})
+print(json.dumps([startup, time.perf_counter() - start]))
+'''
+
+
+def run(direct, cache):
+    code = SNIPPET.format(direct=direct, modes=MODES, rois=ROIS)
+    proc = subprocess.run([sys.executable, '-c', code], cwd=STARTUP, capture_output=True, text=True,
+                          env={**os.environ, 'XDG_CACHE_HOME': cache})
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return json.loads(proc.stdout)
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = {'parse': [], 'cold': [], 'warm': []}
+    for i in range(repeats):
+        cache = tempfile.mkdtemp()
+        try:
+            results['parse'].append(run(True, cache))
+            results['cold'].append(run(False, cache))
+            results['warm'].append(run(False, cache))
+        finally:
+            shutil.rmtree(cache)
+    print(f'median of {repeats}, milliseconds')
+    print(f'   {"":8} {"startup":>9} {"change_edge":>12}')
+    for kind, times in results.items():
+        print(f'   {kind:8} {1000*statistics.median(t[0] for t in times):9.1f} {1000*statistics.median(t[1] for t in times):12.1f}')
@@ -0,0 +1,60 @@
+'''Time BMM.map_export against the way raster maps used to be written:
+a row-by-row openpyxl workbook and a .mat file made from lists.
+
+Synthetic maps of several sizes are written to a temporary folder.
+
+   python raster_export_benchmark.py [folder]
+
+'''
+import os, sys, time, tempfile, shutil
+import numpy, openpyxl
+from scipy.io import savemat
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup'))
+from BMM.map_export import export_map, XLSX_LIMIT
+
+SIZES = ((51, 51), (101, 101), (201, 201), (401, 401))
+
+
+def synthetic_map(nslow, nfast):
+    rng = numpy.random.default_rng(0)
+    slow, fast = numpy.meshgrid(numpy.linspace(-5, 5, nslow), numpy.linspace(-5, 5, nfast), indexing='ij')
+    i0 = 1e5 * (1 + 0.01*rng.standard_normal(slow.size))
+    signal = i0 * (1 + numpy.exp(-(slow.ravel()**2 + fast.ravel()**2)/4)) * 0.01
+    return {'xafs_y': slow.ravel(), 'xafs_x': fast.ravel(), 'I0': i0, 'It': 0.5*i0, 'Ir': 0.25*i0, 'signal': signal}
+
+
+def legacy(stem, columns):
+    '''As RasterFiles.preserve_data did it.'''
+    names = list(columns)
+    wb = openpyxl.Workbook()
+    ws1 = wb.active
+    ws1.title = 'map'
+    ws1.append(names)
+    for i in range(len(columns['I0'])):
+        ws1.append(tuple(columns[n][i] for n in names))
+    wb.save(stem+'.xlsx')
+    savemat(stem+'.mat', {'label': 'map', **{n: list(columns[n]) for n in names}})
+
+
+def timeit(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp(dir=sys.argv[1] if len(sys.argv) > 1 else None)
+    try:
+        print(f'{"map":>10} {"pixels":>8} {"legacy xlsx+mat":>16} {"xlsx+mat":>9} {"hdf5+mat":>9} {"all formats":>12}')
+        for shape in SIZES:
+            columns = synthetic_map(*shape)
+            npixels = shape[0]*shape[1]
+            old = timeit(lambda: legacy(os.path.join(folder, 'legacy'), columns))
+            same = timeit(lambda: export_map(os.path.join(folder, 'same'), columns, shape, formats=('mat', 'xlsx')))
+            fast = timeit(lambda: export_map(os.path.join(folder, 'fast'), columns, shape, formats=('hdf5', 'mat')))
+            every = timeit(lambda: export_map(os.path.join(folder, 'all'), columns, shape, signal='signal', axes=('xafs_y', 'xafs_x')))
+            note = '' if npixels <= XLSX_LIMIT else '  (no xlsx above XLSX_LIMIT)'
+            print(f'{shape[0]:>4}x{shape[1]:<5} {npixels:8d} {old:15.2f}s {same:8.2f}s {fast:8.2f}s {every:11.2f}s{note}')
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,118 @@
+'''Latency benchmark for the bsui <-> kafka worker request/reply channel.
+
+Compares the old scheme (publish, sleep 1 second, then poll a shared
+redis key with exponential backoff) with the correlated request/reply
+scheme used by BMM.kafka.kafka_request and BMM.kafka.fetch_reply
+(publish with a unique reply key, then BLPOP on that key).
+
+By default, both redis and kafka are replaced by in-process stand-ins
+so this runs anywhere:
+
+   python rpc_benchmark.py
+
+To use a real redis server for the reply channel:
+
+   python rpc_benchmark.py --redis localhost
+
+'''
+import argparse, queue, statistics, threading, time, uuid
+
+
+class StandInRedis():
+    '''Just enough of a redis client for this benchmark.'''
+    def __init__(self):
+        self.store = {}
+        self.cond = threading.Condition()
+    def set(self, key, value):
+        with self.cond:
+            self.store[key] = str(value).encode('utf8')
+    def get(self, key):
+        with self.cond:
+            return self.store.get(key)
+    def rpush(self, key, value):
+        with self.cond:
+            self.store.setdefault(key, []).append(str(value).encode('utf8'))
+            self.cond.notify_all()
+    def blpop(self, key, timeout=0):
+        with self.cond:
+            ok = self.cond.wait_for(lambda: len(self.store.get(key, [])) > 0, timeout=timeout)
+            if not ok:
+                return None
+            return (key.encode('utf8'), self.store[key].pop(0))
+    def expire(self, key, seconds):
+        pass
+    def delete(self, key):
+        with self.cond:
+            self.store.pop(key, None)
+
+
+def worker(kafka, rkvs, service_time):
+    '''Stand-in for the kafka file manager answering next_index requests.'''
+    while True:
+        message = kafka.get()
+        if message is None:
+            return
+        time.sleep(service_time)
+        if 'reply_to' in message:
+            rkvs.rpush(message['reply_to'], 7)
+            rkvs.expire(message['reply_to'], 60)
+        else:
+            rkvs.set('BMM:next_index', 7)
+
+
+def polled_request(kafka, rkvs, maxtries=6):
+    rkvs.set('BMM:next_index', 'None')
+    kafka.put({'next_index': True})
+    time.sleep(1)
+    answer = rkvs.get('BMM:next_index').decode('utf8')
+    count = 0
+    while answer == 'None':
+        time.sleep(0.1*2**count)
+        answer = rkvs.get('BMM:next_index').decode('utf8')
+        count += 1
+        if count > maxtries:
+            return None
+    return int(answer)
+
+
+def correlated_request(kafka, rkvs, timeout=15):
+    reply_to = f'BMM:reply:{uuid.uuid4().hex}'
+    kafka.put({'next_index': True, 'reply_to': reply_to})
+    answer = rkvs.blpop(reply_to, timeout=timeout)
+    if answer is None:
+        return None
+    rkvs.delete(reply_to)
+    return int(answer[1].decode('utf8'))
+
+
+def measure(function, kafka, rkvs, repetitions):
+    times = []
+    for i in range(repetitions):
+        t0 = time.perf_counter()
+        assert function(kafka, rkvs) == 7
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='request/reply latency benchmark')
+    parser.add_argument('--redis', default=None, help='host of a real redis server to use for replies')
+    parser.add_argument('--service', type=float, default=0.005, help='time in seconds the worker spends answering [0.005]')
+    parser.add_argument('-n', type=int, default=10, help='number of requests of each kind [10]')
+    args = parser.parse_args()
+
+    if args.redis is not None:
+        import redis
+        rkvs = redis.Redis(host=args.redis, port=6379, db=0)
+    else:
+        rkvs = StandInRedis()
+    kafka = queue.Queue()
+    thread = threading.Thread(target=worker, args=(kafka, rkvs, args.service), daemon=True)
+    thread.start()
+
+    for label, function in (('sleep + poll shared key', polled_request),
+                            ('correlated BLPOP reply ', correlated_request)):
+        times = measure(function, kafka, rkvs, args.n)
+        print(f'{label}:  mean {1000*statistics.mean(times):8.1f} ms   '
+              f'max {1000*max(times):8.1f} ms   ({args.n} requests)')
+    kafka.put(None)
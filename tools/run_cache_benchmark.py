@@ -0,0 +1,117 @@
+'''Count Tiled round trips for the consumer-side handling of one XAS
+scan, with and without BMM.run_cache.RunCache.
+
+The access pattern below follows what happens to a single fluorescence
+scan in the file manager and plot manager: XASFile.to_xdi, the parts
+of BMMDossier.write_dossier which look at the run, the XAFSSequence
+merge (Pandrosus.fetch), and BMMDataEvaluation.evaluate.  Tiled is
+replaced by a stand-in catalog which counts requests.
+
+   python run_cache_benchmark.py
+
+'''
+import os, sys
+import numpy, xarray
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup'))
+from BMM.run_cache import RunCache
+
+NPTS = 400
+PRIMARY  = ['dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', 'I0', 'It', 'Ir',
+            'Fe1', 'Fe2', 'Fe3', 'Fe4', 'Fe5', 'Fe6', 'Fe7']
+BASELINE = ['dcm_x', 'm2_vertical', 'm2_pitch', 'm3_pitch', 'm3_vertical', 'm3_lateral', 'xafs_x', 'xafs_y']
+
+
+class Counter():
+    requests = 0
+
+
+class StandInStream():
+    def __init__(self, names, npts):
+        self.ds = xarray.Dataset({n: ('time', numpy.random.random(npts)) for n in names},
+                                 coords={'time': 1.7e9 + numpy.arange(npts, dtype=float)})
+    def read(self, variables=None):
+        Counter.requests += 1
+        if variables is None:
+            return self.ds
+        return self.ds[variables]
+    @property
+    def data(self):
+        return StandInData(self)
+    def __getitem__(self, key):
+        return StandInData(self)
+
+
+class StandInData():
+    def __init__(self, stream):
+        self.stream = stream
+    def __getitem__(self, key):
+        Counter.requests += 1
+        return numpy.asarray(self.stream.ds[key])
+    def keys(self):
+        Counter.requests += 1
+        return list(self.stream.ds.variables)
+
+
+class StandInRun():
+    def __init__(self, uid):
+        Counter.requests += 1
+        self.metadata = {'start': {'uid': uid, 'detectors': ['7-element SDD'], 'plan_name': 'scan_nd xafs fluorescence',
+                                   'XDI': {'Element': {'symbol': 'Fe'}, '_dtc': ['Fe1', 'Fe2', 'Fe3', 'Fe4', 'Fe5', 'Fe6', 'Fe7'],
+                                           '_mode': ['fluorescence']}},
+                         'stop': {'time': 1}}
+        self.primary  = StandInStream(PRIMARY, NPTS)
+        self.baseline = StandInStream(BASELINE, 2)
+    def __getitem__(self, name):
+        return getattr(self, name)
+    def documents(self):
+        Counter.requests += 1
+        return iter([('start', self.metadata['start'])])
+
+
+class StandInCatalog():
+    def __getitem__(self, uid):
+        return StandInRun(uid)
+
+
+def handle_one_scan(catalog, uid):
+    ## XASFile.to_xdi
+    for i in range(4):
+        catalog[uid].metadata['start']   # experiment_folder, plot_hint, ...
+    list(catalog[uid].documents())      # file_resource
+    catalog[uid].primary.read(PRIMARY)
+    ## BMMDossier.write_dossier and friends
+    for i in range(12):
+        catalog[uid].metadata['start']
+    for name in BASELINE[:6]:
+        catalog[uid].baseline.data[name][0]
+    catalog[uid].baseline.read()
+    catalog[uid].baseline.read()
+    list(catalog[uid].documents())
+    len(catalog[uid].primary.data['time'])          # npoints in the dossier
+    numpy.array(catalog[uid].primary.data['time'])  # time stamps for the dossier plots
+    ## Pandrosus.fetch via XAFSSequence.add
+    for i in range(3):
+        catalog[uid].metadata['start']
+    catalog[uid].primary.read()
+    catalog[uid].primary.read(['dcm_energy', 'It', 'Ir'])
+    ## BMMDataEvaluation.evaluate
+    this = catalog[uid]
+    this.metadata['start']
+    this.primary.read()
+
+
+if __name__ == '__main__':
+    uid = 'f00dcafe-0000-0000-0000-000000000000'
+    Counter.requests = 0
+    handle_one_scan(StandInCatalog(), uid)
+    direct = Counter.requests
+
+    Counter.requests = 0
+    cache = RunCache(StandInCatalog())
+    handle_one_scan(cache, uid)
+    cached = Counter.requests
+
+    print(f'Tiled requests without cache: {direct}')
+    print(f'Tiled requests with cache:    {cached}')
+    print(f'cache statistics: {cache.stats()}')
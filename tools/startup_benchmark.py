@@ -0,0 +1,68 @@
+'''Time the imports which dominate starting bsui, each in a fresh
+python process, using python's -X importtime.
+
+By default, the heavy packages pulled in by the profile are timed,
+along with the BMM modules which are now loaded on first use.  Name
+other modules on the command line to time those instead.
+
+   python startup_benchmark.py [module ...]
+
+With --profile, time the whole profile, as bsui loads it, instead.
+That only works on a beamline workstation.  Then startup_report()
+at the bsui prompt says which steps of the profile were slowest.
+
+   python startup_benchmark.py --profile [repeats]
+
+'''
+import os, sys, subprocess, time
+
+STARTUP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup')
+
+MODULES = ('numpy', 'matplotlib.pyplot', 'openpyxl', 'h5py', 'xraylib',
+           'sklearn.ensemble', 'joblib', 'larch', 'larch.xafs', 'databroker',
+           'BMM.periodictable', 'BMM.larch_interface')
+
+
+def import_time(module):
+    '''Return the cumulative import time in seconds of module and the
+    three slowest packages it imports, or None if it cannot be imported.'''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=STARTUP, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative)/1e6, depth, name.strip()))
+    total = sum(t for t, depth, n in rows if depth == 0)
+    slowest = sorted([(t, n) for t, depth, n in rows if depth == 1], reverse=True)
+    return total, slowest[:3]
+
+
+def profile_time(repeats):
+    '''Time loading the profile as bsui does, without showing a prompt.'''
+    code = 'from BMM.user_ns import *'
+    times = []
+    for i in range(repeats):
+        start = time.time()
+        subprocess.run(['ipython', '--no-banner', '-c', code], cwd=STARTUP)
+        times.append(time.time() - start)
+    return times
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--profile':
+        times = profile_time(int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+        print('profile loaded in ' + ', '.join(f'{t:.1f}' for t in times) + ' seconds')
+        sys.exit()
+    print(f'{"module":24} {"seconds":>8}   slowest imports')
+    for module in sys.argv[1:] or MODULES:
+        result = import_time(module)
+        if result is None:
+            print(f'{module:24} {"--":>8}   (cannot be imported here)')
+            continue
+        total, slowest = result
+        print(f'{module:24} {total:8.2f}   ' + ', '.join(f'{n} {t:.2f}' for t, n in slowest))
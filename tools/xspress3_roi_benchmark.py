@@ -0,0 +1,79 @@
+'''Time BMM.xspress3_roi.roi_sums against a point-by-point reduction
+of an Xspress3 HDF5 file.
+
+A synthetic file is written with the layout of the Xspress3 HDF5
+plugin: a (npoints, nchannels, 4096) dataset of float64 spectra, one
+point per chunk, plus per-point dead-time factors.  The default size
+is about 2 GB, use the first argument to change it.  A contiguous copy
+is also timed, as that one is memory-mapped.
+
+   python xspress3_roi_benchmark.py [gigabytes] [folder]
+
+'''
+import os, sys, time, tempfile
+import numpy, h5py
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup'))
+from BMM.xspress3_roi import roi_sums, DATASET, NDATTRS
+
+NCHANNELS = 7
+NBINS     = 4096
+ROIS      = {'Fe': (626, 654), 'Fe wide': (616, 664), 'Mn': (578, 602), 'Cr': (531, 553), 'OCR': (1, 4095)}
+
+
+def make_file(filename, npoints, chunked=True):
+    rng = numpy.random.default_rng(0)
+    with h5py.File(filename, 'w') as f:
+        dset = f.create_dataset(DATASET, shape=(npoints, NCHANNELS, NBINS), dtype='<f8',
+                                chunks=(1, NCHANNELS, NBINS) if chunked else None)
+        block = 256
+        for first in range(0, npoints, block):
+            last = min(first+block, npoints)
+            dset[first:last] = rng.poisson(5, size=(last-first, NCHANNELS, NBINS))
+        for ch in range(1, NCHANNELS+1):
+            f.create_dataset(f'{NDATTRS}/CHAN{ch}DTFACTOR', data=1 + 0.05*rng.random(npoints))
+
+
+def point_by_point(filename):
+    '''The obvious way: one point, one channel, one ROI at a time.'''
+    results = {name: [] for name in ROIS}
+    with h5py.File(filename, 'r') as f:
+        dset = f[DATASET]
+        dtc = numpy.array([f[f'{NDATTRS}/CHAN{ch}DTFACTOR'][:] for ch in range(1, NCHANNELS+1)]).T
+        for i in range(dset.shape[0]):
+            spectra = dset[i]
+            for name, (low, high) in ROIS.items():
+                results[name].append([spectra[ch, low:high].sum() * dtc[i, ch] for ch in range(NCHANNELS)])
+    return {name: numpy.array(v) for name, v in results.items()}
+
+
+def timeit(label, func, size):
+    start = time.time()
+    result = func()
+    elapsed = time.time() - start
+    print(f'   {label:32} {elapsed:7.1f} s   {size/elapsed/2**20:7.1f} MB/s')
+    return result
+
+
+if __name__ == '__main__':
+    gigabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    folder    = sys.argv[2] if len(sys.argv) > 2 else tempfile.gettempdir()
+    npoints   = int(gigabytes * 2**30 / (NCHANNELS * NBINS * 8))
+    size      = npoints * NCHANNELS * NBINS * 8
+    chunked    = os.path.join(folder, 'xspress3_roi_benchmark_chunked.h5')
+    contiguous = os.path.join(folder, 'xspress3_roi_benchmark_contiguous.h5')
+    try:
+        print(f'writing {npoints} points ({size/2**30:.1f} GB) to {folder}')
+        make_file(chunked, npoints, chunked=True)
+        make_file(contiguous, npoints, chunked=False)
+        print(f'{len(ROIS)} ROIs x {NCHANNELS} channels:')
+        slow = timeit('point by point (chunked)', lambda: point_by_point(chunked), size)
+        fast = timeit('roi_sums (chunked)', lambda: roi_sums(chunked, ROIS), size)
+        mapped = timeit('roi_sums (contiguous, mmap)', lambda: roi_sums(contiguous, ROIS), size)
+        for name in ROIS:
+            assert numpy.allclose(slow[name], fast[name]) and numpy.allclose(slow[name], mapped[name]), name
+        print('   results agree')
+    finally:
+        for f in (chunked, contiguous):
+            if os.path.isfile(f):
+                os.remove(f)